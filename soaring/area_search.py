@@ -1,11 +1,29 @@
-import sys
+import os
+import argparse
 import json
-import requests
-import datetime
 import csv
 import pickle
 import time
+import itertools
+import concurrent.futures
+import numpy as np
+import shapely
+from shapely import STRtree
 from shapely.geometry import shape, Polygon, MultiPolygon
+from geojson_archive import GeojsonArchiveWriter
+import otp_client
+import isochrone_codec
+import reachability_index
+import population_coverage
+
+
+REQUEST_WORKERS = 8  # OTPへの同時リクエスト数
+REQUEST_WINDOW_FACTOR = 2  # 投入しておく問い合わせの数の上限（同時リクエスト数に対する倍率）
+PROCESS_WORKERS = os.cpu_count() or 4  # メッシュ交差判定を行うプロセス数
+UNREACHABLE = np.iinfo(np.uint8).max  # 到達できないメッシュの時間区分
+MESH_INDEX_MODE = "polygon"  # メッシュの交差判定方式（polygon または raster）
+MESH_LAT_DIVISIONS = 480  # 緯度1度あたりの5次メッシュ数（7.5秒）
+MESH_LON_DIVISIONS = 320  # 経度1度あたりの5次メッシュ数（11.25秒）
 
 
 class Mesh:
@@ -15,6 +33,203 @@ class Mesh:
         self.population = feature["population"]
 
 
+class MeshIndex:
+    """メッシュのジオメトリに対する空間インデックス（読み込み時に一度だけ構築する）"""
+
+    def __init__(self, mesh_list: list[Mesh]):
+        self.mesh_list = mesh_list
+        self.mesh_codes = [mesh.mesh_code for mesh in mesh_list]
+        self.geometries = np.array([mesh.geometry for mesh in mesh_list], dtype=object)
+        self.tree = STRtree(self.geometries)
+
+    def query(self, geometry, candidates: np.ndarray = None) -> np.ndarray:
+        """
+        geometryと交差するメッシュのインデックスを昇順で返す。
+        candidatesが与えられた場合はその中からのみ探す。
+        """
+        shapely.prepare(geometry)
+        if candidates is None:
+            indices = self.tree.query(geometry, predicate="intersects")
+        else:
+            mask = shapely.intersects(geometry, self.geometries[candidates])
+            indices = candidates[mask]
+        return np.sort(indices)
+
+    def query_bbox(self, geometry) -> np.ndarray:
+        """geometryの外接矩形と交差するメッシュのインデックスを昇順で返す"""
+        return np.sort(self.tree.query(geometry))
+
+    def to_mesh_codes(self, indices: np.ndarray) -> set[str]:
+        return {self.mesh_codes[i] for i in indices}
+
+
+class RasterMeshIndex:
+    """
+    5次メッシュ（250m）の格子に揃えたビットマップで交差判定を行うインデックス。
+    MeshIndexと同じインターフェースを持つ。
+
+    到達圏が掛かるセルは、中心が到達圏の内側にあるセルと、到達圏の境界（辺）が通るセルの和とする。
+    一部でも到達圏に掛かるセルは必ずどちらかに含まれるため、結果はポリゴンでの判定と一致する
+    （到達圏の辺が格子線にちょうど重なる場合は、接するだけのセルも含める。ポリゴンでの判定では
+    メッシュの座標の丸め誤差によって含まれないことがある）。格子の行・列からメッシュへの対応表は構築時に一度だけ作り、
+    判定の計算量はメッシュ全体の数ではなく到達圏の外接矩形に掛かるセル数に比例する。
+    """
+
+    EPS = 1e-9  # 格子線上の点を両側のセルに含めるための幅[セル]
+
+    def __init__(self, mesh_list: list[Mesh]):
+        self.mesh_list = mesh_list
+        self.mesh_codes = [mesh.mesh_code for mesh in mesh_list]
+
+        # 南西端の座標から格子上の行・列を求める
+        bounds = np.array([mesh.geometry.bounds for mesh in mesh_list]).reshape(-1, 4)
+        rows = np.rint(bounds[:, 1] * MESH_LAT_DIVISIONS).astype(np.int64)
+        cols = np.rint(bounds[:, 0] * MESH_LON_DIVISIONS).astype(np.int64)
+        self.row_origin = int(rows.min()) if len(rows) else 0
+        self.col_origin = int(cols.min()) if len(cols) else 0
+        self.mesh_rows = rows - self.row_origin
+        self.mesh_cols = cols - self.col_origin
+        self.n_rows = int(self.mesh_rows.max()) + 1 if len(rows) else 0
+        self.n_cols = int(self.mesh_cols.max()) + 1 if len(cols) else 0
+
+        # (行, 列) からメッシュのインデックスへの対応表（メッシュのないセルは-1）
+        self.cell_to_mesh = np.full((self.n_rows, self.n_cols), -1, dtype=np.int64)
+        self.cell_to_mesh[self.mesh_rows, self.mesh_cols] = np.arange(len(mesh_list))
+
+    def _to_grid(self, lon: np.ndarray, lat: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """経度・緯度をセル単位の格子座標に変換する"""
+        x = lon * MESH_LON_DIVISIONS - self.col_origin
+        y = lat * MESH_LAT_DIVISIONS - self.row_origin
+        return x, y
+
+    def _window(self, geometry) -> tuple[int, int, int, int]:
+        """geometryの外接矩形に（辺で接するものも含めて）掛かるセルの範囲 (行0, 列0, 行数, 列数)"""
+        min_lon, min_lat, max_lon, max_lat = geometry.bounds
+        min_x, min_y = self._to_grid(min_lon, min_lat)
+        max_x, max_y = self._to_grid(max_lon, max_lat)
+        row0 = min(max(int(np.floor(min_y - self.EPS)), 0), self.n_rows)
+        col0 = min(max(int(np.floor(min_x - self.EPS)), 0), self.n_cols)
+        row1 = min(max(int(np.floor(max_y + self.EPS)) + 1, 0), self.n_rows)
+        col1 = min(max(int(np.floor(max_x + self.EPS)) + 1, 0), self.n_cols)
+        return row0, col0, max(row1 - row0, 0), max(col1 - col0, 0)
+
+    def rasterize(self, geometry) -> tuple[np.ndarray, int, int]:
+        """
+        geometryが掛かるセルをTrueとするビットマップを返す。
+        ビットマップはgeometryの外接矩形に掛かる範囲だけを対象とし、
+        その範囲の先頭の行・列と合わせて返す。
+        """
+        if geometry.is_empty:
+            return np.zeros((0, 0), dtype=bool), 0, 0
+        row0, col0, n_rows, n_cols = self._window(geometry)
+        if n_rows <= 0 or n_cols <= 0:
+            return np.zeros((0, 0), dtype=bool), row0, col0
+
+        rings = shapely.get_rings(shapely.get_parts(geometry))
+        coords, ring_ids = shapely.get_coordinates(rings, return_index=True)
+        x, y = self._to_grid(coords[:, 0], coords[:, 1])
+        x -= col0
+        y -= row0
+
+        # 同じリング内で隣り合う頂点を結ぶ辺
+        same_ring = ring_ids[:-1] == ring_ids[1:]
+        x0, y0 = x[:-1][same_ring], y[:-1][same_ring]
+        x1, y1 = x[1:][same_ring], y[1:][same_ring]
+
+        # 中心が内側にあるセル: 各辺が横切るセル中心の行で、交点より右にある最初の列で偶奇を反転させ、
+        # 行方向に累積して内外判定する（行jのセル中心は j + 0.5）
+        y_lo = np.minimum(y0, y1)
+        y_hi = np.maximum(y0, y1)
+        row_start = np.clip(np.ceil(y_lo - 0.5), 0, n_rows).astype(np.int64)
+        row_stop = np.clip(np.ceil(y_hi - 0.5), 0, n_rows).astype(np.int64)
+        edge_ids, center_rows = _expand_ranges(row_start, row_stop)
+        yc = center_rows + 0.5
+        ex0, ey0 = x0[edge_ids], y0[edge_ids]
+        xc = ex0 + (yc - ey0) * (x1[edge_ids] - ex0) / (y1[edge_ids] - ey0)
+        center_cols = np.clip(np.floor(xc - 0.5).astype(np.int64) + 1, 0, n_cols)
+        toggles = np.zeros((n_rows, n_cols + 1), dtype=bool)
+        np.logical_xor.at(toggles, (center_rows, center_cols), True)
+        bitmap = np.logical_xor.accumulate(toggles, axis=1)[:, :n_cols]
+
+        # 境界が通るセル: 辺の端点と、辺が格子線と交わる点を含むセル（格子線上の点は両側のセル）
+        dx = x1 - x0
+        dy = y1 - y0
+        # 格子線と平行な辺は交点を求めない（その辺が通るセルは端点と、もう一方の向きの交点で分かる）
+        col_start = np.ceil(np.minimum(x0, x1)).astype(np.int64)
+        col_stop = np.where(dx != 0, np.floor(np.maximum(x0, x1)).astype(np.int64) + 1, col_start)
+        edge_ids, line_x = _expand_ranges(col_start, col_stop)
+        line_x = line_x.astype(np.float64)
+        cross_y = y0[edge_ids] + (line_x - x0[edge_ids]) * dy[edge_ids] / dx[edge_ids]
+        row_start = np.ceil(np.minimum(y0, y1)).astype(np.int64)
+        row_stop = np.where(dy != 0, np.floor(np.maximum(y0, y1)).astype(np.int64) + 1, row_start)
+        edge_ids, line_y = _expand_ranges(row_start, row_stop)
+        line_y = line_y.astype(np.float64)
+        cross_x = x0[edge_ids] + (line_y - y0[edge_ids]) * dx[edge_ids] / dy[edge_ids]
+        px = np.concatenate([x, line_x, cross_x])
+        py = np.concatenate([y, cross_y, line_y])
+        for offset_x, offset_y in ((-1, -1), (-1, 1), (1, -1), (1, 1)):
+            point_rows = np.floor(py + offset_y * self.EPS).astype(np.int64)
+            point_cols = np.floor(px + offset_x * self.EPS).astype(np.int64)
+            in_window = (
+                (point_rows >= 0)
+                & (point_rows < n_rows)
+                & (point_cols >= 0)
+                & (point_cols < n_cols)
+            )
+            bitmap[point_rows[in_window], point_cols[in_window]] = True
+        return bitmap, row0, col0
+
+    def query(self, geometry, candidates: np.ndarray = None) -> np.ndarray:
+        """
+        geometryが掛かるメッシュのインデックスを昇順で返す。
+        candidatesが与えられた場合はその中からのみ探す。
+        """
+        bitmap, row0, col0 = self.rasterize(geometry)
+        if candidates is None:
+            window = self.cell_to_mesh[
+                row0 : row0 + bitmap.shape[0], col0 : col0 + bitmap.shape[1]
+            ]
+            indices = window[bitmap]
+            return np.sort(indices[indices >= 0])
+        rows = self.mesh_rows[candidates] - row0
+        cols = self.mesh_cols[candidates] - col0
+        in_window = (
+            (rows >= 0) & (rows < bitmap.shape[0]) & (cols >= 0) & (cols < bitmap.shape[1])
+        )
+        hits = np.zeros(len(candidates), dtype=bool)
+        hits[in_window] = bitmap[rows[in_window], cols[in_window]]
+        return candidates[hits]
+
+    def query_bbox(self, geometry) -> np.ndarray:
+        """geometryの外接矩形と交差するメッシュのインデックスを昇順で返す"""
+        if geometry.is_empty:
+            return np.zeros(0, dtype=np.int64)
+        row0, col0, n_rows, n_cols = self._window(geometry)
+        window = self.cell_to_mesh[row0 : row0 + n_rows, col0 : col0 + n_cols]
+        indices = window[window >= 0]
+        return np.sort(indices)
+
+    def to_mesh_codes(self, indices: np.ndarray) -> set[str]:
+        return {self.mesh_codes[i] for i in indices}
+
+
+def _expand_ranges(starts: np.ndarray, stops: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """各範囲 [starts[i], stops[i]) を展開し、(範囲の番号, 値) の配列の組を返す"""
+    counts = np.maximum(stops - starts, 0)
+    ids = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return ids, starts[ids] + offsets
+
+
+def make_mesh_index(mesh_list: list[Mesh], mode: str = MESH_INDEX_MODE):
+    """交差判定方式に応じたメッシュのインデックスを作成する"""
+    if mode == "polygon":
+        return MeshIndex(mesh_list)
+    if mode == "raster":
+        return RasterMeshIndex(mesh_list)
+    raise ValueError(f"unknown mesh index mode: {mode}")
+
+
 class Geojson:
     def __init__(
         self,
@@ -45,51 +260,54 @@ def load_population_mesh(input_path: str) -> list[Mesh]:
     return mesh_list
 
 
-def load_all_spots(
+def load_spot_groups(
     input_combus_stpops_json_path: str, input_toyama_spot_list_json_path: str
-) -> list[dict]:
-    """スポット情報を読み込み、結合してリストとして返す"""
+) -> dict[str, list[dict]]:
+    """スポット情報を読み込み、種別（入力JSONのキー）ごとのリストを結合した辞書として返す"""
     with open(input_combus_stpops_json_path, "r") as f:
         combus_stop_list_dict = json.load(f)
     with open(input_toyama_spot_list_json_path, "r") as f:
         toyama_spot_list_dict = json.load(f)
-    merged_spot_list_dict = combus_stop_list_dict | toyama_spot_list_dict
+    return combus_stop_list_dict | toyama_spot_list_dict
+
+
+def load_all_spots(
+    input_combus_stpops_json_path: str, input_toyama_spot_list_json_path: str
+) -> list[dict]:
+    """スポット情報を読み込み、結合してリストとして返す"""
+    merged_spot_list_dict = load_spot_groups(
+        input_combus_stpops_json_path, input_toyama_spot_list_json_path
+    )
     return [spot for spots in merged_spot_list_dict.values() for spot in spots]
 
 
 def find_intersecting_meshes(
-    multi_polygon: MultiPolygon, mesh_list: list[Mesh]
+    multi_polygon: MultiPolygon, mesh_index: MeshIndex
 ) -> set[str]:
     """GeoJSONと交差するメッシュコードの集合を返す"""
-    mesh_codes = set()
-    for mesh in mesh_list:
-        if multi_polygon.intersects(mesh.geometry):
-            mesh_codes.add(mesh.mesh_code)
-    return mesh_codes
+    return mesh_index.to_mesh_codes(mesh_index.query(multi_polygon))
 
 
 def request_to_otp(spot: dict, time_limits: list, walk_distance_limit: int) -> dict:
-    """Open Trip Plannerで到達圏探索を実行する"""
+    """
+    Open Trip Plannerで到達圏探索を実行する。
+    再試行しても失敗した場合は、到達圏が欠けたまま出力しないよう OtpError を送出する。
+    """
     lat = spot["lat"]
     lon = spot["lon"]
-    host = "http://localhost:8080"
-    path = "/otp/routers/default/isochrone"
-
-    # 現在の日付を取得してMM-DD-YYYYフォーマットに変換
-    current_date = datetime.datetime.now().strftime("%m-%d-%Y")
 
     params = {
         "fromPlace": f"{lat},{lon}",
         "mode": "WALK,TRANSIT",
-        "date": current_date,
+        "date": otp_client.service_date(),
         "time": "10:00am",
         "maxWalkDistance": f"{walk_distance_limit}",
+        "cutoffSec": list(time_limits),
     }
-    url = f"{host}{path}?{'&'.join([f'{k}={v}' for k, v in params.items()])}"
-    for time_limit in time_limits:
-        url += f"&cutoffSec={time_limit}"
-    response = requests.get(url)
-    return response.json()
+    result = otp_client.get_client().isochrone(params)
+    if not result.ok:
+        raise otp_client.OtpError(result)
+    return result.data
 
 
 def calc_geojson_list(
@@ -116,91 +334,335 @@ def calc_geojson_list(
     return geojson_list
 
 
-def calc_and_update_reachable_meshs(
-    geojson_list: list[Geojson], all_mesh_list: list[Mesh]
-) -> set[str]:
-    """各GeoJSONに対して到達可能なメッシュコードを計算し、GeoJSONオブジェクトを更新する"""
-    # 高速化のため、最初に一番大きなGeojsonを計算
-    max_geojson = geojson_list[-1]
-    reachable_mesh_code_set = find_intersecting_meshes(
-        shape(max_geojson.geometry), all_mesh_list
+def calc_first_reachable_times(
+    walk_geojson_lists: list[list[Geojson]], time_limits: list, mesh_index: MeshIndex
+) -> np.ndarray:
+    """
+    徒歩距離ごと・メッシュごとに、到達可能となる最小の時間区分（time_limitsの
+    インデックス）を計算する。到達できないメッシュはUNREACHABLEとなる。
+
+    到達可能性は時間・徒歩距離の両方について単調なので、
+    - 時間の大きい方から順に、一つ大きい時間で到達できたメッシュだけを候補とし、
+    - 一つ短い徒歩距離で同じ時間内に到達できたメッシュは判定せずに到達可能とする。
+    これにより交差判定は到達圏の境界付近のメッシュに対してだけ行われる。
+    """
+    time_to_index = {time_limit // 60: i for i, time_limit in enumerate(time_limits)}
+    first_times = np.full(
+        (len(walk_geojson_lists), len(mesh_index.mesh_codes)),
+        UNREACHABLE,
+        dtype=np.uint8,
     )
-    geojson_list[-1].reachable_mesh_codes = reachable_mesh_code_set
-
-    # 二番目以降のGeojsonについては、最大geojsonで到達できたメッシュだけを探す
-    max_geojson_reachable_mesh_list = [
-        mesh for mesh in all_mesh_list if mesh.mesh_code in reachable_mesh_code_set
-    ]
-    for geojson in geojson_list[:-1]:
-        assert geojson.geometry
-        reachable_meshes = find_intersecting_meshes(
-            shape(geojson.geometry), max_geojson_reachable_mesh_list
-        )
-        geojson.reachable_mesh_codes.update(reachable_meshes)
-    return reachable_mesh_code_set
+    for walk_index, geojson_list in enumerate(walk_geojson_lists):
+        candidates = None
+        for geojson in reversed(geojson_list):
+            time_index = time_to_index[geojson.time_limit_min]
+            geometry = shape(geojson.geometry)
+            if candidates is None:
+                candidates = mesh_index.query_bbox(geometry)
+
+            if walk_index == 0:
+                reachable = mesh_index.query(geometry, candidates)
+            else:
+                # 集合演算（ソート・ハッシュ）を避け、メッシュ数の真偽値配列で和・差をとる
+                reachable_mask = first_times[walk_index - 1] <= time_index
+                boundary = candidates[~reachable_mask[candidates]]
+                reachable_mask[mesh_index.query(geometry, boundary)] = True
+                reachable = np.flatnonzero(reachable_mask)
+
+            first_times[walk_index, reachable] = time_index
+            candidates = reachable
+    return first_times
+
+
+def update_reachable_mesh_codes(
+    walk_geojson_lists: list[list[Geojson]],
+    first_times: np.ndarray,
+    time_limits: list,
+    mesh_codes: list[str],
+):
+    """最小到達時間区分の行列から、各GeoJSONの到達可能なメッシュコードを導出する"""
+    time_to_index = {time_limit // 60: i for i, time_limit in enumerate(time_limits)}
+    for walk_index, geojson_list in enumerate(walk_geojson_lists):
+        for geojson in geojson_list:
+            time_index = time_to_index[geojson.time_limit_min]
+            reachable = np.flatnonzero(first_times[walk_index] <= time_index)
+            geojson.reachable_mesh_codes = {mesh_codes[i] for i in reachable}
 
 
-def exec_single_spot(
-    spot: dict, all_mesh_list: list[Mesh]
-) -> tuple[list[Geojson], set[str]]:
-    # 時間制限リストの作成
+def make_time_limits() -> list[int]:
+    """時間制限リスト[秒]を作成する"""
     time_trial_num = 25
-    time_limits = [i * 60 * 5 for i in range(1, time_trial_num)]
+    return [i * 60 * 5 for i in range(1, time_trial_num)]
+
 
-    # 徒歩距離リストの作成
+def make_walk_distance_limits() -> list[int]:
+    """徒歩距離リスト[m]を作成する"""
     walk_distance_trial_num = 21
-    walk_distance_limits = [i * 50 for i in range(1, walk_distance_trial_num)]
+    return [i * 50 for i in range(1, walk_distance_trial_num)]
+
+
+def parse_isochrone(
+    response_json: dict, time_limits: list, spot_id: str, walk_distance_limit: int
+) -> list[Geojson]:
+    """到達圏探索のレスポンスからGeoJSONリストを作成する"""
+    time_to_geometry_dict = {}
+    for i in range(len(time_limits)):
+        feature = response_json["features"][i]
+        if not feature["geometry"]:
+            continue
+        geometry = feature["geometry"]
+        time = int(feature["properties"]["time"])
+        time_to_geometry_dict[time] = geometry
+
+    return calc_geojson_list(
+        time_limits, time_to_geometry_dict, spot_id, walk_distance_limit
+    )
 
-    all_geojson_list = []
+
+def exec_single_spot(
+    spot: dict, mesh_index: MeshIndex
+) -> tuple[list[Geojson], np.ndarray]:
+    time_limits = make_time_limits()
+    walk_distance_limits = make_walk_distance_limits()
+
+    walk_geojson_lists = []
     for walk_distance_limit in walk_distance_limits:
         # Open Trip Plannerに問い合わせ
         response_json = request_to_otp(spot, time_limits, walk_distance_limit)
-        time_to_geometry_dict = {}
-        for i in range(time_trial_num - 1):
-            # print(f"------{walk_distance_limit}--------")
-            # print(response_json)
-            feature = response_json["features"][i]
-            if not feature["geometry"]:
-                continue
-            geometry = feature["geometry"]
-            time = int(feature["properties"]["time"])
-            time_to_geometry_dict[time] = geometry
 
         # GeoJSONリストを計算
-        geojson_list = calc_geojson_list(
-            time_limits, time_to_geometry_dict, spot["id"], walk_distance_limit
+        walk_geojson_lists.append(
+            parse_isochrone(response_json, time_limits, spot["id"], walk_distance_limit)
         )
-        if not geojson_list:
-            continue
-        calc_and_update_reachable_meshs(geojson_list, all_mesh_list)
-        all_geojson_list.extend(geojson_list)
 
-    return all_geojson_list
+    first_times = calc_first_reachable_times(
+        walk_geojson_lists, time_limits, mesh_index
+    )
+    update_reachable_mesh_codes(
+        walk_geojson_lists, first_times, time_limits, mesh_index.mesh_codes
+    )
+    all_geojson_list = [
+        geojson for geojson_list in walk_geojson_lists for geojson in geojson_list
+    ]
+    return all_geojson_list, first_times
+
+
+_worker_mesh_index = None
+
+
+def _init_mesh_worker(input_population_mesh_json_path: str, mesh_index_mode: str):
+    """交差判定用のワーカープロセスでメッシュを読み込み、インデックスを構築する"""
+    global _worker_mesh_index
+    _worker_mesh_index = make_mesh_index(
+        load_population_mesh(input_population_mesh_json_path), mesh_index_mode
+    )
+
+
+def _calc_first_reachable_times_in_worker(
+    walk_geojson_lists: list[list[Geojson]], time_limits: list
+) -> np.ndarray:
+    """ワーカープロセスでスポット一つ分の最小到達時間区分の行列を計算する"""
+    return calc_first_reachable_times(
+        walk_geojson_lists, time_limits, _worker_mesh_index
+    )
+
+
+def exec_all_spots(
+    all_spot_list: list[dict],
+    input_population_mesh_json_path: str,
+    mesh_codes: list[str],
+    request_workers: int = REQUEST_WORKERS,
+    process_workers: int = PROCESS_WORKERS,
+    mesh_index_mode: str = MESH_INDEX_MODE,
+) -> tuple[list[Geojson], np.ndarray]:
+    """
+    すべてのスポット×徒歩距離について到達圏探索を行う。
+    OTPへの問い合わせはスレッドプールで複数同時に行い（未完了の問い合わせは
+    request_workers × REQUEST_WINDOW_FACTOR 件まで）、スポットの応答が揃ったものから
+    同じ完了待ちのループでプロセスプールに交差判定を投入することで、通信待ちとCPU処理を重ね合わせる。
+    問い合わせ・交差判定のいずれかが失敗した場合は、未実行のものを取り消して例外を送出する。
+    GeoJSONはexec_single_spotを順に実行した場合と同じ順序で返し、
+    最小到達時間区分の行列は(スポット, 徒歩距離, メッシュ)の形で返す。
+    mesh_codes は input_population_mesh_json_path のメッシュの並び（交差判定はワーカーが読み込んで行う）。
+    """
+    time_limits = make_time_limits()
+    walk_distance_limits = make_walk_distance_limits()
+
+    spot_walk_geojson_lists = [
+        [None] * len(walk_distance_limits) for _ in all_spot_list
+    ]
+    remaining_walks = [len(walk_distance_limits)] * len(all_spot_list)
+    first_times_list = [None] * len(all_spot_list)
+    total_spots = len(all_spot_list)
+    processed = 0
+    requests_to_submit = (
+        (spot_index, walk_index)
+        for spot_index in range(total_spots)
+        for walk_index in range(len(walk_distance_limits))
+    )
+    request_window = request_workers * REQUEST_WINDOW_FACTOR
+    with concurrent.futures.ThreadPoolExecutor(
+        max_workers=request_workers
+    ) as request_executor, concurrent.futures.ProcessPoolExecutor(
+        max_workers=process_workers,
+        initializer=_init_mesh_worker,
+        initargs=(input_population_mesh_json_path, mesh_index_mode),
+    ) as mesh_executor:
+        request_futures = {}  # 未完了の問い合わせ -> (スポット, 徒歩距離)
+        mesh_futures = {}  # 未完了の交差判定 -> スポット
+
+        def submit_requests():
+            for spot_index, walk_index in itertools.islice(
+                requests_to_submit, request_window - len(request_futures)
+            ):
+                future = request_executor.submit(
+                    request_to_otp,
+                    all_spot_list[spot_index],
+                    time_limits,
+                    walk_distance_limits[walk_index],
+                )
+                request_futures[future] = (spot_index, walk_index)
+
+        def on_request_done(future):
+            spot_index, walk_index = request_futures.pop(future)
+            spot_walk_geojson_lists[spot_index][walk_index] = parse_isochrone(
+                future.result(),
+                time_limits,
+                all_spot_list[spot_index]["id"],
+                walk_distance_limits[walk_index],
+            )
+            remaining_walks[spot_index] -= 1
+            if remaining_walks[spot_index] == 0:
+                # スポットの全徒歩距離の応答が揃ったら交差判定を行う
+                mesh_future = mesh_executor.submit(
+                    _calc_first_reachable_times_in_worker,
+                    spot_walk_geojson_lists[spot_index],
+                    time_limits,
+                )
+                mesh_futures[mesh_future] = spot_index
+
+        def on_mesh_done(future):
+            spot_index = mesh_futures.pop(future)
+            first_times_list[spot_index] = future.result()
+            update_reachable_mesh_codes(
+                spot_walk_geojson_lists[spot_index],
+                first_times_list[spot_index],
+                time_limits,
+                mesh_codes,
+            )
+
+        try:
+            submit_requests()
+            while request_futures or mesh_futures:
+                done, _ = concurrent.futures.wait(
+                    [*request_futures, *mesh_futures],
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future in request_futures:
+                        on_request_done(future)
+                    else:
+                        on_mesh_done(future)
+                        # 進捗を出力
+                        processed += 1
+                        progress = (processed / total_spots) * 100
+                        print(f"Progress: {progress:.1f}% ({processed}/{total_spots})", end="\r")
+                submit_requests()
+        except BaseException:
+            # 未実行の問い合わせ・交差判定を取り消す（実行中のものは終わるのを待つ）
+            request_executor.shutdown(wait=False, cancel_futures=True)
+            mesh_executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    print()
+
+    all_geojson_list = [
+        geojson
+        for walk_geojson_lists in spot_walk_geojson_lists
+        for geojson_list in walk_geojson_lists
+        for geojson in geojson_list
+    ]
+    first_times = np.zeros(
+        (total_spots, len(walk_distance_limits), len(mesh_codes)), dtype=np.uint8
+    )
+    for spot_index, spot_first_times in enumerate(first_times_list):
+        first_times[spot_index] = spot_first_times
+    return all_geojson_list, first_times
+
+
+def write_first_reachable_times(
+    first_times: np.ndarray,
+    spot_list: list[dict],
+    mesh_list: list[Mesh],
+    output_path: str,
+):
+    """最小到達時間区分の行列を、軸のラベルと合わせてファイルに書き出す"""
+    np.savez(
+        output_path,
+        first_times=first_times,
+        spot_ids=np.array([spot["id"] for spot in spot_list]),
+        mesh_codes=np.array([mesh.mesh_code for mesh in mesh_list]),
+        time_limits_min=np.array([t // 60 for t in make_time_limits()]),
+        walk_distances_m=np.array(make_walk_distance_limits()),
+    )
+
+
+def load_first_reachable_times(input_path: str) -> dict:
+    """write_first_reachable_timesで書き出した行列とラベルを読み込む"""
+    with np.load(input_path) as data:
+        return {key: data[key] for key in data.files}
+
+
+def to_feature(geojson: Geojson) -> dict:
+    """GeoJSONオブジェクトを出力用のFeatureに変換する"""
+    return {
+        "type": "Feature",
+        "properties": {"reachable-mesh": list(geojson.reachable_mesh_codes)},
+        "geometry": geojson.geometry,
+    }
 
 
 def write_geojsons(
     geojson_list: list[Geojson],
-    output_geojson_dir_path: str,
-    output_geojson_txt_dir_path: str,
+    output_geojson_dir_path: str = None,
+    output_geojson_txt_dir_path: str = None,
+    delta_encode: bool = False,
 ):
-    """GeoJSONリストをファイルに書き出す"""
+    """
+    GeoJSONリストを到達圏ごとの個別ファイル（従来の出力形式）に書き出す。
+    .bin は output_geojson_dir_path、.json は output_geojson_txt_dir_path を指定した場合のみ書き出す。
+    delta_encode の場合、差分で符号化するのは .bin だけで、.json はGeoJSONのまま書き出す
+    """
     for geojson in geojson_list:
-        feature = {
-            "type": "Feature",
-            "properties": {"reachable-mesh": list(geojson.reachable_mesh_codes)},
-            "geometry": geojson.geometry,
-        }
+        feature = to_feature(geojson)
         time_limit_min = geojson.time_limit_min
         walk_distance_m = geojson.walk_distance_m
         id = geojson.id
-        output_path = (
-            f"{output_geojson_dir_path}/{id}_{time_limit_min}_{walk_distance_m}.bin"
-        )
-        output_txt_path = f"{output_geojson_txt_dir_path}/{id}_{time_limit_min}_{walk_distance_m}.json"
-        with open(output_path, "wb") as f:
-            pickle.dump(feature, f)
-        with open(output_txt_path, "w") as f:
-            json.dump(feature, f)
+        if output_geojson_dir_path:
+            bin_feature = isochrone_codec.encode_feature(feature) if delta_encode else feature
+            output_path = (
+                f"{output_geojson_dir_path}/{id}_{time_limit_min}_{walk_distance_m}.bin"
+            )
+            with open(output_path, "wb") as f:
+                pickle.dump(bin_feature, f)
+        if output_geojson_txt_dir_path:
+            output_txt_path = f"{output_geojson_txt_dir_path}/{id}_{time_limit_min}_{walk_distance_m}.json"
+            with open(output_txt_path, "w") as f:
+                json.dump(feature, f)
+
+
+def write_geojson_archive(
+    geojson_list: list[Geojson], output_archive_path: str, delta_encode: bool = False
+):
+    """GeoJSONリストを索引付きの1ファイルのアーカイブに書き出す（GeojsonArchive.getで復号される）"""
+    with GeojsonArchiveWriter(output_archive_path) as writer:
+        for geojson in geojson_list:
+            feature = to_feature(geojson)
+            writer.add(
+                geojson.id,
+                geojson.time_limit_min,
+                geojson.walk_distance_m,
+                isochrone_codec.encode_feature(feature) if delta_encode else feature,
+            )
 
 
 def write_reachable_meshes(
@@ -228,44 +690,137 @@ def main(
     input_combus_stpops_json_path,
     input_toyama_spot_list_json_path,
     input_population_mesh_json_path,
-    output_geojson_dir_path,
-    output_geojson_txt_dir_path,
+    output_geojson_archive_path,
+    output_first_times_path=None,
+    mesh_index_mode=MESH_INDEX_MODE,
+    simplify_tolerance_m=None,
+    delta_encode=False,
+    output_reachability_index_path=None,
+    output_population_coverage_path=None,
+    output_geojson_dir_path=None,
+    output_geojson_txt_dir_path=None,
 ):
-    # データ入力データをロード
-    all_mesh_list = load_population_mesh(input_population_mesh_json_path)
-    all_spot_list = load_all_spots(
+    """
+    到達圏探索を行い、すべてのgeojsonを索引付きの1ファイルのアーカイブに書き出す。
+    到達圏ごとの個別ファイル（従来の出力形式）は、出力先のディレクトリを指定した場合のみ書き出す
+    """
+    # データ入力データをロード（交差判定は各ワーカーがメッシュを読み込んで行う）
+    spot_groups = load_spot_groups(
         input_combus_stpops_json_path, input_toyama_spot_list_json_path
     )
+    all_spot_list = [spot for spots in spot_groups.values() for spot in spots]
+    all_mesh_list = load_population_mesh(input_population_mesh_json_path)
 
     # 到達圏探索を実行しgeojsonを取得
-    geojson_list = []
-    total_spots = len(all_spot_list)
-    for i, spot in enumerate(all_spot_list, 1):
-        geojson_list_tmp = exec_single_spot(spot, all_mesh_list)
-        geojson_list.extend(geojson_list_tmp)
-        # 進捗を出力
-        progress = (i / total_spots) * 100
-        print(f"Progress: {progress:.1f}% ({i}/{total_spots})", end="\r")
-    print()
+    geojson_list, first_times = exec_all_spots(
+        all_spot_list,
+        input_population_mesh_json_path,
+        [mesh.mesh_code for mesh in all_mesh_list],
+        mesh_index_mode=mesh_index_mode,
+    )
+
+    # 出力前に到達圏の形状を簡略化・量子化する（reachable-mesh は元の形状で求めたもの）
+    if simplify_tolerance_m is not None or delta_encode:
+        mesh_index = make_mesh_index(all_mesh_list, mesh_index_mode)
+        report = isochrone_codec.compact_geojsons(
+            geojson_list, mesh_index, simplify_tolerance_m or 0.0, delta_encode
+        )
+        print(isochrone_codec.format_report(report))
 
     # 結果を出力する
-    write_geojsons(geojson_list, output_geojson_dir_path, output_geojson_txt_dir_path)
+    write_geojson_archive(geojson_list, output_geojson_archive_path, delta_encode)
+    for dir_path in (output_geojson_dir_path, output_geojson_txt_dir_path):
+        if dir_path:
+            os.makedirs(dir_path, exist_ok=True)
+    if output_geojson_dir_path or output_geojson_txt_dir_path:
+        write_geojsons(
+            geojson_list, output_geojson_dir_path, output_geojson_txt_dir_path, delta_encode
+        )
+    if output_first_times_path:
+        write_first_reachable_times(
+            first_times, all_spot_list, all_mesh_list, output_first_times_path
+        )
+    if output_reachability_index_path:
+        reachability_index.write_reachability_index(
+            first_times,
+            [spot["id"] for spot in all_spot_list],
+            [mesh.mesh_code for mesh in all_mesh_list],
+            [t // 60 for t in make_time_limits()],
+            make_walk_distance_limits(),
+            output_reachability_index_path,
+        )
+    if output_population_coverage_path:
+        population_coverage.write_population_coverage(
+            first_times,
+            spot_groups,
+            np.array([mesh.population for mesh in all_mesh_list]),
+            [t // 60 for t in make_time_limits()],
+            make_walk_distance_limits(),
+            output_population_coverage_path,
+        )
 
 
 if __name__ == "__main__":
-    input_combus_stpops_json_path = sys.argv[1]
-    input_toyama_spot_list_json_path = sys.argv[2]
-    input_population_mesh_json_path = sys.argv[3]
-    output_geojson_dir_path = sys.argv[4]
-    output_geojson_txt_dir_path = sys.argv[5]
+    parser = argparse.ArgumentParser(description="到達圏探索を行いgeojsonを生成する")
+    parser.add_argument("input_combus_stpops_json_path")
+    parser.add_argument("input_toyama_spot_list_json_path")
+    parser.add_argument("input_population_mesh_json_path")
+    parser.add_argument(
+        "output_geojson_archive_path",
+        help="すべてのgeojsonを索引付きの1ファイルにまとめて書き出すパス",
+    )
+    parser.add_argument("output_first_times_path", nargs="?")
+    parser.add_argument(
+        "--mesh-index",
+        choices=["polygon", "raster"],
+        default=MESH_INDEX_MODE,
+        help="メッシュの交差判定方式（raster は5次メッシュ格子のビットマップで判定する）",
+    )
+    parser.add_argument(
+        "--simplify-tolerance-m",
+        type=float,
+        help="到達圏の形状を位相を保って簡略化する許容誤差[m]（座標はマイクロ度に丸める）",
+    )
+    parser.add_argument(
+        "--delta-encode",
+        action="store_true",
+        help="到達圏の座標をマイクロ度の整数の差分で符号化して .bin とアーカイブに出力する"
+        "（.json はGeoJSONのまま。isochrone_codec.decode_geometryで復元）",
+    )
+    parser.add_argument(
+        "--reachability-index",
+        help="メッシュから到達できるスポットを引く転置索引を書き出すパス",
+    )
+    parser.add_argument(
+        "--population-coverage",
+        help="スポットごと・到達圏ごとのカバー人口の集計表を書き出すパス",
+    )
+    parser.add_argument(
+        "--legacy-geojson-dir",
+        dest="output_geojson_dir_path",
+        help="従来の到達圏ごとのファイル（{id}_{分}_{m}.bin）を書き出すディレクトリ（省略時は書き出さない）",
+    )
+    parser.add_argument(
+        "--legacy-geojson-txt-dir",
+        dest="output_geojson_txt_dir_path",
+        help="従来の到達圏ごとのGeoJSON（{id}_{分}_{m}.json）を書き出すディレクトリ（省略時は書き出さない）",
+    )
+    args = parser.parse_args()
 
     start_time = time.time()
     main(
-        input_combus_stpops_json_path,
-        input_toyama_spot_list_json_path,
-        input_population_mesh_json_path,
-        output_geojson_dir_path,
-        output_geojson_txt_dir_path,
+        args.input_combus_stpops_json_path,
+        args.input_toyama_spot_list_json_path,
+        args.input_population_mesh_json_path,
+        args.output_geojson_archive_path,
+        args.output_first_times_path,
+        args.mesh_index,
+        args.simplify_tolerance_m,
+        args.delta_encode,
+        args.reachability_index,
+        args.population_coverage,
+        args.output_geojson_dir_path,
+        args.output_geojson_txt_dir_path,
     )
     end_time = time.time()
     execution_time = end_time - start_time
@@ -0,0 +1,342 @@
+"""
+OSMの道路網から車の経路を求めるプロセス内ルータ。
+道路網はCSR形式（各ノードから出る辺を連続して並べた配列）のグラフとして保持し、
+辺の重みは道路種別（または maxspeed）から決めた速度での所要時間とする。
+バス停ごとに1回ダイクストラ法で最短経路木を作り、全組み合わせの所要時間・距離・形状を求める。
+
+.osm.pbf の読み込みには pyosmium（pip install osmium）が必要。入っていない場合は .osm（XML）のみ読み込めるため、
+osmium-tool（osmium cat in.osm.pbf -o out.osm）や osmconvert でXMLに変換して渡す。
+"""
+import math
+import heapq
+import xml.etree.ElementTree as ET
+import numpy as np
+import polyline
+
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+EARTH_RADIUS_M = 6_371_000
+KM_PER_MILE = 1.609344
+
+# 道路種別ごとの速度[km/h]。ここにない種別（歩道など）は車が通れないものとして扱う
+HIGHWAY_SPEEDS_KMH = {
+    "motorway": 80,
+    "motorway_link": 40,
+    "trunk": 60,
+    "trunk_link": 40,
+    "primary": 50,
+    "primary_link": 30,
+    "secondary": 40,
+    "secondary_link": 30,
+    "tertiary": 40,
+    "tertiary_link": 30,
+    "unclassified": 30,
+    "residential": 30,
+    "living_street": 10,
+    "service": 15,
+    "road": 20,
+}
+NO_ACCESS_VALUES = {"no", "private"}
+
+
+class Way:
+    def __init__(self, node_refs: list[int], tags: dict):
+        self.node_refs = node_refs
+        self.tags = tags
+
+
+def way_speed_kmh(tags: dict) -> float:
+    """車が通れない道路ならNone"""
+    highway = tags.get("highway")
+    if highway not in HIGHWAY_SPEEDS_KMH:
+        return None
+    if tags.get("access") in NO_ACCESS_VALUES or tags.get("motor_vehicle") in NO_ACCESS_VALUES:
+        return None
+    maxspeed = parse_maxspeed_kmh(tags.get("maxspeed", ""))
+    if maxspeed is not None:
+        return maxspeed
+    return float(HIGHWAY_SPEEDS_KMH[highway])
+
+
+def parse_maxspeed_kmh(value: str) -> float:
+    """maxspeedタグの値を km/h に変換する。単位なしは km/h、"mph" は換算し、それ以外（"signals" など）はNone"""
+    parts = value.strip().split()
+    if not parts or not parts[0].isdigit() or int(parts[0]) <= 0:
+        return None
+    unit = parts[1] if len(parts) > 1 else "km/h"
+    if unit in ("km/h", "kmh", "kph"):
+        return float(parts[0])
+    if unit == "mph":
+        return float(parts[0]) * KM_PER_MILE
+    return None
+
+
+def way_direction(tags: dict) -> int:
+    """1: 順方向のみ, -1: 逆方向のみ, 0: 双方向"""
+    oneway = tags.get("oneway")
+    if oneway in ("yes", "true", "1"):
+        return 1
+    if oneway == "-1":
+        return -1
+    if oneway == "no":
+        return 0
+    if tags.get("highway") == "motorway" or tags.get("junction") == "roundabout":
+        return 1
+    return 0
+
+
+def read_osm_xml(path: str) -> tuple[dict, list[Way]]:
+    """
+    .osm（XML）から 道路のノードID→(緯度, 経度) の辞書と道路のリストを読み込む。
+    ノードはファイル中で道路より前に現れるため、1回目に道路とその構成ノードを、
+    2回目に構成ノードの座標だけを読み込む
+    """
+    ways = []
+    for elem in _iter_osm_elements(path, "way"):
+        tags = {tag.get("k"): tag.get("v") for tag in elem.iter("tag")}
+        if way_speed_kmh(tags) is not None:
+            refs = [int(nd.get("ref")) for nd in elem.iter("nd")]
+            ways.append(Way(refs, tags))
+    road_node_ids = {ref for way in ways for ref in way.node_refs}
+
+    nodes = {}
+    for elem in _iter_osm_elements(path, "node"):
+        node_id = int(elem.get("id"))
+        if node_id in road_node_ids:
+            nodes[node_id] = (float(elem.get("lat")), float(elem.get("lon")))
+    return nodes, ways
+
+
+def _iter_osm_elements(path: str, tag: str):
+    """OSM XMLの最上位の要素のうち tag のものを順に返す。読み終えた要素は根から外して解放する"""
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+    depth = 0
+    for event, elem in context:
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 0:
+            if elem.tag == tag:
+                yield elem
+            root.clear()
+
+
+def check_osm_readable(path: str):
+    """OSMファイルを読み込めるか確認する。.osm.pbf でpyosmiumがなければ、XMLでの指定方法を添えてRuntimeError"""
+    if path.endswith(".pbf") and osmium is None:
+        xml_path = path[: -len(".pbf")] if path.endswith(".osm.pbf") else path + ".osm"
+        raise RuntimeError(
+            f"reading {path} requires pyosmium (pip install osmium). "
+            f"Without it, convert the extract to OSM XML "
+            f"(e.g. osmium cat {path} -o {xml_path}) and pass the .osm file instead"
+        )
+
+
+def read_osm_pbf(path: str) -> tuple[dict, list[Way]]:
+    """pyosmiumで .osm.pbf から道路とその構成ノードの座標を読み込む"""
+    check_osm_readable(path)
+
+    class Handler(osmium.SimpleHandler):
+        def __init__(self):
+            super().__init__()
+            self.nodes = {}
+            self.ways = []
+
+        def way(self, w):
+            tags = {tag.k: tag.v for tag in w.tags}
+            if way_speed_kmh(tags) is None:
+                return
+            refs = []
+            for n in w.nodes:
+                if not n.location.valid():
+                    continue
+                self.nodes[n.ref] = (n.location.lat, n.location.lon)
+                refs.append(n.ref)
+            self.ways.append(Way(refs, tags))
+
+    handler = Handler()
+    handler.apply_file(path, locations=True)
+    return handler.nodes, handler.ways
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """2点間の大円距離[m]（numpy配列可）"""
+    p1, p2 = np.radians(lat1), np.radians(lat2)
+    dp = p2 - p1
+    dl = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dp / 2) ** 2 + np.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(1.0, a)))
+
+
+class CarGraph:
+    """CSR形式の道路グラフ"""
+
+    def __init__(self, lat, lon, src, dst, length_m, time_s):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        n = len(self.lat)
+
+        # 出発ノードの順に辺を並べ替えてCSRにする
+        order = np.argsort(src, kind="stable")
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+        self.indices = np.asarray(dst, dtype=np.int64)[order]
+        self.length_m = np.asarray(length_m, dtype=np.float64)[order]
+        self.time_s = np.asarray(time_s, dtype=np.float64)[order]
+
+        # ダイクストラ法の内側のループはPythonのリストの方が速い
+        self._indptr_list = self.indptr.tolist()
+        self._indices_list = self.indices.tolist()
+        self._time_list = self.time_s.tolist()
+        self._snap_mask = self._largest_component_mask()
+
+    @property
+    def node_count(self) -> int:
+        return len(self.lat)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.indices)
+
+    @classmethod
+    def from_osm(cls, path: str) -> "CarGraph":
+        if path.endswith(".pbf"):
+            nodes, ways = read_osm_pbf(path)
+        else:
+            nodes, ways = read_osm_xml(path)
+        return cls.from_ways(nodes, ways)
+
+    @classmethod
+    def from_ways(cls, nodes: dict, ways: list[Way]) -> "CarGraph":
+        # 道路で使われているノードだけに連番を振る
+        node_ids = {}
+        src, dst, speeds = [], [], []
+        for way in ways:
+            refs = [ref for ref in way.node_refs if ref in nodes]
+            speed_mps = way_speed_kmh(way.tags) / 3.6
+            direction = way_direction(way.tags)
+            ids = [node_ids.setdefault(ref, len(node_ids)) for ref in refs]
+            for a, b in zip(ids[:-1], ids[1:]):
+                if direction >= 0:
+                    src.append(a)
+                    dst.append(b)
+                    speeds.append(speed_mps)
+                if direction <= 0:
+                    src.append(b)
+                    dst.append(a)
+                    speeds.append(speed_mps)
+
+        coords = np.array([nodes[ref] for ref in node_ids], dtype=np.float64).reshape(-1, 2)
+        src = np.array(src, dtype=np.int64)
+        dst = np.array(dst, dtype=np.int64)
+        length_m = haversine_m(coords[src, 0], coords[src, 1], coords[dst, 0], coords[dst, 1])
+        time_s = length_m / np.array(speeds, dtype=np.float64)
+        return cls(coords[:, 0], coords[:, 1], src, dst, length_m, time_s)
+
+    def _largest_component_mask(self) -> np.ndarray:
+        """向きを無視して最大の連結成分に属するノード。孤立した道路へのスナップを避ける"""
+        n = self.node_count
+        src = np.repeat(np.arange(n), np.diff(self.indptr))
+        neighbors = [[] for _ in range(n)]
+        for a, b in zip(src.tolist(), self._indices_list):
+            neighbors[a].append(b)
+            neighbors[b].append(a)
+        labels = [-1] * n
+        sizes = []
+        for start in range(n):
+            if labels[start] >= 0:
+                continue
+            label = len(sizes)
+            labels[start] = label
+            stack = [start]
+            size = 0
+            while stack:
+                u = stack.pop()
+                size += 1
+                for v in neighbors[u]:
+                    if labels[v] < 0:
+                        labels[v] = label
+                        stack.append(v)
+            sizes.append(size)
+        if not sizes:
+            return np.zeros(0, dtype=bool)
+        return np.array(labels) == int(np.argmax(sizes))
+
+    def nearest_node(self, lat: float, lon: float) -> int:
+        """最大連結成分の中で最も近いノード"""
+        candidates = np.flatnonzero(self._snap_mask)
+        # 近距離なので正距円筒図法で近似する
+        dx = (self.lon[candidates] - lon) * math.cos(math.radians(lat))
+        dy = self.lat[candidates] - lat
+        return int(candidates[np.argmin(dx * dx + dy * dy)])
+
+    def shortest_path_tree(self, source: int, targets: set[int]) -> tuple[list, list]:
+        """
+        sourceからの最短所要時間の木を作る。targetsがすべて確定した時点で打ち切る。
+        (所要時間[秒]のリスト, 直前の辺の番号のリスト) を返す。到達できないノードはinf / -1
+        """
+        indptr, indices, weights = self._indptr_list, self._indices_list, self._time_list
+        dist = [math.inf] * self.node_count
+        pred_edge = [-1] * self.node_count
+        dist[source] = 0.0
+        remaining = set(targets)
+        heap = [(0.0, source)]
+        while heap and remaining:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            remaining.discard(u)
+            for k in range(indptr[u], indptr[u + 1]):
+                v = indices[k]
+                nd = d + weights[k]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    pred_edge[v] = k
+                    heapq.heappush(heap, (nd, v))
+        return dist, pred_edge
+
+    def edge_source(self, edge: int) -> int:
+        return int(np.searchsorted(self.indptr, edge, side="right") - 1)
+
+    def path_edges(self, pred_edge: list, target: int) -> list[int]:
+        """最短経路木をたどり、targetまでの辺の番号を順に返す"""
+        edges = []
+        node = target
+        while pred_edge[node] >= 0:
+            edge = pred_edge[node]
+            edges.append(edge)
+            node = self.edge_source(edge)
+        edges.reverse()
+        return edges
+
+
+def route_all_pairs(graph: CarGraph, stops: list[dict]) -> list:
+    """
+    すべてのバス停の組み合わせについて (所要時間[分], 距離[km], 形状) を求める。
+    car_search.search_all_pairs と同じ順序・形式で、到達できない組はNoneの三つ組
+    """
+    nodes = [graph.nearest_node(stop["lat"], stop["lon"]) for stop in stops]
+    results = []
+    for i, from_stop in enumerate(stops):
+        targets = {nodes[j] for j, to_stop in enumerate(stops) if to_stop != from_stop}
+        dist, pred_edge = graph.shortest_path_tree(nodes[i], targets)
+        for j, to_stop in enumerate(stops):
+            if to_stop == from_stop:
+                continue
+            target = nodes[j]
+            if math.isinf(dist[target]):
+                results.append((None, None, None))
+                continue
+            edges = graph.path_edges(pred_edge, target)
+            path = [nodes[i]] + [int(graph.indices[k]) for k in edges]
+            coords = list(zip(graph.lat[path].tolist(), graph.lon[path].tolist()))
+            distance_m = float(graph.length_m[edges].sum()) if edges else 0.0
+            results.append((dist[target] / 60, distance_m / 1000, polyline.encode(coords)))
+        print(f"Progress: {i + 1}/{len(stops)} stops")
+    return results
+
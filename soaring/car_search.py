@@ -1,9 +1,16 @@
 import json
 import csv
-import requests
-import sys
 import os
-import time
+import math
+import random
+import argparse
+import statistics
+import concurrent.futures
+import otp_cache
+import otp_client
+import car_router
+
+MAX_WORKERS = 32  # OTPへの同時リクエスト数の上限
 
 
 def load_stops(json_path):
@@ -15,26 +22,27 @@ def load_stops(json_path):
 
 def get_travel_time(from_stop, to_stop):
     """2つのバス停間の所要時間と距離を取得"""
-    base_url = "http://localhost:8080/otp/routers/default/plan"
-
     # バス停データの検証
     if not all(key in from_stop and key in to_stop for key in ["lat", "lon"]):
-        return None, None
+        return None, None, None
 
     params = {
         "fromPlace": f"{from_stop['lat']},{from_stop['lon']}",
         "toPlace": f"{to_stop['lat']},{to_stop['lon']}",
         "mode": "CAR",
-        "date": "10-09-2025",
+        "date": otp_client.service_date(),
         "time": "12:00:00",
         "arriveBy": "false",
         "numItineraries": 1,
     }
 
+    result = otp_client.get_client().plan(params)
+    if not result.ok:
+        print(f"Error calculating travel time: {result.error}")
+        return None, None, None
+
     try:
-        response = requests.get(base_url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = result.data
 
         # 経路が見つかった場合、所要時間（分）と距離（メートル）を返す
         if "plan" in data and data["plan"]["itineraries"]:
@@ -51,52 +59,133 @@ def get_travel_time(from_stop, to_stop):
         return None, None, None
 
 
-def main():
-    if len(sys.argv) != 3:
-        print("Usage: python car_search.py <combus_stops.json> <output_dir>")
-        sys.exit(1)
+def make_pairs(stops: list) -> list:
+    return [
+        (from_stop, to_stop)
+        for from_stop in stops
+        for to_stop in stops
+        if from_stop != to_stop
+    ]
+
 
-    input_path = sys.argv[1]
-    output_dir = sys.argv[2]
+def to_routes(pairs: list, results: list) -> list:
+    routes = []
+    for (from_stop, to_stop), (duration_m, distance_km, geometry) in zip(
+        pairs, results
+    ):
+        if duration_m is None or distance_km is None or geometry is None:
+            continue
+        routes.append(
+            {
+                "from": from_stop.get("id", "unknown"),
+                "to": to_stop.get("id", "unknown"),
+                "distance_km": round(distance_km, 2),
+                "duration_m": round(duration_m, 2),
+                "geometry": geometry,
+            }
+        )
+    return routes
+
+
+def search_all_pairs(stops: list, max_workers: int = MAX_WORKERS) -> list:
+    """
+    すべてのバス停の組み合わせに対して並列に経路探索を行う。
+    結果は逐次実行した場合と同じ順序で返す。
+    """
+    pairs = make_pairs(stops)
+    total_pairs = len(pairs)
+    if total_pairs == 0:
+        return []
+
+    results = [None] * total_pairs
+    processed = 0
+    last_percentage = -1
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        future_to_index = {
+            executor.submit(get_travel_time, from_stop, to_stop): i
+            for i, (from_stop, to_stop) in enumerate(pairs)
+        }
+        for future in concurrent.futures.as_completed(future_to_index):
+            results[future_to_index[future]] = future.result()
+
+            # 進捗は1%刻みでまとめて出力
+            processed += 1
+            current_percentage = int((processed / total_pairs) * 100)
+            if current_percentage > last_percentage:
+                print(f"Progress: {current_percentage}% ({processed}/{total_pairs})")
+                last_percentage = current_percentage
+
+    return to_routes(pairs, results)
+
+
+def search_all_pairs_local(stops: list, osm_path: str, cross_check: int = 0) -> list:
+    """
+    OTPを使わず、OSMの道路網からプロセス内で全組み合わせの経路を求める。
+    cross_checkが正なら、その数の組をOTPでも探索して所要時間を比較する。
+    """
+    graph = car_router.CarGraph.from_osm(osm_path)
+    print(f"Loaded road graph: {graph.node_count} nodes, {graph.edge_count} edges")
+    pairs = make_pairs(stops)
+    results = car_router.route_all_pairs(graph, stops)
+    if cross_check > 0:
+        cross_check_with_otp(pairs, results, cross_check)
+    return to_routes(pairs, results)
+
+
+def cross_check_with_otp(pairs: list, results: list, sample_size: int, seed: int = 0):
+    """一部の組をOTPでも探索し、所要時間・距離の比（ルータ / OTP）を出力する"""
+    rng = random.Random(seed)
+    indices = rng.sample(range(len(pairs)), min(sample_size, len(pairs)))
+    duration_ratios = []
+    distance_ratios = []
+    for i in indices:
+        duration_m, distance_km, _ = results[i]
+        otp_duration_m, otp_distance_km, _ = get_travel_time(*pairs[i])
+        if None in (duration_m, otp_duration_m) or otp_duration_m <= 0:
+            continue
+        duration_ratios.append(duration_m / otp_duration_m)
+        if otp_distance_km:
+            distance_ratios.append(distance_km / otp_distance_km)
+    if not duration_ratios:
+        print("Cross-check: no comparable pairs")
+        return
+    print(
+        f"Cross-check ({len(duration_ratios)} pairs): "
+        f"duration ratio median {statistics.median(duration_ratios):.2f} "
+        f"[{min(duration_ratios):.2f}, {max(duration_ratios):.2f}], "
+        f"distance ratio median {statistics.median(distance_ratios or [math.nan]):.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コミュニティバスの車経路探索")
+    parser.add_argument("input_path", help="combus_stops.json")
+    parser.add_argument("output_dir")
+    parser.add_argument("--osm", help="OTPの代わりにこのOSMファイル（.osm.pbf / .osm）の道路網で探索する")
+    parser.add_argument("--cross-check", type=int, default=0, help="--osm の結果をOTPと比較する組の数")
+    args = parser.parse_args()
+    if args.osm:
+        try:
+            car_router.check_osm_readable(args.osm)
+        except RuntimeError as e:
+            parser.error(str(e))
+
+    input_path = args.input_path
+    output_dir = args.output_dir
     os.makedirs(output_dir, exist_ok=True)
 
     # バス停データの読み込み
     stops = load_stops(input_path)
     print(f"Loaded {len(stops)} stops")
 
-    # 結果を格納するリスト
-    routes = []
-
     # すべての組み合わせに対して所要時間を計算
-    total_pairs = len(stops) * (len(stops) - 1)
-    current_pair = 0
-
-    for from_stop in stops:
-        for to_stop in stops:
-            if from_stop == to_stop:
-                continue
-
-            current_pair += 1
-            print(f"Processing pair {current_pair}/{total_pairs}...")
-
-            # 所要時間と距離を計算
-            duration_m, distance_km, geometry = get_travel_time(from_stop, to_stop)
-
-            # 結果を追加
-            if (
-                duration_m is not None
-                and distance_km is not None
-                and geometry is not None
-            ):
-                routes.append(
-                    {
-                        "from": from_stop.get("id", "unknown"),
-                        "to": to_stop.get("id", "unknown"),
-                        "distance_km": round(distance_km, 2),
-                        "duration_m": round(duration_m, 2),
-                        "geometry": geometry,
-                    }
-                )
+    if args.osm:
+        routes = search_all_pairs_local(stops, args.osm, args.cross_check)
+    else:
+        routes = search_all_pairs(stops)
+    if not args.osm or args.cross_check > 0:
+        print(otp_client.get_client().report())
+        otp_cache.close_cache()
 
     # 結果をJSONファイルに出力
     output = {"combus-routes": routes}
@@ -1,6 +1,10 @@
-import sys
+import os
 import json
+import argparse
 import pickle
+import numpy as np
+from route_store import RouteStoreWriter
+from geometry_store import GeometryStore
 
 
 def read_json(file_path: str, key_str: str) -> list[dict]:
@@ -9,56 +13,158 @@ def read_json(file_path: str, key_str: str) -> list[dict]:
         return data[key_str]
 
 
+def iter_routes(input_paths: list[tuple[str, str]]):
+    """(JSONのパス, キー) の順に経路を返す。JSONは1ファイルずつ読み込み、連結したリストは作らない"""
+    for input_path, key in input_paths:
+        yield from read_json(input_path, key)
+
+
+def route_matrix_paths(output_all_routes_path: str) -> dict:
+    """all_routes.csvと同じ場所に置く行列ファイルのパスを返す"""
+    base = os.path.splitext(output_all_routes_path)[0]
+    return {
+        "duration_m": f"{base}_duration_m.npy",
+        "walk_distance_m": f"{base}_walk_distance_m.npy",
+        "index": f"{base}_index.json",
+    }
+
+
+def write_route_matrices(keypair_to_duration_dict: dict, output_all_routes_path: str):
+    """
+    所要時間・徒歩距離を (出発地, 目的地) の密な行列として書き出す。
+    経路のない組と徒歩距離が不明な組（サーフェスで求めた所要時間）はNaNとし、
+    IDと行・列番号の対応はJSONに書き出す。
+    """
+    from_ids = list(dict.fromkeys(from_key for from_key, _ in keypair_to_duration_dict))
+    to_ids = list(dict.fromkeys(to_key for _, to_key in keypair_to_duration_dict))
+    from_index = {key: i for i, key in enumerate(from_ids)}
+    to_index = {key: i for i, key in enumerate(to_ids)}
+
+    duration_matrix = np.full((len(from_ids), len(to_ids)), np.nan, dtype=np.float32)
+    walk_distance_matrix = np.full_like(duration_matrix, np.nan)
+    for (from_key, to_key), (
+        duration_m,
+        walk_distance_m,
+    ) in keypair_to_duration_dict.items():
+        i = from_index[from_key]
+        j = to_index[to_key]
+        duration_matrix[i, j] = duration_m
+        if walk_distance_m is not None:
+            walk_distance_matrix[i, j] = walk_distance_m
+
+    paths = route_matrix_paths(output_all_routes_path)
+    np.save(paths["duration_m"], duration_matrix)
+    np.save(paths["walk_distance_m"], walk_distance_matrix)
+    with open(paths["index"], "w", encoding="utf-8") as f:
+        json.dump({"from": from_ids, "to": to_ids}, f, ensure_ascii=False)
+
+
+def load_route_matrices(all_routes_path: str) -> dict:
+    """
+    write_route_matricesで書き出した行列をメモリマップで読み込む。
+    from_index / to_index はIDから行・列番号への辞書。
+    """
+    paths = route_matrix_paths(all_routes_path)
+    with open(paths["index"], encoding="utf-8") as f:
+        index = json.load(f)
+    return {
+        "duration_m": np.load(paths["duration_m"], mmap_mode="r"),
+        "walk_distance_m": np.load(paths["walk_distance_m"], mmap_mode="r"),
+        "from_index": {key: i for i, key in enumerate(index["from"])},
+        "to_index": {key: i for i, key in enumerate(index["to"])},
+    }
+
+
 def main(
     input_spot_to_refpoints_path: str,
     input_spot_to_stops_path: str,
     input_stop_to_refpoints_path: str,
     output_all_routes_path: str,
-    output_route_dir_path: str,
+    output_route_store_path: str,
+    input_geometry_store_path: str = None,
+    output_route_dir_path: str = None,
 ):
-    spot_to_refpoints_list = read_json(
-        input_spot_to_refpoints_path, "spot_to_refpoints"
-    )
-    spot_to_spots_list = read_json(input_spot_to_stops_path, "spot_to_stops")
-    stop_to_refpoints_list = read_json(
-        input_stop_to_refpoints_path, "stop_to_refpoints"
-    )
-    merged_list = spot_to_refpoints_list + spot_to_spots_list + stop_to_refpoints_list
+    """
+    3つの探索結果を順に読み、経路をルートストアに書き出して、所要時間の表を作る。
+    ptrans_search.py を --geometry-store 付きで実行した場合、ルートストアの経路は geometry_id を持ったまま
+    書き出す（RouteStore にジオメトリストアを指定して読み出すと形状が復元される）。
+    output_route_dir_path を指定した場合のみ、従来の組ごとの経路ファイル（{from}_{to}.bin）も
+    書き出す。こちらは形状を復元したものを書き出すため、経路が geometry_id を持つ場合
+    （ptrans_search.py を --geometry-store 付きで実行した場合）は input_geometry_store_path が必要で、
+    指定がなければValueError
+    """
+    input_paths = [
+        (input_spot_to_refpoints_path, "spot_to_refpoints"),
+        (input_spot_to_stops_path, "spot_to_stops"),
+        (input_stop_to_refpoints_path, "stop_to_refpoints"),
+    ]
 
+    # 経路は読み込んだ順にルートストアへ書き出し、手元には所要時間と徒歩距離だけを残す
     keypair_to_duration_dict = {}
-    for elem in merged_list:
-        from_key = elem["from"]
-        to_key = elem["to"]
-        duration = elem["duration_m"]
-        walk_distance_m = elem["walk_distance_m"]
-        keypair_to_duration_dict[(from_key, to_key)] = (duration, walk_distance_m)
+    geometry_store = GeometryStore(input_geometry_store_path) if input_geometry_store_path else None
+    try:
+        with RouteStoreWriter(output_route_store_path) as writer:
+            for elem in iter_routes(input_paths):
+                from_key = elem["from"]
+                to_key = elem["to"]
+                keypair_to_duration_dict[(from_key, to_key)] = (
+                    elem["duration_m"],
+                    elem["walk_distance_m"],
+                )
+                writer.add(elem)
+                if output_route_dir_path:
+                    if geometry_store is not None:
+                        elem = geometry_store.resolve_route(elem)
+                    elif "geometry" not in elem:
+                        raise ValueError(
+                            f"route {from_key} -> {to_key} has geometry_id references; "
+                            "--legacy-route-dir needs --geometry-store to restore its geometry"
+                        )
+                    file_path = output_route_dir_path + f"/{from_key}_{to_key}.bin"
+                    with open(file_path, "wb") as f:
+                        pickle.dump(elem, f)
+    finally:
+        if geometry_store is not None:
+            geometry_store.close()
 
+    # サーフェスで所要時間だけを求めた組（徒歩距離が不明）も all_routes.csv に含め、徒歩距離の列を空にする
     with open(output_all_routes_path, "w", encoding="utf-8") as f:
         f.write("from,to,duration_m,walk_distance_m\n")
         for (from_key, to_key), (
             duration_m,
             walk_distance_m,
         ) in keypair_to_duration_dict.items():
-            f.write(f"{from_key},{to_key},{duration_m},{walk_distance_m}\n")
+            walk_distance = "" if walk_distance_m is None else walk_distance_m
+            f.write(f"{from_key},{to_key},{duration_m},{walk_distance}\n")
 
-    for elem in merged_list:
-        from_key = elem["from"]
-        to_key = elem["to"]
-        file_path = output_route_dir_path + f"/{from_key}_{to_key}.bin"
-        with open(file_path, "wb") as f:
-            pickle.dump(elem, f)
+    write_route_matrices(keypair_to_duration_dict, output_all_routes_path)
 
 
 if __name__ == "__main__":
-    input_spot_to_refpoints_path = sys.argv[1]
-    input_spot_to_stops_path = sys.argv[2]
-    input_stop_to_refpoints_path = sys.argv[3]
-    output_all_routes_path = sys.argv[4]
-    output_route_dir_path = sys.argv[5]
+    parser = argparse.ArgumentParser(description="公共交通探索の結果をルートストアと所要時間の表にまとめる")
+    parser.add_argument("input_spot_to_refpoints_path")
+    parser.add_argument("input_spot_to_stops_path")
+    parser.add_argument("input_stop_to_refpoints_path")
+    parser.add_argument("output_all_routes_path")
+    parser.add_argument("output_route_store_path")
+    parser.add_argument(
+        "--geometry-store",
+        dest="input_geometry_store_path",
+        help="ptrans_search.py --geometry-store で書き出したジオメトリストア"
+        "（--legacy-route-dir の経路ファイルに形状を復元して書き出す）",
+    )
+    parser.add_argument(
+        "--legacy-route-dir",
+        dest="output_route_dir_path",
+        help="従来の組ごとの経路ファイル（{from}_{to}.bin）を書き出すディレクトリ（省略時は書き出さない）",
+    )
+    args = parser.parse_args()
     main(
-        input_spot_to_refpoints_path,
-        input_spot_to_stops_path,
-        input_stop_to_refpoints_path,
-        output_all_routes_path,
-        output_route_dir_path,
+        args.input_spot_to_refpoints_path,
+        args.input_spot_to_stops_path,
+        args.input_stop_to_refpoints_path,
+        args.output_all_routes_path,
+        args.output_route_store_path,
+        args.input_geometry_store_path,
+        args.output_route_dir_path,
     )
@@ -2,9 +2,14 @@ import csv
 import json
 import sys
 from pathlib import Path
-from typing import Dict, List, Tuple
-import xml.etree.ElementTree as ET
+from typing import Dict, Iterator, List, Set, Tuple
 import math
+import concurrent.futures
+import numpy as np
+from kml_writer import KmlWriter
+
+CHUNK_SIZE = 100_000  # 一度にまとめて変換する行数
+PALETTE_SIZE = 32  # 人口のグラデーションに使う共有スタイルの数
 
 
 def mesh250m_to_polygon(mesh_code: str) -> Tuple[float, float, float, float, List[List[float]]]:
@@ -62,6 +67,31 @@ def mesh250m_to_polygon(mesh_code: str) -> Tuple[float, float, float, float, Lis
     return sw_lat, sw_lon, height, width, polygon
 
 
+def latlon_to_mesh_cell(lat: float, lon: float) -> Tuple[int, int]:
+    """緯度・経度を含む5次メッシュの、全国共通の格子上の(行, 列)を返す"""
+    return int(math.floor(lat * 480)), int(math.floor((lon - 100) * 320))
+
+
+def mesh_cell_to_mesh250m(row: int, col: int) -> str:
+    """格子上の(行, 列)から10桁の第5次メッシュコードを作る"""
+    p, r, t = row // 320, (row % 320) // 40, (row % 40) // 4
+    q, s, u = col // 320, (col % 320) // 40, (col % 40) // 4
+    m4 = 1 + ((row % 4) // 2) * 2 + (col % 4) // 2
+    m5 = 1 + (row % 2) * 2 + col % 2
+    return f"{p:02d}{q:02d}{r}{s}{t}{u}{m4}{m5}"
+
+
+def mesh250m_to_cell(mesh_code: str) -> Tuple[int, int]:
+    """10桁の第5次メッシュコードから格子上の(行, 列)を返す"""
+    sw_lat, sw_lon, _, _, _ = mesh250m_to_polygon(mesh_code)
+    return int(round(sw_lat * 480)), int(round((sw_lon - 100) * 320))
+
+
+def latlon_to_mesh250m(lat: float, lon: float) -> str:
+    """緯度・経度を含む10桁の第5次メッシュコードを返す"""
+    return mesh_cell_to_mesh250m(*latlon_to_mesh_cell(lat, lon))
+
+
 def load_region(path: Path) -> Dict[str, float]:
     with path.open(encoding="utf-8") as f:
         data = json.load(f)
@@ -126,92 +156,174 @@ def write_kml(meshes: List[Dict], out_path: Path) -> None:
     p_max = max(pops)
     span = (p_max - p_min) if (p_max - p_min) > 0 else 1.0
 
-    kml = ET.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-    doc = ET.SubElement(kml, "Document")
-
-    for idx, m in enumerate(meshes):
-        t = (m["population"] - p_min) / span
-        r, g, b = gradient_color(t)
-        poly_color = rgba_to_kml(alpha, r, g, b)
-
-        pm = ET.SubElement(doc, "Placemark")
-        ET.SubElement(pm, "name").text = m["mesh_code"]
-        ET.SubElement(pm, "description").text = f"population: {m['population']}"
-
-        style = ET.SubElement(pm, "Style")
-        line = ET.SubElement(style, "LineStyle")
-        ET.SubElement(line, "color").text = rgba_to_kml(0xFF, 0, 0, 0)  # 黒の枠線
-        ET.SubElement(line, "width").text = "1"
-
-        polystyle = ET.SubElement(style, "PolyStyle")
-        ET.SubElement(polystyle, "color").text = poly_color
-        ET.SubElement(polystyle, "fill").text = "1"
-        ET.SubElement(polystyle, "outline").text = "1"
-
-        polygon = ET.SubElement(pm, "Polygon")
-        ET.SubElement(polygon, "tessellate").text = "1"
-        outer = ET.SubElement(polygon, "outerBoundaryIs")
-        lr = ET.SubElement(outer, "LinearRing")
-        coords = ET.SubElement(lr, "coordinates")
-        ring = m["geometry"]["coordinates"][0]
-        if ring[0] != ring[-1]:
-            ring = ring + [ring[0]]
-        coord_lines = [f"{lon},{lat},0" for lon, lat in ring]
-        coords.text = " ".join(coord_lines)
-
-    tree = ET.ElementTree(kml)
-    tree.write(out_path, encoding="utf-8", xml_declaration=True)
-
-
-def main() -> None:
-    if len(sys.argv) != 5:
-        print("Usage: python generate_mesh.py <region.json> <input.csv> <output.json> <output.kml>", file=sys.stderr)
-        sys.exit(1)
-
-    region_path = Path(sys.argv[1])
-    csv_path = Path(sys.argv[2])
-    out_json_path = Path(sys.argv[3])
-    out_kml_path = Path(sys.argv[4])
+    with KmlWriter(out_path) as kml:
+        # 人口のグラデーションを PALETTE_SIZE 段階の共有スタイルとして定義
+        for level in range(PALETTE_SIZE):
+            r, g, b = gradient_color(level / (PALETTE_SIZE - 1))
+            kml.add_style(
+                f"pop{level}",
+                line_color=rgba_to_kml(0xFF, 0, 0, 0),  # 黒の枠線
+                line_width=1,
+                poly_color=rgba_to_kml(alpha, r, g, b),
+            )
+
+        for m in meshes:
+            t = (m["population"] - p_min) / span
+            level = int(round(t * (PALETTE_SIZE - 1)))
+            kml.add_polygon(
+                m["geometry"]["coordinates"][0],
+                name=m["mesh_code"],
+                description=f"population: {m['population']}",
+                style_id=f"pop{level}",
+            )
+
+
+def first_order_codes_in_region(region: Dict[str, float]) -> Set[str]:
+    """対象領域と重なる1次メッシュ（4桁）のコードの集合を返す"""
+    p_min = int(math.floor(region["sw_lat"] * 1.5))
+    p_max = int(math.floor(region["ne_lat"] * 1.5))
+    q_min = int(math.floor(region["sw_lon"])) - 100
+    q_max = int(math.floor(region["ne_lon"])) - 100
+    return {
+        f"{p:02d}{q:02d}"
+        for p in range(p_min, p_max + 1)
+        for q in range(q_min, q_max + 1)
+    }
 
-    region = load_region(region_path)
 
-    meshes = []
+def read_population_chunks(
+    csv_path: Path, first_order_codes: Set[str], chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[List[str], List[int]]]:
+    """
+    e-Statの人口メッシュCSVを読み込み、(メッシュコード, 人口) をチャンク単位で返す。
+    人口が0以下の行と、対象領域と重ならない1次メッシュの行はここで除外する。
+    """
     with csv_path.open(encoding="shift_jis", newline="") as f:
         reader = csv.reader(f)
         # skip first two header lines
         next(reader, None)
         next(reader, None)
 
+        codes, populations = [], []
         for row in reader:
             if len(row) < 5:
                 continue
             mesh_code = row[0].strip()
+            if mesh_code[:4] not in first_order_codes:
+                continue
             population = row_to_population(row)
             if population <= 0:
                 continue
-            try:
-                sw_lat, sw_lon, h, w, polygon = mesh250m_to_polygon(mesh_code)
-            except ValueError:
-                continue
+            codes.append(mesh_code)
+            populations.append(population)
+            if len(codes) >= chunk_size:
+                yield codes, populations
+                codes, populations = [], []
+        if codes:
+            yield codes, populations
+
+
+def decode_mesh_codes(mesh_codes: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    10桁の第5次メッシュコードをまとめて南西端の緯度・経度に変換する。
+    mesh250m_to_polygonと同じ順序で計算するため、結果は完全に一致する。
+    不正なコードはvalid=Falseとなる。
+    """
+    n = len(mesh_codes)
+    valid = np.array(
+        [len(code) == 10 and code.isdigit() for code in mesh_codes], dtype=bool
+    )
+    digits = np.zeros((n, 10), dtype=np.int64)
+    if valid.any():
+        encoded = np.array(
+            [code for code, ok in zip(mesh_codes, valid) if ok], dtype="S10"
+        )
+        digits[valid] = encoded.view(np.uint8).reshape(-1, 10) - ord("0")
+
+    p = digits[:, 0] * 10 + digits[:, 1]
+    q = digits[:, 2] * 10 + digits[:, 3]
+    r, s, t, u = digits[:, 4], digits[:, 5], digits[:, 6], digits[:, 7]
+    m4, m5 = digits[:, 8], digits[:, 9]
+    valid &= (m4 >= 1) & (m4 <= 4) & (m5 >= 1) & (m5 <= 4)
+
+    lat_sw = p * (2/3) + r * (1/12) + t * (1/120)
+    lon_sw = (q + 100) + s * (1/8) + u * (1/80)
+    lat_offset_4 = np.where(m4 > 2, 1/240, 0.0)
+    lon_offset_4 = np.where(m4 % 2 == 0, 1/160, 0.0)
+    lat_offset_5 = np.where(m5 > 2, 1/480, 0.0)
+    lon_offset_5 = np.where(m5 % 2 == 0, 1/320, 0.0)
+    sw_lat = lat_sw + lat_offset_4 + lat_offset_5
+    sw_lon = lon_sw + lon_offset_4 + lon_offset_5
+    return valid, sw_lat, sw_lon
+
 
-            min_lat, max_lat = sw_lat, sw_lat + h
-            min_lon, max_lon = sw_lon, sw_lon + w
-            if (
-                min_lat >= region["sw_lat"]
-                and max_lat <= region["ne_lat"]
-                and min_lon >= region["sw_lon"]
-                and max_lon <= region["ne_lon"]
-            ):
-                meshes.append(
-                    {
-                        "mesh_code": mesh_code,
-                        "population": population,
-                        "geometry": {
-                            "type": "Polygon",
-                            "coordinates": [polygon],
-                        },
-                    }
-                )
+def load_meshes_in_region(csv_path: Path, region: Dict[str, float]) -> List[Dict]:
+    """1つの人口メッシュCSVから、対象領域に完全に含まれるメッシュを読み込む"""
+    height = 7.5 / 3600
+    width = 11.25 / 3600
+    first_order_codes = first_order_codes_in_region(region)
+
+    meshes = []
+    for codes, populations in read_population_chunks(csv_path, first_order_codes):
+        valid, sw_lat, sw_lon = decode_mesh_codes(codes)
+        ne_lat = sw_lat + height
+        ne_lon = sw_lon + width
+        inside = (
+            valid
+            & (sw_lat >= region["sw_lat"])
+            & (ne_lat <= region["ne_lat"])
+            & (sw_lon >= region["sw_lon"])
+            & (ne_lon <= region["ne_lon"])
+        )
+        for i in np.flatnonzero(inside).tolist():
+            lat0, lat1 = float(sw_lat[i]), float(ne_lat[i])
+            lon0, lon1 = float(sw_lon[i]), float(ne_lon[i])
+            meshes.append(
+                {
+                    "mesh_code": codes[i],
+                    "population": populations[i],
+                    "geometry": {
+                        "type": "Polygon",
+                        "coordinates": [
+                            [
+                                [lon0, lat0],
+                                [lon1, lat0],
+                                [lon1, lat1],
+                                [lon0, lat1],
+                                [lon0, lat0],
+                            ]
+                        ],
+                    },
+                }
+            )
+    return meshes
+
+
+def load_meshes_from_files(
+    csv_paths: List[Path], region: Dict[str, float], max_workers: int = None
+) -> List[Dict]:
+    """複数の人口メッシュCSVを並列に読み込み、ファイルの順に結合して返す"""
+    if len(csv_paths) == 1:
+        return load_meshes_in_region(csv_paths[0], region)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(
+            load_meshes_in_region, csv_paths, [region] * len(csv_paths)
+        )
+        return [mesh for meshes in results for mesh in meshes]
+
+
+def main() -> None:
+    if len(sys.argv) < 5:
+        print("Usage: python generate_mesh.py <region.json> <input.csv>... <output.json> <output.kml>", file=sys.stderr)
+        sys.exit(1)
+
+    region_path = Path(sys.argv[1])
+    csv_paths = [Path(path) for path in sys.argv[2:-2]]
+    out_json_path = Path(sys.argv[-2])
+    out_kml_path = Path(sys.argv[-1])
+
+    region = load_region(region_path)
+    meshes = load_meshes_from_files(csv_paths, region)
 
     out = {"mesh": meshes}
     with out_json_path.open("w", encoding="utf-8") as f:
@@ -221,4 +333,4 @@ def main() -> None:
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,90 @@
+"""
+到達圏探索の結果（GeoJSONのFeature）を1ファイルにまとめたアーカイブ。
+キーは (スポットID, 時間制限[分], 徒歩距離[m]) で、各レコードは
+個別ファイル出力の .bin と同じくFeatureをpickleしたもの。
+"""
+import sys
+import pickle
+from record_store import RecordStore, RecordStoreWriter
+import isochrone_codec
+
+
+def feature_key(id: str, time_limit_min: int, walk_distance_m: int) -> str:
+    """個別ファイル出力のファイル名と同じ形式のキーを返す"""
+    return f"{id}_{time_limit_min}_{walk_distance_m}"
+
+
+def parse_feature_key(key: str) -> tuple[str, int, int]:
+    """feature_key の逆変換。スポットIDに "_" が含まれていてもよい"""
+    id, time_limit_min, walk_distance_m = key.rsplit("_", 2)
+    return id, int(time_limit_min), int(walk_distance_m)
+
+
+class GeojsonArchiveWriter:
+    """GeoJSONアーカイブを逐次書き出す"""
+
+    def __init__(self, path: str):
+        self._writer = RecordStoreWriter(path)
+
+    def add(self, id: str, time_limit_min: int, walk_distance_m: int, feature: dict):
+        self._writer.add(
+            feature_key(id, time_limit_min, walk_distance_m), pickle.dumps(feature)
+        )
+
+    def close(self):
+        self._writer.close()
+
+    def abort(self):
+        """書きかけのファイルを破棄する"""
+        self._writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GeojsonArchive:
+    """GeoJSONアーカイブをメモリマップし、必要なFeatureだけを読み出す"""
+
+    def __init__(self, path: str):
+        self._store = RecordStore(path)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, key: tuple) -> bool:
+        return feature_key(*key) in self._store
+
+    def keys(self) -> list[tuple[str, int, int]]:
+        """(スポットID, 時間制限[分], 徒歩距離[m]) のリスト。__contains__ と get に渡せる"""
+        return [parse_feature_key(key) for key in self._store.keys()]
+
+    def get(self, id: str, time_limit_min: int, walk_distance_m: int) -> dict:
+        """Featureを一つ読み出す。形状が差分で符号化されていればGeoJSONに戻す。なければKeyError"""
+        key = feature_key(id, time_limit_min, walk_distance_m)
+        feature = pickle.loads(self._store.get_bytes(key))
+        feature["geometry"] = isochrone_codec.decode_geometry(feature["geometry"])
+        return feature
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python geojson_archive.py <archive> [id time_limit_min walk_distance_m]
+    with GeojsonArchive(sys.argv[1]) as archive:
+        if len(sys.argv) == 5:
+            print(archive.get(sys.argv[2], int(sys.argv[3]), int(sys.argv[4])))
+        else:
+            print(f"{len(archive)} features")
@@ -0,0 +1,140 @@
+"""
+経路の区間の形状（Google Polyline）を内容のハッシュで重複なく格納するジオメトリストア。
+同じバスの区間や駅からの徒歩区間など、多くの経路で繰り返し現れる形状を一度だけ保存し、
+経路側には形状の代わりにハッシュ（geometry_id）を持たせる。
+経路全体の形状は区間の形状を順に連結したものなので、読み込み時に組み立て直す。
+"""
+import sys
+import hashlib
+import polyline
+from record_store import RecordStore, RecordStoreWriter
+
+
+def merge_geometry(geometry_list: list[str]) -> str:
+    coords = []
+    for geom in geometry_list:
+        coords.extend(polyline.decode(geom))
+    if not coords:
+        return ""  # 区間のない経路（所要時間だけの経路）
+    merged_geom = polyline.encode(coords)
+    return merged_geom
+
+
+def geometry_id(geometry: str) -> str:
+    """形状の内容から決まるID"""
+    return hashlib.sha1(geometry.encode("utf-8")).hexdigest()[:20]
+
+
+class GeometryStoreWriter:
+    """ジオメトリストアを逐次書き出す。同じ形状は一度だけ格納する"""
+
+    def __init__(self, path: str):
+        self._writer = RecordStoreWriter(path, compress=True)
+        self._ids = set()
+        self.total_count = 0
+        self.total_bytes = 0
+        self.unique_bytes = 0
+
+    def add(self, geometry: str) -> str:
+        """形状を追加し、そのIDを返す"""
+        id = geometry_id(geometry)
+        data = geometry.encode("utf-8")
+        self.total_count += 1
+        self.total_bytes += len(data)
+        if id not in self._ids:
+            self._ids.add(id)
+            self._writer.add(id, data)
+            self.unique_bytes += len(data)
+        return id
+
+    def dedupe_route(self, route: dict) -> dict:
+        """
+        区間の形状をストアに格納し、形状の代わりに geometry_id を持つ経路を返す。
+        経路全体の形状（geometry）は区間から組み立て直せるため持たない。
+        区間を連結した形状が経路全体の形状と一致しない経路は、復元できないためValueError
+        """
+        section_geometries = [section["geometry"] for section in route["sections"]]
+        if merge_geometry(section_geometries) != route["geometry"]:
+            raise ValueError(
+                f"route {route.get('from')} -> {route.get('to')}: "
+                "merged section geometries do not match the route geometry"
+            )
+        sections = []
+        for section in route["sections"]:
+            section = dict(section)
+            section["geometry_id"] = self.add(section.pop("geometry"))
+            sections.append(section)
+        deduped = {k: v for k, v in route.items() if k != "geometry"}
+        deduped["sections"] = sections
+        return deduped
+
+    def report(self) -> str:
+        unique_count = len(self._ids)
+        return (
+            f"Geometry store: {self.total_count} legs, {unique_count} unique, "
+            f"{self.total_bytes} -> {self.unique_bytes} bytes"
+        )
+
+    def close(self):
+        self._writer.close()
+
+    def abort(self):
+        """書きかけのファイルを破棄する"""
+        self._writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class GeometryStore:
+    """ジオメトリストアをメモリマップし、経路の形状を組み立て直す"""
+
+    def __init__(self, path: str):
+        self._store = RecordStore(path)
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def get(self, id: str) -> str:
+        """形状を一つ読み出す。なければKeyError"""
+        return self._store.get_bytes(id).decode("utf-8")
+
+    def resolve_route(self, route: dict) -> dict:
+        """geometry_id を持つ経路から、区間と経路全体の形状を復元した経路を返す"""
+        if "geometry" in route:
+            return route
+        ids = [section["geometry_id"] for section in route["sections"]]
+        geometries = [data.decode("utf-8") for data in self._store.get_many_bytes(ids)]
+        sections = []
+        for section, geometry in zip(route["sections"], geometries):
+            section = {k: v for k, v in section.items() if k != "geometry_id"}
+            section["geometry"] = geometry
+            sections.append(section)
+        resolved = dict(route)
+        resolved["geometry"] = merge_geometry(geometries)
+        resolved["sections"] = sections
+        return resolved
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python geometry_store.py <store> [geometry_id]
+    with GeometryStore(sys.argv[1]) as store:
+        if len(sys.argv) == 3:
+            print(store.get(sys.argv[2]))
+        else:
+            print(f"{len(store)} geometries")
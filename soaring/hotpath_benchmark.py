@@ -0,0 +1,408 @@
+"""
+CPU負荷の高い処理のマイクロベンチマーク。
+合成した領域（町・市・県の規模）に対して各処理を実行し、最短の実行時間を計測する。
+結果はJSONに書き出し、保存済みのベースラインと比べて閾値を超えて遅くなった処理があれば
+終了コード1で終了する。ベースラインは実行する環境ごとに --update-baseline で作成する。
+--require-baseline を付けた場合（make benchmark, CI）は、ベースラインがなければ
+比較できないため終了コード2で終了する。
+
+使い方:
+    python soaring/hotpath_benchmark.py [--scales town city prefecture]
+        [--benchmarks NAME ...] [--repeat 3] [--threshold 0.2]
+        [--baseline work/benchmark/hotpath_baseline.json]
+        [--output work/benchmark/hotpath_latest.json] [--update-baseline]
+        [--require-baseline]
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+from shapely.geometry import shape
+
+import area_search
+import edit_routes
+import generate_mesh
+import ptrans_search
+import synthetic_region
+
+DEFAULT_BASELINE_PATH = "work/benchmark/hotpath_baseline.json"
+DEFAULT_OUTPUT_PATH = "work/benchmark/hotpath_latest.json"
+REGRESSION_THRESHOLD = 0.2  # ベースラインより20%以上遅ければ退行とみなす
+REPEAT = 3
+
+# 規模ごとの領域の一辺[km]と地点数
+SCALES = {
+    "town": {"size_km": 5, "spots": 5, "stops": 20, "refpoints": 30, "isochrone_spots": 1},
+    "city": {"size_km": 15, "spots": 15, "stops": 50, "refpoints": 150, "isochrone_spots": 3},
+    "prefecture": {"size_km": 60, "spots": 40, "stops": 120, "refpoints": 400, "isochrone_spots": 8},
+}
+ISOCHRONE_WALK_DISTANCES = [200, 1000]  # 到達圏を合成する徒歩距離[m]
+
+
+class Region:
+    """ある規模の合成データ。必要になった時点で一度だけ作る"""
+
+    def __init__(self, scale: str, seed: int = 0):
+        self.scale = scale
+        self.config = SCALES[scale]
+        self.seed = seed
+        self._cache = {}
+
+    def _get(self, name: str, make):
+        if name not in self._cache:
+            self._cache[name] = make()
+        return self._cache[name]
+
+    def points(self, kind: str) -> list[dict]:
+        return self._get(
+            kind,
+            lambda: synthetic_region.make_points(
+                self.config[kind], kind, self.config["size_km"], self.seed
+            ),
+        )
+
+    def mesh_features(self) -> list[dict]:
+        return self._get(
+            "mesh",
+            lambda: synthetic_region.make_mesh_features(self.config["size_km"], self.seed),
+        )
+
+    def mesh_index(self, mode: str = area_search.MESH_INDEX_MODE):
+        return self._get(
+            f"mesh_index_{mode}",
+            lambda: area_search.make_mesh_index(
+                [area_search.Mesh(f) for f in self.mesh_features()], mode
+            ),
+        )
+
+    def isochrone_spots(self) -> list[dict]:
+        return self.points("spots")[: self.config["isochrone_spots"]]
+
+    def walk_geojson_lists(self) -> list[list[list]]:
+        """スポットごとの、徒歩距離の昇順の到達圏のGeojsonリスト（時間の昇順）"""
+
+        def make():
+            time_limits = area_search.make_time_limits()
+            return [
+                [
+                    area_search.parse_isochrone(
+                        synthetic_region.make_isochrone(spot, time_limits, walk),
+                        time_limits,
+                        spot["id"],
+                        walk,
+                    )
+                    for walk in ISOCHRONE_WALK_DISTANCES
+                ]
+                for spot in self.isochrone_spots()
+            ]
+
+        return self._get("walk_geojson_lists", make)
+
+    def geojson_lists(self) -> list[list]:
+        """スポット・徒歩距離ごとの到達圏のGeojsonリスト（時間の昇順）"""
+        return [lst for walk_lists in self.walk_geojson_lists() for lst in walk_lists]
+
+    def isochrone_responses(self) -> dict:
+        """exec_single_spot が問い合わせる (スポットID, 徒歩距離) ごとの到達圏のレスポンス"""
+
+        def make():
+            time_limits = area_search.make_time_limits()
+            return {
+                (spot["id"], walk): synthetic_region.make_isochrone(spot, time_limits, walk)
+                for spot in self.isochrone_spots()
+                for walk in area_search.make_walk_distance_limits()
+            }
+
+        return self._get("isochrone_responses", make)
+
+    def routes(self) -> dict:
+        def make():
+            spots = self.points("spots")
+            stops = self.points("stops")
+            refpoints = self.points("refpoints")
+            return {
+                "spot_to_stops": synthetic_region.make_routes(spots, stops, self.seed),
+                "spot_to_refpoints": synthetic_region.make_routes(spots, refpoints, self.seed),
+                "stop_to_refpoints": synthetic_region.make_routes(stops, refpoints, self.seed),
+            }
+
+        return self._get("routes", make)
+
+
+# 各ベンチマークは領域を受け取り、(計測する関数, 処理件数) を返す。
+# 計測する関数は作業用ディレクトリを引数に取る。
+
+
+def bench_mesh250m_to_polygon(region: Region):
+    codes = [f["mesh_code"] for f in region.mesh_features()]
+
+    def run(work_dir: str):
+        for code in codes:
+            generate_mesh.mesh250m_to_polygon(code)
+
+    return run, len(codes)
+
+
+def bench_write_kml(region: Region):
+    meshes = region.mesh_features()
+
+    def run(work_dir: str):
+        generate_mesh.write_kml(meshes, os.path.join(work_dir, "mesh.kml"))
+
+    return run, len(meshes)
+
+
+def bench_find_intersecting_meshes(region: Region):
+    mesh_index = region.mesh_index()
+    geometries = [
+        shape(geojson.geometry)
+        for geojson_list in region.geojson_lists()
+        for geojson in geojson_list
+    ]
+
+    def run(work_dir: str):
+        for geometry in geometries:
+            area_search.find_intersecting_meshes(geometry, mesh_index)
+
+    return run, len(geometries)
+
+
+def _bench_calc_first_reachable_times(mode: str):
+    def bench(region: Region):
+        mesh_index = region.mesh_index(mode)
+        time_limits = area_search.make_time_limits()
+        spot_walk_lists = region.walk_geojson_lists()
+
+        def run(work_dir: str):
+            for walk_geojson_lists in spot_walk_lists:
+                area_search.calc_first_reachable_times(walk_geojson_lists, time_limits, mesh_index)
+
+        return run, sum(len(lst) for lst in region.geojson_lists())
+
+    return bench
+
+
+def bench_reachability_update(region: Region):
+    """
+    到達メッシュの更新（旧 calc_and_update_reachable_meshs を置き換えた処理）。
+    最小到達時間区分の計算と、そこから各GeoJSONの到達メッシュコードを導出するまでを計測する
+    """
+    mesh_index = region.mesh_index()
+    time_limits = area_search.make_time_limits()
+    spot_walk_lists = region.walk_geojson_lists()
+
+    def run(work_dir: str):
+        for walk_geojson_lists in spot_walk_lists:
+            first_times = area_search.calc_first_reachable_times(
+                walk_geojson_lists, time_limits, mesh_index
+            )
+            area_search.update_reachable_mesh_codes(
+                walk_geojson_lists, first_times, time_limits, mesh_index.mesh_codes
+            )
+
+    return run, sum(len(lst) for lst in region.geojson_lists())
+
+
+def bench_exec_single_spot(region: Region):
+    """
+    到達圏探索1スポット分（20通りの徒歩距離）。OTPへの問い合わせは合成したレスポンスを返すものに
+    差し替え、レスポンスの解析・交差判定・到達メッシュの更新だけを計測する
+    """
+    mesh_index = region.mesh_index()
+    spots = region.isochrone_spots()
+    responses = region.isochrone_responses()
+
+    def request_to_otp(spot: dict, time_limits: list, walk_distance_limit: int) -> dict:
+        return responses[(spot["id"], walk_distance_limit)]
+
+    def run(work_dir: str):
+        original = area_search.request_to_otp
+        area_search.request_to_otp = request_to_otp
+        try:
+            for spot in spots:
+                area_search.exec_single_spot(spot, mesh_index)
+        finally:
+            area_search.request_to_otp = original
+
+    return run, len(spots)
+
+
+def bench_merge_geometry(region: Region):
+    geometry_lists = [
+        [section["geometry"] for section in route["sections"]]
+        for route in region.routes()["spot_to_stops"]
+    ]
+
+    def run(work_dir: str):
+        for geometry_list in geometry_lists:
+            ptrans_search.merge_geometry(geometry_list)
+
+    return run, len(geometry_lists)
+
+
+def bench_write_geojsons(region: Region):
+    geojson_list = [geojson for lst in region.geojson_lists() for geojson in lst]
+    # 出力に含まれる到達可能メッシュを埋めておく
+    time_limits = area_search.make_time_limits()
+    mesh_index = region.mesh_index()
+    for walk_geojson_lists in region.walk_geojson_lists():
+        first_times = area_search.calc_first_reachable_times(
+            walk_geojson_lists, time_limits, mesh_index
+        )
+        area_search.update_reachable_mesh_codes(
+            walk_geojson_lists, first_times, time_limits, mesh_index.mesh_codes
+        )
+
+    def run(work_dir: str):
+        bin_dir = os.path.join(work_dir, "geojson")
+        txt_dir = os.path.join(work_dir, "geojson_txt")
+        os.makedirs(bin_dir)
+        os.makedirs(txt_dir)
+        area_search.write_geojsons(geojson_list, bin_dir, txt_dir)
+
+    return run, len(geojson_list)
+
+
+def bench_edit_routes_main(region: Region):
+    routes = region.routes()
+    input_dir = tempfile.mkdtemp(prefix="bench_routes_")
+    for key, route_list in routes.items():
+        ptrans_search.write_json(input_dir, key, route_list)
+
+    def run(work_dir: str):
+        edit_routes.main(
+            os.path.join(input_dir, "spot_to_refpoints.json"),
+            os.path.join(input_dir, "spot_to_stops.json"),
+            os.path.join(input_dir, "stop_to_refpoints.json"),
+            os.path.join(work_dir, "all_routes.csv"),
+            os.path.join(work_dir, "routes.bin"),
+        )
+
+    run.cleanup_dir = input_dir
+    return run, sum(len(route_list) for route_list in routes.values())
+
+
+BENCHMARKS = {
+    "mesh250m_to_polygon": bench_mesh250m_to_polygon,
+    "write_kml": bench_write_kml,
+    "find_intersecting_meshes": bench_find_intersecting_meshes,
+    "calc_first_reachable_times_polygon": _bench_calc_first_reachable_times("polygon"),
+    "calc_first_reachable_times_raster": _bench_calc_first_reachable_times("raster"),
+    "reachability_update": bench_reachability_update,
+    "exec_single_spot": bench_exec_single_spot,
+    "merge_geometry": bench_merge_geometry,
+    "write_geojsons": bench_write_geojsons,
+    "edit_routes_main": bench_edit_routes_main,
+}
+
+
+def measure(run, repeat: int) -> float:
+    """repeat回実行し、最短の実行時間[秒]を返す。毎回新しい作業用ディレクトリを使う"""
+    best = float("inf")
+    for _ in range(repeat):
+        work_dir = tempfile.mkdtemp(prefix="bench_")
+        try:
+            start_time = time.perf_counter()
+            run(work_dir)
+            best = min(best, time.perf_counter() - start_time)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    return best
+
+
+def run_benchmarks(scales: list[str], names: list[str], repeat: int, seed: int = 0) -> dict:
+    """ "規模/ベンチマーク名" から計測結果への辞書を返す"""
+    results = {}
+    for scale in scales:
+        region = Region(scale, seed)
+        for name in names:
+            run, items = BENCHMARKS[name](region)
+            seconds = measure(run, repeat)
+            cleanup_dir = getattr(run, "cleanup_dir", None)
+            if cleanup_dir:
+                shutil.rmtree(cleanup_dir, ignore_errors=True)
+            results[f"{scale}/{name}"] = {
+                "seconds": seconds,
+                "items": items,
+                "us_per_item": seconds / items * 1e6 if items else None,
+            }
+            print(f"{scale + '/' + name:<44} {seconds:9.4f}s  ({items} items)")
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """ベースラインより threshold を超えて遅くなったベンチマークの一覧を返す"""
+    regressions = []
+    print(f"{'benchmark':<44} {'baseline':>10} {'current':>10} {'ratio':>7}")
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None or base["items"] != result["items"]:
+            print(f"{key:<44} {'-':>10} {result['seconds']:10.4f}     new")
+            continue
+        ratio = result["seconds"] / base["seconds"] if base["seconds"] > 0 else 1.0
+        mark = ""
+        if ratio > 1 + threshold:
+            regressions.append(key)
+            mark = "  REGRESSION"
+        print(f"{key:<44} {base['seconds']:10.4f} {result['seconds']:10.4f} {ratio:7.2f}{mark}")
+    return regressions
+
+
+def write_results(path: str, results: dict, repeat: int, seed: int):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    data = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "repeat": repeat,
+        "seed": seed,
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU負荷の高い処理のマイクロベンチマーク")
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=list(SCALES))
+    parser.add_argument("--benchmarks", nargs="+", choices=list(BENCHMARKS), default=list(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=REPEAT)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH)
+    parser.add_argument("--output", default=DEFAULT_OUTPUT_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="結果をベースラインとして保存する")
+    parser.add_argument(
+        "--require-baseline",
+        action="store_true",
+        help="ベースラインがなければ失敗する（退行の検出を飛ばさない）",
+    )
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.benchmarks, args.repeat, args.seed)
+    write_results(args.output, results, args.repeat, args.seed)
+
+    if args.update_baseline:
+        write_results(args.baseline, results, args.repeat, args.seed)
+        print(f"Baseline written to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one")
+        return 2 if args.require_baseline else 0
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = compare(results, baseline, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
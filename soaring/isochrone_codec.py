@@ -0,0 +1,189 @@
+"""
+到達圏のジオメトリを出力前に小さくする。
+    - 位相を保った簡略化（許容誤差はメートルで指定）
+    - 座標をマイクロ度（1e-6度、約0.1m）に量子化し、潰れたリング・ポリゴンを除く
+    - リングごとに先頭からの差分で符号化（任意、.bin とアーカイブの出力のみ）
+差分で符号化したジオメトリは {"type": ..., "encoding": "udeg-delta", "coordinates": ...} の形で、
+各リングは [x0, y0, dx1, dy1, ...] の整数の平らなリストになる。decode_geometry で元の形式に戻す。
+"""
+import json
+import pickle
+import numpy as np
+import shapely
+from shapely.geometry import shape
+
+QUANTIZE_SCALE = 1_000_000  # 1度あたりの量子化単位（マイクロ度）
+M_PER_DEG_LAT = 111_320  # 緯度1度あたりの距離[m]
+DELTA_ENCODING = "udeg-delta"
+
+
+def _quantize_ring(ring) -> np.ndarray:
+    """リングの座標をマイクロ度の整数にし、連続する重複点を除く"""
+    q = np.rint(np.asarray(ring, dtype=np.float64)[:, :2] * QUANTIZE_SCALE).astype(np.int64)
+    keep = np.ones(len(q), dtype=bool)
+    keep[1:] = np.any(q[1:] != q[:-1], axis=1)
+    return q[keep]
+
+
+def _quantize_polygons(geometry: dict) -> list[list[np.ndarray]]:
+    """
+    (Multi)PolygonのGeoJSONジオメトリの各リングをマイクロ度の整数に量子化する。
+    4点未満に潰れたリングは除き、外周が潰れたポリゴンはポリゴンごと除く
+    """
+    polygons = geometry["coordinates"]
+    if geometry["type"] == "Polygon":
+        polygons = [polygons]
+    quantized = []
+    for polygon in polygons:
+        rings = []
+        for i, ring in enumerate(polygon):
+            q = _quantize_ring(ring)
+            if len(q) < 4:
+                if i == 0:
+                    break
+                continue
+            rings.append(q)
+        if rings:
+            quantized.append(rings)
+    return quantized
+
+
+def simplify_geometry(geometry: dict, tolerance_m: float) -> dict:
+    """
+    位相を保って簡略化し、座標をマイクロ度に丸めたMultiPolygonのGeoJSONジオメトリを返す。
+    許容誤差は緯度方向の長さで度に換算するため、経度方向はそれより小さい誤差になる。
+    すべてのポリゴンが潰れた場合は座標が空のMultiPolygonになる
+    """
+    geom = shape(geometry)
+    if tolerance_m > 0:
+        geom = shapely.simplify(geom, tolerance_m / M_PER_DEG_LAT, preserve_topology=True)
+    if geom.geom_type == "Polygon":
+        geom = shapely.MultiPolygon([geom])
+    polygons = [
+        [
+            np.asarray(polygon.exterior.coords),
+            *(np.asarray(interior.coords) for interior in polygon.interiors),
+        ]
+        for polygon in geom.geoms
+        if not polygon.is_empty
+    ]
+    return {
+        "type": "MultiPolygon",
+        "coordinates": [
+            [(q / QUANTIZE_SCALE).tolist() for q in rings]
+            for rings in _quantize_polygons({"type": "MultiPolygon", "coordinates": polygons})
+        ],
+    }
+
+
+def encode_geometry(geometry: dict) -> dict:
+    """(Multi)PolygonのGeoJSONジオメトリをマイクロ度の差分で符号化する。潰れたリングは除く"""
+    encoded = []
+    for rings in _quantize_polygons(geometry):
+        encoded.append(
+            [
+                np.diff(q, axis=0, prepend=np.zeros((1, 2), dtype=np.int64)).ravel().tolist()
+                for q in rings
+            ]
+        )
+    return {"type": "MultiPolygon", "encoding": DELTA_ENCODING, "coordinates": encoded}
+
+
+def decode_geometry(geometry: dict) -> dict:
+    """encode_geometry で符号化したジオメトリをGeoJSONに戻す。符号化されていなければそのまま返す"""
+    if geometry.get("encoding") != DELTA_ENCODING:
+        return geometry
+    polygons = []
+    for rings in geometry["coordinates"]:
+        polygon = []
+        for flat in rings:
+            coords = np.cumsum(np.asarray(flat, dtype=np.int64).reshape(-1, 2), axis=0)
+            polygon.append((coords / QUANTIZE_SCALE).tolist())
+        polygons.append(polygon)
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+
+def count_vertices(geometry: dict) -> int:
+    return int(shapely.get_num_coordinates(shape(decode_geometry(geometry))))
+
+
+def compact_geojsons(
+    geojson_list: list,
+    mesh_index,
+    tolerance_m: float = 0.0,
+    delta_encode: bool = False,
+) -> dict:
+    """
+    各Geojsonのジオメトリを簡略化・量子化したGeoJSONジオメトリに置き換え、
+    頂点数・バイト数の削減量（delta_encode なら差分で符号化した場合のバイト数）と、
+    置き換えたジオメトリで交差判定した場合の到達メッシュの増減（元のジオメトリとの差）を集計して返す。
+    差分での符号化自体は出力時に行う（encode_feature）。
+    reachable_mesh_codes は元のジオメトリで求めたまま変更しない。
+    """
+    report = {
+        "tolerance_m": tolerance_m,
+        "delta_encode": delta_encode,
+        "features": 0,
+        "features_emptied": 0,
+        "vertices_before": 0,
+        "vertices_after": 0,
+        "json_bytes_before": 0,
+        "json_bytes_after": 0,
+        "pickle_bytes_before": 0,
+        "pickle_bytes_after": 0,
+        "features_with_mesh_error": 0,
+        "meshes_added": 0,
+        "meshes_removed": 0,
+    }
+    for geojson in geojson_list:
+        before = geojson.geometry
+        after = simplify_geometry(before, tolerance_m)
+        output = encode_geometry(after) if delta_encode else after
+
+        before_geom = shape(before)
+        after_geom = shape(after)
+        before_meshes = set() if before_geom.is_empty else set(mesh_index.query(before_geom).tolist())
+        after_meshes = set() if after_geom.is_empty else set(mesh_index.query(after_geom).tolist())
+        added = len(after_meshes - before_meshes)
+        removed = len(before_meshes - after_meshes)
+
+        report["features"] += 1
+        report["features_emptied"] += int(after_geom.is_empty and not before_geom.is_empty)
+        report["vertices_before"] += count_vertices(before)
+        report["vertices_after"] += count_vertices(after)
+        report["json_bytes_before"] += len(json.dumps(before))
+        report["json_bytes_after"] += len(json.dumps(output))
+        report["pickle_bytes_before"] += len(pickle.dumps(before))
+        report["pickle_bytes_after"] += len(pickle.dumps(output))
+        report["features_with_mesh_error"] += int(added + removed > 0)
+        report["meshes_added"] += added
+        report["meshes_removed"] += removed
+        geojson.geometry = after
+    return report
+
+
+def encode_feature(feature: dict) -> dict:
+    """Featureのジオメトリを差分で符号化したFeatureを返す（.bin・アーカイブ用。JSONの出力には使わない）"""
+    encoded = dict(feature)
+    encoded["geometry"] = encode_geometry(feature["geometry"])
+    return encoded
+
+
+def format_report(report: dict) -> str:
+    def ratio(key: str) -> str:
+        before = report[f"{key}_before"]
+        after = report[f"{key}_after"]
+        return f"{before} -> {after} ({after / before:.1%})" if before else "0 -> 0"
+
+    return "\n".join(
+        [
+            f"Isochrone compaction (tolerance {report['tolerance_m']} m, "
+            f"delta encode {report['delta_encode']}): {report['features']} features "
+            f"({report['features_emptied']} collapsed to empty)",
+            f"  vertices:     {ratio('vertices')}",
+            f"  json bytes:   {ratio('json_bytes')}",
+            f"  pickle bytes: {ratio('pickle_bytes')}",
+            f"  mesh error:   {report['features_with_mesh_error']} features, "
+            f"+{report['meshes_added']} / -{report['meshes_removed']} meshes",
+        ]
+    )
@@ -0,0 +1,110 @@
+"""
+Placemarkを逐次ファイルに書き出すKMLライター。
+スタイルは文書の先頭で一度だけ定義し、各Placemarkからは styleUrl で参照する。
+出力先の拡張子が .kmz の場合は doc.kml を圧縮したKMZ（zip）として書き出す。
+"""
+import io
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+
+class KmlWriter:
+    def __init__(self, out_path, name: str = None):
+        self.out_path = Path(out_path)
+        self._zip = None
+        if self.out_path.suffix.lower() == ".kmz":
+            self._zip = zipfile.ZipFile(self.out_path, "w", zipfile.ZIP_DEFLATED)
+            raw = self._zip.open("doc.kml", "w")
+        else:
+            raw = self.out_path.open("wb")
+        self._file = io.TextIOWrapper(raw, encoding="utf-8", newline="\n")
+        self._file.write("<?xml version='1.0' encoding='utf-8'?>\n")
+        self._file.write('<kml xmlns="http://www.opengis.net/kml/2.2"><Document>')
+        if name is not None:
+            self._file.write(f"<name>{escape(name)}</name>")
+        self._has_placemark = False
+
+    def add_style(
+        self,
+        style_id: str,
+        line_color: str = None,
+        line_width: int = None,
+        poly_color: str = None,
+        fill: bool = True,
+        outline: bool = True,
+    ):
+        """共有スタイルを定義する。Placemarkより前に呼び出すこと。色はKMLのaabbggrr形式"""
+        if self._has_placemark:
+            raise RuntimeError("styles must be added before placemarks")
+        parts = [f'<Style id="{escape(style_id)}">']
+        if line_color is not None or line_width is not None:
+            parts.append("<LineStyle>")
+            if line_color is not None:
+                parts.append(f"<color>{line_color}</color>")
+            if line_width is not None:
+                parts.append(f"<width>{line_width}</width>")
+            parts.append("</LineStyle>")
+        if poly_color is not None:
+            parts.append(
+                f"<PolyStyle><color>{poly_color}</color>"
+                f"<fill>{int(fill)}</fill><outline>{int(outline)}</outline></PolyStyle>"
+            )
+        parts.append("</Style>")
+        self._file.write("".join(parts))
+
+    def _begin_placemark(self, name: str, description: str, style_id: str):
+        self._has_placemark = True
+        parts = ["<Placemark>"]
+        if name is not None:
+            parts.append(f"<name>{escape(name)}</name>")
+        if description is not None:
+            parts.append(f"<description>{escape(description)}</description>")
+        if style_id is not None:
+            parts.append(f"<styleUrl>#{escape(style_id)}</styleUrl>")
+        self._file.write("".join(parts))
+
+    def add_point(
+        self,
+        lon: float,
+        lat: float,
+        name: str = None,
+        description: str = None,
+        style_id: str = None,
+    ):
+        self._begin_placemark(name, description, style_id)
+        self._file.write(
+            f"<Point><coordinates>{lon},{lat},0</coordinates></Point></Placemark>"
+        )
+
+    def add_polygon(
+        self,
+        ring: list,
+        name: str = None,
+        description: str = None,
+        style_id: str = None,
+    ):
+        """外周リング [[lon, lat], ...] からなるポリゴンを追加する"""
+        if ring[0] != ring[-1]:
+            ring = ring + [ring[0]]
+        coords = " ".join(f"{lon},{lat},0" for lon, lat in ring)
+        self._begin_placemark(name, description, style_id)
+        self._file.write(
+            "<Polygon><tessellate>1</tessellate><outerBoundaryIs><LinearRing>"
+            f"<coordinates>{coords}</coordinates>"
+            "</LinearRing></outerBoundaryIs></Polygon></Placemark>"
+        )
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write("</Document></kml>\n")
+        self._file.close()
+        if self._zip is not None:
+            self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,120 @@
+"""
+探索処理（車経路・公共交通・到達圏）のOTP負荷ベンチマーク。
+合成したスポット・メッシュに対して各探索を実行し、ステージごとに
+リクエスト数、スループット[req/s]、応答時間のp50/p99、経過時間を出力する。
+
+--base-url を省略した場合は otp_stub を同じプロセス内で起動して問い合わせる。
+OTPのレスポンスキャッシュは測定の妨げになるため無効にする。
+
+使い方:
+    python soaring/otp_benchmark.py [--base-url URL] [--stages car ptrans area]
+        [--spots 5] [--stops 40] [--area-spots 2] [--output result.json]
+        [otp_stubのオプション（--latency-ms, --error-rate など）]
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+import otp_stub
+import synthetic_region
+
+STAGES = ["car", "ptrans", "area"]
+REGION_SIZE_KM = 10.0  # 合成する領域の一辺[km]
+
+
+def run_stage(name: str, args: argparse.Namespace):
+    """ステージを1つ実行する"""
+    if name == "car":
+        import car_search
+
+        stops = synthetic_region.make_points(args.stops, "stop", REGION_SIZE_KM, args.seed)
+        car_search.search_all_pairs(stops)
+    elif name == "ptrans":
+        import ptrans_search
+
+        spots = synthetic_region.make_points(args.spots, "spot", REGION_SIZE_KM, args.seed)
+        stops = synthetic_region.make_points(args.stops, "stop", REGION_SIZE_KM, args.seed)
+        ptrans_search.execute(spots, stops, ptrans_search.MAX_WALK_DISTANCE_M)
+    elif name == "area":
+        import area_search
+
+        features = synthetic_region.make_mesh_features(REGION_SIZE_KM, args.seed)
+        mesh_index = area_search.make_mesh_index([area_search.Mesh(f) for f in features])
+        for spot in synthetic_region.make_points(args.area_spots, "spot", REGION_SIZE_KM, args.seed):
+            area_search.exec_single_spot(spot, mesh_index)
+    else:
+        raise ValueError(f"unknown stage: {name}")
+
+
+def summarize(name: str, client, elapsed_s: float) -> dict:
+    latencies_ms = np.array(client.latencies_s) * 1000
+    has_latency = len(latencies_ms) > 0
+    return {
+        "stage": name,
+        "requests": client.request_count,
+        "failed_attempts": client.failure_count,
+        "wall_time_s": elapsed_s,
+        "requests_per_s": client.request_count / elapsed_s if elapsed_s > 0 else 0.0,
+        "p50_ms": float(np.percentile(latencies_ms, 50)) if has_latency else None,
+        "p99_ms": float(np.percentile(latencies_ms, 99)) if has_latency else None,
+    }
+
+
+def format_ms(value: float) -> str:
+    return f"{value:8.1f}" if value is not None else "       -"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="探索処理のOTP負荷ベンチマーク")
+    parser.add_argument("--base-url", help="問い合わせるOTPのURL（省略時はスタブを起動）")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES)
+    parser.add_argument("--spots", type=int, default=5, help="公共交通探索の出発地の数")
+    parser.add_argument("--stops", type=int, default=40, help="バス停の数")
+    parser.add_argument("--area-spots", type=int, default=2, help="到達圏探索を行うスポットの数")
+    parser.add_argument("--output", help="結果を書き出すJSONファイル")
+    otp_stub.add_stub_arguments(parser)
+    args = parser.parse_args()
+    if args.seed is None:
+        args.seed = 0
+
+    stub = None
+    base_url = args.base_url
+    if base_url is None:
+        stub = otp_stub.start_stub(**otp_stub.stub_options(args))
+        base_url = stub.base_url
+
+    # 共有クライアントを作る前に接続先を設定する
+    os.environ["OTP_BASE_URL"] = base_url
+    os.environ["OTP_CACHE_DISABLE"] = "1"
+    import otp_client
+
+    client = otp_client.get_client()
+    results = []
+    for name in args.stages:
+        client.reset_stats()
+        start_time = time.perf_counter()
+        run_stage(name, args)
+        results.append(summarize(name, client, time.perf_counter() - start_time))
+
+    if stub is not None:
+        stub.shutdown()
+        stub.server_close()
+
+    print("stage    requests  failed   req/s   p50[ms]  p99[ms]  wall[s]")
+    for r in results:
+        print(
+            f"{r['stage']:<8} {r['requests']:8d} {r['failed_attempts']:7d} "
+            f"{r['requests_per_s']:7.1f} {format_ms(r['p50_ms'])} "
+            f"{format_ms(r['p99_ms'])} {r['wall_time_s']:8.2f}"
+        )
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"base_url": base_url, "args": vars(args), "results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
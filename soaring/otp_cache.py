@@ -0,0 +1,270 @@
+import sys
+import os
+import json
+import time
+import zlib
+import sqlite3
+import fnmatch
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = "work/cache/otp_cache.sqlite3"
+DEFAULT_GRAPH_DIR = "work/input"
+MAX_ENTRIES = 2_000_000  # これを超えたら最終アクセスが古いものから削除する
+EVICT_INTERVAL = 10_000  # 何件書き込むごとに削除判定を行うか
+BUSY_TIMEOUT_S = 30.0  # 他のプロセスが書き込み中のとき、ロックの解放を待つ時間[秒]
+TOUCH_FLUSH_COUNT = 10_000  # ヒットしたキーがこの件数たまったら最終アクセス時刻を書き込む
+TOUCH_FLUSH_INTERVAL_S = 30.0  # 前回からこの秒数が経っても書き込む
+COORD_DIGITS = 6  # キーに使う座標の丸め桁数（約0.1m）
+PLACE_KEYS = ("fromPlace", "toPlace")
+# 応答の "error" の id のうち、一時的な障害を表すもの（REQUEST_TIMEOUT, SYSTEM_ERROR, GRAPH_UNAVAILABLE）。
+# これ以外（PATH_NOT_FOUND, OUTSIDE_BOUNDS など）は同じグラフなら同じ結果になるため保存する
+TRANSIENT_ERROR_IDS = {408, 500, 503}
+# OTPグラフを決めるファイル（OSM, GTFS, ビルド済みのグラフ）。人口データなど他の入力は含めない
+GRAPH_FILE_PATTERNS = ("*.osm.pbf", "*.zip", "Graph.obj")
+
+
+def graph_identity(graph_dir: str = DEFAULT_GRAPH_DIR) -> str:
+    """
+    OTPグラフを決めるファイル（GRAPH_FILE_PATTERNS）の名前・サイズ・更新時刻から
+    グラフの識別子を計算する
+    """
+    h = hashlib.sha1()
+    if os.path.isdir(graph_dir):
+        for name in sorted(os.listdir(graph_dir)):
+            path = os.path.join(graph_dir, name)
+            if not os.path.isfile(path):
+                continue
+            if not any(fnmatch.fnmatch(name, pattern) for pattern in GRAPH_FILE_PATTERNS):
+                continue
+            stat = os.stat(path)
+            h.update(f"{name}:{stat.st_size}:{int(stat.st_mtime)}\n".encode())
+    return h.hexdigest()
+
+
+def is_cacheable(data: dict) -> bool:
+    """
+    OTPの応答をキャッシュしてよいか。正常な応答と、id が一時的な障害を表さないエラー応答が対象。
+    通信の失敗やHTTPエラーはそもそも保存されない（OtpClient.plan は成功した応答だけを渡す）
+    """
+    error = data.get("error")
+    if error is None:
+        return True
+    return isinstance(error, dict) and error.get("id") not in (None, *TRANSIENT_ERROR_IDS)
+
+
+def _round_place(place: str) -> str:
+    lat, lon = place.split(",")
+    return f"{float(lat):.{COORD_DIGITS}f},{float(lon):.{COORD_DIGITS}f}"
+
+
+def make_key(path: str, params: dict) -> str:
+    """OTPのパスとクエリパラメータからキャッシュキーを作る"""
+    normalized = {}
+    for k, v in params.items():
+        if k in PLACE_KEYS:
+            v = _round_place(v)
+        normalized[k] = str(v)
+    payload = json.dumps([path, normalized], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+class OtpCache:
+    """
+    OTPのレスポンスをSQLiteに永続化するキャッシュ。
+    グラフの識別子が異なるエントリはミス扱いとし、開いた時点で削除する。
+    複数スレッドから共有して利用できる。
+    書き込みは1件ごとにコミットし、同じファイルを開いた他のプロセスの書き込みを妨げない。
+    """
+
+    def __init__(
+        self,
+        cache_path: str = DEFAULT_CACHE_PATH,
+        graph_dir: str = DEFAULT_GRAPH_DIR,
+        max_entries: int = MAX_ENTRIES,
+    ):
+        os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+        self.cache_path = cache_path
+        self.graph_id = graph_identity(graph_dir)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        self._touched = set()
+        self._last_flush = time.monotonic()
+        self._conn = sqlite3.connect(
+            cache_path, timeout=BUSY_TIMEOUT_S, check_same_thread=False
+        )
+        self._conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT_S * 1000)}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WALではコミットごとのfsyncを省いても、クラッシュでデータベースが壊れることはない
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY,"
+            " graph_id TEXT NOT NULL,"
+            " value BLOB NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_access ON entries(last_access)"
+        )
+        self.purged_on_open = self.purge_stale()
+
+    def get(self, path: str, params: dict):
+        """キャッシュされたレスポンスを返す。なければNone"""
+        key = make_key(path, params)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND graph_id = ?",
+                (key, self.graph_id),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched.add(key)
+            if (
+                len(self._touched) >= TOUCH_FLUSH_COUNT
+                or time.monotonic() - self._last_flush >= TOUCH_FLUSH_INTERVAL_S
+            ):
+                self._flush_touched()
+                self._conn.commit()
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, path: str, params: dict, data: dict):
+        """
+        レスポンスをキャッシュに保存する。
+        OTPがエラーを返した応答のうち、経路が見つからない・範囲外などの決まった結果は保存し、
+        一時的な障害の可能性があるもの（is_cacheable を参照）は保存しない
+        """
+        if not is_cacheable(data):
+            return
+        key = make_key(path, params)
+        value = zlib.compress(json.dumps(data, ensure_ascii=False).encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (key, self.graph_id, value, time.time()),
+            )
+            self.stores += 1
+            # 書き込みロックを持ち続けないよう、1件ごとにコミットする
+            self._conn.commit()
+            if self.stores % EVICT_INTERVAL == 0:
+                self._evict()
+                self._conn.commit()
+
+    def purge_stale(self) -> int:
+        """現在のグラフと異なるグラフで得たエントリを削除する"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM entries WHERE graph_id != ?", (self.graph_id,)
+            )
+            self._conn.commit()
+        return cursor.rowcount
+
+    def clear(self):
+        """すべてのエントリを削除する"""
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def _evict(self):
+        """最終アクセスが古いエントリから削除し、max_entries件以下に保つ"""
+        self._flush_touched()
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        overflow = count - self.max_entries
+        if overflow > 0:
+            self._conn.execute(
+                "DELETE FROM entries WHERE key IN"
+                " (SELECT key FROM entries ORDER BY last_access LIMIT ?)",
+                (overflow,),
+            )
+
+    def _flush_touched(self):
+        """ヒットしたエントリの最終アクセス時刻をまとめて更新する"""
+        self._last_flush = time.monotonic()
+        if not self._touched:
+            return
+        now = time.time()
+        self._conn.executemany(
+            "UPDATE entries SET last_access = ? WHERE key = ?",
+            [(now, key) for key in self._touched],
+        )
+        self._touched.clear()
+
+    def count(self) -> int:
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()
+        return count
+
+    def report(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = (self.hits / total * 100) if total else 0.0
+        return (
+            f"OTP cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.1f}% hit rate), {self.stores} stored"
+        )
+
+    def close(self):
+        with self._lock:
+            self._evict()
+            self._conn.commit()
+            self._conn.close()
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    スクリプト間で共有するキャッシュを返す。
+    環境変数 OTP_CACHE_DISABLE=1 の場合はNoneを返す。
+    """
+    global _default_cache
+    if os.environ.get("OTP_CACHE_DISABLE") == "1":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = OtpCache(
+                os.environ.get("OTP_CACHE_PATH", DEFAULT_CACHE_PATH),
+                os.environ.get("OTP_GRAPH_DIR", DEFAULT_GRAPH_DIR),
+            )
+    return _default_cache
+
+
+def close_cache():
+    """共有キャッシュの統計を出力して閉じる"""
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            return
+        print(_default_cache.report())
+        _default_cache.close()
+        _default_cache = None
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "purge", "clear"):
+        print("Usage: python otp_cache.py <stats|purge|clear> [cache_path] [graph_dir]")
+        sys.exit(1)
+
+    command = sys.argv[1]
+    cache_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_CACHE_PATH
+    graph_dir = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_GRAPH_DIR
+
+    # 開いた時点で古いグラフのエントリは削除される
+    cache = OtpCache(cache_path, graph_dir)
+    if command == "clear":
+        cache.clear()
+    elif command == "purge":
+        print(f"Purged {cache.purged_on_open} stale entries")
+    print(f"{cache.count()} entries in {cache_path} (graph {cache.graph_id[:12]})")
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
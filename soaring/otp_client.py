@@ -0,0 +1,259 @@
+"""
+Open Trip Plannerへの問い合わせを共通化したクライアント。
+接続を使い回すセッション、ジッタ付き指数バックオフによる再試行、
+全スレッド共通のリクエストレート上限、タイムアウトを備え、
+結果は成否・エラー内容を持つOtpResultとして返す。
+"""
+import os
+import time
+import random
+import sqlite3
+import threading
+import requests
+import otp_cache
+
+DEFAULT_BASE_URL = "http://localhost:8080"
+PLAN_PATH = "/otp/routers/default/plan"
+ISOCHRONE_PATH = "/otp/routers/default/isochrone"
+SURFACES_PATH = "/otp/surfaces"  # --analyst 付きで起動したOTPでのみ使える
+
+DEFAULT_TIMEOUT_S = 10  # 経路探索のタイムアウト[秒]
+ISOCHRONE_TIMEOUT_S = 120  # 到達圏探索のタイムアウト[秒]
+MAX_RETRIES = 3  # 失敗時の再試行回数
+BACKOFF_BASE_S = 0.5  # 再試行の待ち時間の基準[秒]
+BACKOFF_MAX_S = 10.0  # 再試行の待ち時間の上限[秒]
+POOL_SIZE = 32  # 使い回す接続の数
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+# 再試行する通信エラー（それ以外の requests の例外は再試行せずに失敗とする）
+RETRY_EXCEPTIONS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+)
+LATENCY_SAMPLE_SIZE = 10_000  # 応答時間の分位点を求めるために保持する標本の数
+# 問い合わせに使う日付（MM-DD-YYYY）。実行日で変わるとキャッシュが効かないため固定し、
+# 環境変数 OTP_SERVICE_DATE で変更する（GTFSの有効期間内の日付にすること）
+DEFAULT_SERVICE_DATE = "10-09-2025"
+
+
+class OtpResult:
+    """OTPへの問い合わせ結果"""
+
+    def __init__(
+        self,
+        data: dict = None,
+        error: str = None,
+        status: int = None,
+        attempts: int = 0,
+        elapsed_s: float = 0.0,
+    ):
+        self.data = data
+        self.error = error
+        self.status = status
+        self.attempts = attempts
+        self.elapsed_s = elapsed_s
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class OtpError(Exception):
+    """OTPへの問い合わせが再試行しても失敗した"""
+
+    def __init__(self, result: OtpResult):
+        super().__init__(
+            f"OTP request failed after {result.attempts} attempts: {result.error}"
+        )
+        self.result = result
+
+
+class RateLimiter:
+    """全スレッドで共有するリクエストレートの上限（max_rate回/秒）"""
+
+    def __init__(self, max_rate: float = None):
+        self.interval = 1.0 / max_rate if max_rate else 0.0
+        self._next_time = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class OtpClient:
+    def __init__(
+        self,
+        base_url: str = DEFAULT_BASE_URL,
+        max_rate: float = None,
+        max_retries: int = MAX_RETRIES,
+        pool_size: int = POOL_SIZE,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_retries = max_retries
+        self.rate_limiter = RateLimiter(max_rate)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # 統計
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.failure_count = 0
+        self.latencies_s = []  # 応答時間の標本（リザーバサンプリングで最大 LATENCY_SAMPLE_SIZE 件）
+        self._sample_random = random.Random(0)
+
+    def get(self, path: str, params: dict, timeout: float = DEFAULT_TIMEOUT_S) -> OtpResult:
+        return self.request("GET", path, params, timeout)
+
+    def request(
+        self, method: str, path: str, params: dict, timeout: float = DEFAULT_TIMEOUT_S
+    ) -> OtpResult:
+        """
+        OTPにリクエストを送る。接続エラー・タイムアウト・応答の途中切断・429/5xxの場合は
+        ジッタ付き指数バックオフで再試行する。例外は送出せず、失敗はOtpResultのerrorで返す。
+        """
+        url = self.base_url + path
+        start_time = time.monotonic()
+        error = None
+        status = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                backoff = min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** (attempt - 1))
+                time.sleep(random.uniform(0, backoff))
+            self.rate_limiter.acquire()
+            request_start = time.monotonic()
+            retryable = True
+            try:
+                response = self.session.request(method, url, params=params, timeout=timeout)
+                status = response.status_code
+                if status == 200:
+                    data = response.json()
+                    self._record(time.monotonic() - request_start, ok=True)
+                    return OtpResult(
+                        data=data,
+                        status=status,
+                        attempts=attempt + 1,
+                        elapsed_s=time.monotonic() - start_time,
+                    )
+                error = f"HTTP {status}"
+                retryable = status in RETRY_STATUS_CODES
+            except requests.RequestException as e:
+                # JSONとして読めない応答（requests.JSONDecodeError）もここで再試行せずに失敗とする
+                error = f"{type(e).__name__}: {e}"
+                retryable = isinstance(e, RETRY_EXCEPTIONS)
+            except ValueError as e:
+                error = f"invalid JSON response: {e}"
+                retryable = False
+            self._record(time.monotonic() - request_start, ok=False)
+            if not retryable:
+                break
+
+        return OtpResult(
+            error=error,
+            status=status,
+            attempts=attempt + 1,
+            elapsed_s=time.monotonic() - start_time,
+        )
+
+    def plan(self, params: dict, use_cache: bool = True) -> OtpResult:
+        """
+        経路探索を行う。成功した応答は共有キャッシュに保存する。
+        キャッシュの読み書きに失敗した場合はミス・保存なしとして扱い、探索自体は失敗させない
+        """
+        cache = otp_cache.get_cache() if use_cache else None
+        cache_url = self.base_url + PLAN_PATH
+        if cache:
+            try:
+                data = cache.get(cache_url, params)
+            except sqlite3.Error as e:
+                print(f"OTP cache read failed: {e}")
+                data = None
+            if data is not None:
+                return OtpResult(data=data, status=200)
+        result = self.get(PLAN_PATH, params)
+        if result.ok and cache:
+            try:
+                cache.put(cache_url, params, result.data)
+            except sqlite3.Error as e:
+                print(f"OTP cache write failed: {e}")
+        return result
+
+    def isochrone(self, params: dict) -> OtpResult:
+        """到達圏探索を行う。cutoffSecはリストで複数指定できる"""
+        return self.get(ISOCHRONE_PATH, params, timeout=ISOCHRONE_TIMEOUT_S)
+
+    def surface(self, params: dict) -> OtpResult:
+        """出発地からの所要時間サーフェスを作る。dataの "id" でサーフェスを参照する"""
+        return self.request("POST", SURFACES_PATH, params, timeout=ISOCHRONE_TIMEOUT_S)
+
+    def surface_indicator(self, surface_id, pointset_id: str) -> OtpResult:
+        """
+        サーフェスをポイントセットの各点で評価する。
+        dataの "times" がポイントセットの点の順に並んだ所要時間[秒]
+        """
+        return self.get(
+            f"{SURFACES_PATH}/{surface_id}/indicator",
+            {"targets": pointset_id, "detail": "true"},
+            timeout=ISOCHRONE_TIMEOUT_S,
+        )
+
+    def _record(self, latency_s: float, ok: bool):
+        with self._lock:
+            self.request_count += 1
+            if not ok:
+                self.failure_count += 1
+            if len(self.latencies_s) < LATENCY_SAMPLE_SIZE:
+                self.latencies_s.append(latency_s)
+            else:
+                # これまでの全リクエストから一様に標本が選ばれるよう置き換える
+                i = self._sample_random.randrange(self.request_count)
+                if i < LATENCY_SAMPLE_SIZE:
+                    self.latencies_s[i] = latency_s
+
+    def reset_stats(self):
+        with self._lock:
+            self.request_count = 0
+            self.failure_count = 0
+            self.latencies_s = []
+
+    def report(self) -> str:
+        with self._lock:
+            return (
+                f"OTP client: {self.request_count} requests, "
+                f"{self.failure_count} failed attempts"
+            )
+
+
+def service_date() -> str:
+    return os.environ.get("OTP_SERVICE_DATE", DEFAULT_SERVICE_DATE)
+
+
+_default_client = None
+_default_client_lock = threading.Lock()
+
+
+def get_client() -> OtpClient:
+    """
+    スクリプト間で共有するクライアントを返す。
+    接続先は環境変数 OTP_BASE_URL、レート上限[回/秒]は OTP_MAX_RATE で変更できる。
+    """
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            max_rate = os.environ.get("OTP_MAX_RATE")
+            _default_client = OtpClient(
+                os.environ.get("OTP_BASE_URL", DEFAULT_BASE_URL),
+                max_rate=float(max_rate) if max_rate else None,
+            )
+    return _default_client
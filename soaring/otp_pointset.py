@@ -0,0 +1,40 @@
+"""
+参照点をOTPのポイントセット（CSV）として書き出す。
+OTPを `--analyst --pointSets <ディレクトリ>` 付きで起動すると、ファイル名（拡張子なし）を
+IDとしてポイントセットが読み込まれ、サーフェスをまとめて評価できるようになる。
+評価結果は点の順に並ぶため、参照点は ref_points.json と同じ順で書き出す。
+
+使い方:
+    python soaring/otp_pointset.py <ref_points.json> <pointsets_dir>
+"""
+import os
+import sys
+import csv
+import json
+
+REFPOINT_POINTSET_ID = "refpoints"
+
+
+def write_pointset(points: list[dict], output_path: str):
+    """地点のリストを lat,lon 列のCSVとして書き出す"""
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["lat", "lon"])
+        for point in points:
+            writer.writerow([point["lat"], point["lon"]])
+
+
+def main(input_refpoint_path: str, output_dir: str):
+    with open(input_refpoint_path, "r", encoding="utf-8") as f:
+        refpoints = json.load(f).get("ref-points", [])
+    output_path = os.path.join(output_dir, f"{REFPOINT_POINTSET_ID}.csv")
+    write_pointset(refpoints, output_path)
+    print(f"Wrote {len(refpoints)} points to {output_path}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python otp_pointset.py <ref_points.json> <pointsets_dir>")
+        sys.exit(1)
+    main(sys.argv[1], sys.argv[2])
@@ -0,0 +1,417 @@
+"""
+Open Trip Plannerの代わりに経路探索・到達圏探索に応答するローカルHTTPサーバ。
+OTPを起動せずに探索処理を動かしたり、負荷を測ったりするために使う。
+
+モード:
+    synthetic : 直線距離から合成したレスポンスを返す
+    record    : 実際のOTP（--upstream）に中継し、レスポンスをJSON Linesに記録する
+    replay    : 記録したレスポンスを返す（記録にないリクエストは404、--fallbackなら合成）
+
+サーフェス（/otp/surfaces）はモードによらず合成して返す。評価先のポイントセットは
+--pointsets で指定したディレクトリのCSV（lat,lon列、ファイル名がID）から読み込む。
+
+いずれのモードでも、応答時間（対数正規分布）とエラー（HTTPエラー・無応答）を
+指定した割合で発生させられる。
+
+使い方:
+    python soaring/otp_stub.py [--port 8080] [--mode synthetic|record|replay]
+        [--record-path otp_record.jsonl] [--upstream http://localhost:8080]
+        [--latency-ms 50] [--latency-sigma 0.5] [--error-rate 0.0]
+        [--error-status 503] [--hang-rate 0.0] [--hang-s 30] [--seed 0]
+        [--pointsets DIR]
+"""
+import os
+import re
+import sys
+import csv
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import http.server
+import urllib.parse
+import requests
+import polyline
+
+PLAN_PATH = "/otp/routers/default/plan"
+ISOCHRONE_PATH = "/otp/routers/default/isochrone"
+SURFACES_PATH = "/otp/surfaces"
+INDICATOR_PATH = re.compile(r"^/otp/surfaces/(\d+)/indicator$")
+
+EARTH_RADIUS_M = 6_371_000
+DETOUR_FACTOR = 1.3  # 直線距離に対する道のりの比
+WALK_SPEED_MPS = 1.2  # 徒歩の速さ[m/s]
+CAR_SPEED_MPS = 10.0  # 車の速さ[m/s]
+TRANSIT_SPEED_MPS = 6.0  # 公共交通の速さ[m/s]
+TRANSIT_WAIT_S = 600  # 公共交通の待ち時間[秒]
+ISOCHRONE_VERTICES = 64  # 到達圏の円の頂点数
+IGNORED_KEY_PARAMS = ("date",)  # 記録の照合で無視するパラメータ
+
+
+def parse_place(place: str) -> tuple[float, float]:
+    lat, lon = place.split(",")
+    return float(lat), float(lon)
+
+
+def distance_m(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """2点間の大円距離[m]"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def request_key(path: str, query: list[tuple[str, str]]) -> str:
+    """記録と照合するためのキー（パラメータの順序と日付の違いを無視する）"""
+    pairs = sorted((k, v) for k, v in query if k not in IGNORED_KEY_PARAMS)
+    return path + "?" + urllib.parse.urlencode(pairs)
+
+
+def make_leg(mode: str, start: tuple, end: tuple, leg_distance_m: float, speed_mps: float) -> dict:
+    return {
+        "mode": mode,
+        "from": {"name": "", "lat": start[0], "lon": start[1]},
+        "to": {"name": "", "lat": end[0], "lon": end[1]},
+        "duration": leg_distance_m / speed_mps,
+        "distance": leg_distance_m,
+        "legGeometry": {"points": polyline.encode([start, end])},
+    }
+
+
+def synthetic_plan(params: dict) -> dict:
+    """
+    直線距離から経路探索のレスポンスを合成する。
+    CARなら車の1区間、徒歩圏内なら徒歩の1区間、それ以外は徒歩・バス・徒歩の3区間。
+    """
+    start = parse_place(params["fromPlace"])
+    end = parse_place(params["toPlace"])
+    mode = params.get("mode", "WALK,TRANSIT")
+    max_walk_m = float(params.get("maxWalkDistance", 1000))
+    total_m = distance_m(*start, *end) * DETOUR_FACTOR
+
+    if "CAR" in mode:
+        legs = [make_leg("CAR", start, end, total_m, CAR_SPEED_MPS)]
+    elif total_m <= max_walk_m:
+        legs = [make_leg("WALK", start, end, total_m, WALK_SPEED_MPS)]
+    else:
+        walk_m = min(max_walk_m / 2, total_m * 0.1)
+        ratio = walk_m / total_m
+        stop1 = tuple(s + (e - s) * ratio for s, e in zip(start, end))
+        stop2 = tuple(e + (s - e) * ratio for s, e in zip(start, end))
+        legs = [
+            make_leg("WALK", start, stop1, walk_m, WALK_SPEED_MPS),
+            make_leg("BUS", stop1, stop2, total_m - 2 * walk_m, TRANSIT_SPEED_MPS),
+            make_leg("WALK", stop2, end, walk_m, WALK_SPEED_MPS),
+        ]
+
+    walk_distance = sum(leg["distance"] for leg in legs if leg["mode"] == "WALK")
+    itinerary = {
+        "duration": sum(leg["duration"] for leg in legs),
+        "walkDistance": walk_distance,
+        "legs": legs,
+    }
+    return {"plan": {"itineraries": [itinerary]}}
+
+
+def isochrone_radius_m(time_s: float, max_walk_m: float) -> float:
+    """所要時間・徒歩距離の上限に対して単調に広がる到達圏の半径[m]"""
+    walk_m = min(max_walk_m, WALK_SPEED_MPS * time_s)
+    transit_m = TRANSIT_SPEED_MPS * max(0.0, time_s - TRANSIT_WAIT_S) * min(1.0, max_walk_m / 1000)
+    return walk_m + transit_m
+
+
+def synthetic_isochrone(params: dict, vertices: int = ISOCHRONE_VERTICES) -> dict:
+    """出発地を中心とする円を到達圏とするレスポンスを合成する。featuresはcutoffSecの順"""
+    lat, lon = parse_place(params["fromPlace"])
+    max_walk_m = float(params.get("maxWalkDistance", 1000))
+    cutoffs = params.get("cutoffSec", [])
+    if not isinstance(cutoffs, list):
+        cutoffs = [cutoffs]
+
+    m_per_deg_lat = math.pi * EARTH_RADIUS_M / 180
+    m_per_deg_lon = m_per_deg_lat * math.cos(math.radians(lat))
+    features = []
+    for cutoff in cutoffs:
+        radius_m = isochrone_radius_m(float(cutoff), max_walk_m)
+        geometry = None
+        if radius_m > 0:
+            ring = [
+                [
+                    lon + radius_m * math.cos(2 * math.pi * i / vertices) / m_per_deg_lon,
+                    lat + radius_m * math.sin(2 * math.pi * i / vertices) / m_per_deg_lat,
+                ]
+                for i in range(vertices)
+            ]
+            ring.append(ring[0])
+            geometry = {"type": "MultiPolygon", "coordinates": [[ring]]}
+        features.append(
+            {"type": "Feature", "geometry": geometry, "properties": {"time": int(cutoff)}}
+        )
+    return {"type": "FeatureCollection", "features": features}
+
+
+def synthetic_surface_times(params: dict, points: list[tuple[float, float]]) -> list[int]:
+    """サーフェスを各点で評価した所要時間[秒]。cutoffMinutesを超える点は-1"""
+    cutoff_s = float(params.get("cutoffMinutes", 90)) * 60
+    times = []
+    for lat, lon in points:
+        plan = synthetic_plan({**params, "toPlace": f"{lat},{lon}"})
+        duration = plan["plan"]["itineraries"][0]["duration"]
+        times.append(int(duration) if duration <= cutoff_s else -1)
+    return times
+
+
+def load_pointsets(pointsets_dir: str) -> dict:
+    """ディレクトリ内のCSVをポイントセットとして読み込む"""
+    pointsets = {}
+    for name in sorted(os.listdir(pointsets_dir)):
+        pointset_id, ext = os.path.splitext(name)
+        if ext.lower() != ".csv":
+            continue
+        with open(os.path.join(pointsets_dir, name), encoding="utf-8") as f:
+            pointsets[pointset_id] = [
+                (float(row["lat"]), float(row["lon"])) for row in csv.DictReader(f)
+            ]
+    return pointsets
+
+
+class OtpStubServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        mode: str = "synthetic",
+        record_path: str = None,
+        upstream: str = None,
+        fallback: bool = False,
+        latency_ms: float = 0.0,
+        latency_sigma: float = 0.5,
+        error_rate: float = 0.0,
+        error_status: list[int] = (503,),
+        hang_rate: float = 0.0,
+        hang_s: float = 30.0,
+        seed: int = None,
+        pointsets_dir: str = None,
+    ):
+        super().__init__(address, OtpStubHandler)
+        if mode not in ("synthetic", "record", "replay"):
+            raise ValueError(f"unknown mode: {mode}")
+        if mode == "record" and not (record_path and upstream):
+            raise ValueError("record mode needs record_path and upstream")
+        self.mode = mode
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.fallback = fallback
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_status = list(error_status)
+        self.hang_rate = hang_rate
+        self.hang_s = hang_s
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.request_count = 0
+        self.error_count = 0
+
+        self.pointsets = load_pointsets(pointsets_dir) if pointsets_dir else {}
+        self.surfaces = {}
+
+        self.records = {}
+        self._record_file = None
+        if mode == "replay":
+            with open(record_path, encoding="utf-8") as f:
+                for line in f:
+                    record = json.loads(line)
+                    self.records[record["key"]] = (record["status"], record["response"])
+            print(f"Loaded {len(self.records)} recorded responses")
+        elif mode == "record":
+            self._record_file = open(record_path, "a", encoding="utf-8")
+            self._session = requests.Session()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def draw_fault(self) -> tuple[float, int, bool]:
+        """(応答までの待ち時間[秒], エラーのステータス（なければNone）, 無応答か) を決める"""
+        with self._lock:
+            self.request_count += 1
+            delay_s = 0.0
+            if self.latency_ms > 0:
+                delay_s = self._random.lognormvariate(
+                    math.log(self.latency_ms / 1000), self.latency_sigma
+                )
+            hang = self._random.random() < self.hang_rate
+            status = None
+            if not hang and self._random.random() < self.error_rate:
+                status = self._random.choice(self.error_status)
+            if hang or status:
+                self.error_count += 1
+        return delay_s, status, hang
+
+    def respond_surface(self, path: str, params: dict) -> tuple[int, dict]:
+        """サーフェスの作成・評価に応答する"""
+        if path == SURFACES_PATH:
+            with self._lock:
+                surface_id = len(self.surfaces)
+                self.surfaces[surface_id] = params
+            return 200, {"id": surface_id}
+        surface = self.surfaces.get(int(INDICATOR_PATH.match(path).group(1)))
+        points = self.pointsets.get(params.get("targets"))
+        if surface is None or points is None:
+            return 404, {"error": "unknown surface or pointset"}
+        return 200, {"id": params["targets"], "times": synthetic_surface_times(surface, points)}
+
+    def respond(self, path: str, query: list[tuple[str, str]]) -> tuple[int, dict]:
+        """モードに応じて (ステータス, レスポンス) を返す"""
+        # cutoffSecのように繰り返し指定されるパラメータはリストにまとめる
+        params = {}
+        for k, v in query:
+            params.setdefault(k, []).append(v)
+        params = {k: v if len(v) > 1 or k == "cutoffSec" else v[0] for k, v in params.items()}
+
+        if path == SURFACES_PATH or INDICATOR_PATH.match(path):
+            return self.respond_surface(path, params)
+
+        if self.mode == "record":
+            response = self._session.get(self.upstream + path, params=query, timeout=600)
+            data = response.json() if response.ok else {"error": response.text}
+            line = json.dumps(
+                {"key": request_key(path, query), "status": response.status_code, "response": data}
+            )
+            with self._lock:
+                self._record_file.write(line + "\n")
+                self._record_file.flush()
+            return response.status_code, data
+
+        if self.mode == "replay":
+            record = self.records.get(request_key(path, query))
+            if record is not None:
+                return record
+            if not self.fallback:
+                return 404, {"error": "no recorded response"}
+
+        if path == PLAN_PATH:
+            return 200, synthetic_plan(params)
+        return 200, synthetic_isochrone(params)
+
+    def server_close(self):
+        super().server_close()
+        if self._record_file:
+            self._record_file.close()
+
+
+class OtpStubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-aliveに対応する
+    disable_nagle_algorithm = True  # ヘッダと本文を分けて送っても遅延させない
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path not in (PLAN_PATH, ISOCHRONE_PATH) and not INDICATOR_PATH.match(url.path):
+            self.send_json(404, {"error": f"unknown path: {url.path}"})
+            return
+        self.handle_request(url)
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        self.rfile.read(length)
+        if url.path != SURFACES_PATH:
+            self.send_json(404, {"error": f"unknown path: {url.path}"})
+            return
+        self.handle_request(url)
+
+    def handle_request(self, url: urllib.parse.SplitResult):
+        delay_s, error_status, hang = self.server.draw_fault()
+        if hang:
+            time.sleep(self.server.hang_s)
+            self.close_connection = True
+            return
+        time.sleep(delay_s)
+        if error_status:
+            self.send_json(error_status, {"error": "injected error"})
+            return
+
+        query = urllib.parse.parse_qsl(url.query)
+        try:
+            status, data = self.server.respond(url.path, query)
+        except Exception as e:
+            status, data = 500, {"error": str(e)}
+        self.send_json(status, data)
+
+    def send_json(self, status: int, data: dict):
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, **options) -> OtpStubServer:
+    """スタブをバックグラウンドのスレッドで起動する。port=0なら空いているポートを使う"""
+    server = OtpStubServer((host, port), **options)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--record-path", help="記録ファイル（JSON Lines）")
+    parser.add_argument("--upstream", help="recordモードで中継するOTPのURL")
+    parser.add_argument("--fallback", action="store_true", help="replayで記録にないリクエストを合成で返す")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="応答時間の中央値[ms]")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="応答時間の対数の標準偏差")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="HTTPエラーを返す割合")
+    parser.add_argument("--error-status", type=int, nargs="+", default=[503])
+    parser.add_argument("--hang-rate", type=float, default=0.0, help="応答しない割合")
+    parser.add_argument("--hang-s", type=float, default=30.0, help="応答しない場合に待つ時間[秒]")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--pointsets", help="サーフェスの評価先とするポイントセット（CSV）のディレクトリ")
+
+
+def stub_options(args: argparse.Namespace) -> dict:
+    return {
+        "mode": args.mode,
+        "record_path": args.record_path,
+        "upstream": args.upstream,
+        "fallback": args.fallback,
+        "latency_ms": args.latency_ms,
+        "latency_sigma": args.latency_sigma,
+        "error_rate": args.error_rate,
+        "error_status": args.error_status,
+        "hang_rate": args.hang_rate,
+        "hang_s": args.hang_s,
+        "seed": args.seed,
+        "pointsets_dir": args.pointsets,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OTPの代わりに応答するローカルサーバ")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = OtpStubServer((args.host, args.port), **stub_options(args))
+    print(f"OTP stub ({args.mode}) listening on {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"{server.request_count} requests, {server.error_count} injected errors")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
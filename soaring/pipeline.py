@@ -0,0 +1,430 @@
+"""
+コンバート処理（make convert-all）をステージのDAGとして実行するオーケストレータ。
+
+各ステージの入力ファイル・スクリプト（importしているsoaring内のモジュールを含む）・
+パラメータ・OTPグラフの内容からハッシュを計算し、
+前回実行時と同じで出力も揃っていればそのステージをスキップする。
+依存関係が満たされたステージは並行して実行する
+（car-search, ptrans-search, area-search はいずれも select-spots にのみ依存する）。
+"""
+import os
+import ast
+import sys
+import json
+import time
+import shutil
+import threading
+import hashlib
+import zipfile
+import argparse
+import subprocess
+import concurrent.futures
+import otp_client
+import otp_cache
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+STATE_FILE_NAME = ".pipeline_state.json"
+
+
+class Stage:
+    def __init__(
+        self,
+        name: str,
+        deps: list[str],
+        inputs: list[str],
+        outputs: list[str],
+        commands: list,
+        params: dict = None,
+        graph_dir: str = None,
+        env: dict = None,
+    ):
+        self.name = name
+        self.deps = deps
+        self.inputs = inputs
+        self.outputs = outputs
+        # コマンドは引数のリスト（サブプロセスで実行）または引数なしの関数
+        self.commands = commands
+        self.params = params or {}
+        # OTPに問い合わせるステージはグラフの識別子もハッシュに含める
+        self.graph_dir = graph_dir
+        # サブプロセスに追加で渡す環境変数（出力に影響しないものだけ。ハッシュには含めない）
+        self.env = env or {}
+
+    def scripts(self) -> list[str]:
+        """コマンドから参照されているスクリプトのパス"""
+        return [
+            arg
+            for command in self.commands
+            if isinstance(command, list)
+            for arg in command
+            if arg.endswith(".py")
+        ]
+
+    def content_hash(self) -> str:
+        """
+        入力ファイル・スクリプト（とそこから読み込まれるsoaring内のモジュール）・
+        コマンド・パラメータ・OTPグラフの内容から計算したハッシュ
+        """
+        h = hashlib.sha256()
+        h.update(json.dumps(self.params, sort_keys=True).encode())
+        if self.graph_dir is not None:
+            h.update(otp_cache.graph_identity(self.graph_dir).encode())
+        for command in self.commands:
+            if isinstance(command, list):
+                h.update("\0".join(command).encode())
+            else:
+                h.update(command.__name__.encode())
+        for path in sorted(set(self.inputs) | local_modules(self.scripts())):
+            h.update(path.encode())
+            h.update(hash_file(path).encode())
+        return h.hexdigest()
+
+    def outputs_exist(self) -> bool:
+        return all(os.path.exists(path) for path in self.outputs)
+
+
+def local_modules(scripts: list[str]) -> set[str]:
+    """スクリプトと、そこから（間接的にも）importされている同じディレクトリのモジュールのパス"""
+    found = set()
+    pending = list(scripts)
+    while pending:
+        path = pending.pop()
+        if path in found or not os.path.isfile(path):
+            continue
+        found.add(path)
+        with open(path, encoding="utf-8") as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                names = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                names = [node.module]
+            else:
+                continue
+            for name in names:
+                module_path = os.path.join(os.path.dirname(path), name.split(".")[0] + ".py")
+                if os.path.isfile(module_path):
+                    pending.append(module_path)
+    return found
+
+
+def hash_file(path: str) -> str:
+    """ファイルの内容のハッシュ。存在しなければ空文字列"""
+    if not os.path.isfile(path):
+        return ""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def copy_files(pairs: list[tuple[str, str]]):
+    def copy():
+        for src, dst in pairs:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            shutil.copyfile(src, dst)
+
+    copy.__name__ = "copy_files"
+    return copy
+
+
+def remove_files(paths: list[str]):
+    def remove():
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    remove.__name__ = "remove_files"
+    return remove
+
+
+def remove_dirs(paths: list[str]):
+    def rmtree():
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    rmtree.__name__ = "remove_dirs"
+    return rmtree
+
+
+def zip_dir(dir_path: str, output_path: str):
+    """ディレクトリの中身をzipにまとめる"""
+
+    def archive():
+        with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zf:
+            for root, _, files in os.walk(dir_path):
+                for name in files:
+                    path = os.path.join(root, name)
+                    zf.write(path, os.path.relpath(path, dir_path))
+
+    archive.__name__ = "zip_dir"
+    return archive
+
+
+def build_stages(
+    target_area: str,
+    work_dir: str = "work",
+    static_dir: str = "static",
+    service_date: str = otp_client.DEFAULT_SERVICE_DATE,
+) -> list[Stage]:
+    """
+    Makefileの convert-all と同じ処理をステージとして定義する。
+    OTPに問い合わせるステージは問い合わせの日付をパラメータに持つ（変われば再実行する）
+    """
+    otp_params = {"service_date": service_date}
+    py = sys.executable
+    out = os.path.join(work_dir, "output")
+    archive = os.path.join(out, "archive")
+
+    def script(name: str) -> str:
+        return os.path.join(SCRIPT_DIR, name)
+
+    def a(name: str) -> str:
+        return os.path.join(archive, name)
+
+    def o(name: str) -> str:
+        return os.path.join(out, name)
+
+    graph_dir = os.path.join(work_dir, "input")
+    # 経路探索のステージは1つのOTPキャッシュを共有する（並行して書き込んでもよい）
+    otp_env = {
+        "OTP_CACHE_PATH": os.path.join(work_dir, "cache", "otp_cache.sqlite3"),
+        "OTP_GRAPH_DIR": graph_dir,
+    }
+    static_region = os.path.join(static_dir, f"target_region_{target_area}.json")
+    static_spots = os.path.join(static_dir, f"{target_area}_spot_list.json")
+    population_csv = os.path.join(work_dir, "input", "tblT001102Q06.txt")
+
+    return [
+        Stage(
+            "prepare",
+            deps=[],
+            inputs=[static_region, static_spots],
+            outputs=[a("target_region.json"), a("spot_list.json")],
+            commands=[
+                copy_files(
+                    [
+                        (static_region, a("target_region.json")),
+                        (static_spots, a("spot_list.json")),
+                    ]
+                )
+            ],
+            params={"target_area": target_area},
+        ),
+        Stage(
+            "generate-mesh",
+            deps=["prepare"],
+            inputs=[a("target_region.json"), population_csv],
+            outputs=[a("mesh.json"), o("mesh.kml")],
+            commands=[
+                [py, script("generate_mesh.py"), a("target_region.json"),
+                 population_csv, a("mesh.json"), o("mesh.kml")],
+            ],
+        ),
+        Stage(
+            "select-spots",
+            deps=["prepare", "generate-mesh"],
+            inputs=[a("target_region.json"), a("mesh.json"), a("spot_list.json")],
+            outputs=[a("combus_stops.json"), a("ref_points.json")],
+            commands=[
+                [py, script("select_bus_stop.py"), a("target_region.json"),
+                 a("mesh.json"), a("spot_list.json"), a("combus_stops.json"),
+                 o("combus_stops.kml")],
+                [py, script("select_ref_points.py"), a("target_region.json"),
+                 a("mesh.json"), a("ref_points.json"), o("ref_points.kml")],
+            ],
+        ),
+        Stage(
+            "car-search",
+            deps=["select-spots"],
+            inputs=[a("combus_stops.json")],
+            outputs=[a("combus_routes.json")],
+            commands=[
+                [py, script("car_search.py"), a("combus_stops.json"), archive],
+            ],
+            params=otp_params,
+            graph_dir=graph_dir,
+            env=otp_env,
+        ),
+        Stage(
+            "ptrans-search",
+            deps=["select-spots"],
+            inputs=[a("spot_list.json"), a("combus_stops.json"), a("ref_points.json")],
+            outputs=[a("all_routes.csv"), a("routes.bin"), a("route_geometries.bin")],
+            commands=[
+                # 組ごとの経路ファイルはルートストアに置き換えたため、以前の出力が残っていれば削除する
+                remove_dirs([a("route")]),
+                [py, script("ptrans_search.py"), a("spot_list.json"),
+                 a("combus_stops.json"), a("ref_points.json"), out,
+                 "--geometry-store", a("route_geometries.bin")],
+                [py, script("edit_routes.py"), o("spot_to_refpoints.json"),
+                 o("spot_to_stops.json"), o("stop_to_refpoints.json"),
+                 a("all_routes.csv"), a("routes.bin")],
+            ],
+            params=otp_params,
+            graph_dir=graph_dir,
+            env=otp_env,
+        ),
+        Stage(
+            "area-search",
+            deps=["select-spots"],
+            inputs=[a("combus_stops.json"), a("spot_list.json"), a("mesh.json")],
+            outputs=[a("geojsons.bin"), a("reachability.bin"), a("population_coverage.npz")],
+            commands=[
+                # 到達圏ごとの個別ファイルとその一覧はアーカイブに置き換えたため、以前の出力が残っていれば削除する
+                remove_dirs([a("geojson")]),
+                remove_files([a("all_geojsons.txt")]),
+                [py, script("area_search.py"), a("combus_stops.json"),
+                 a("spot_list.json"), a("mesh.json"), a("geojsons.bin"),
+                 o("first_reachable_times.npz"),
+                 "--reachability-index", a("reachability.bin"),
+                 "--population-coverage", a("population_coverage.npz")],
+            ],
+            params=otp_params,
+            graph_dir=graph_dir,
+        ),
+        Stage(
+            "archive",
+            deps=["car-search", "ptrans-search", "area-search"],
+            inputs=[
+                a("combus_routes.json"),
+                a("all_routes.csv"),
+                a("routes.bin"),
+                a("route_geometries.bin"),
+                a("geojsons.bin"),
+                a("reachability.bin"),
+                a("population_coverage.npz"),
+            ],
+            outputs=[o("archive.zip")],
+            commands=[zip_dir(archive, o("archive.zip"))],
+        ),
+    ]
+
+
+def run_stage(stage: Stage) -> float:
+    """ステージのコマンドを順に実行し、経過時間[秒]を返す"""
+    start_time = time.time()
+    env = {**os.environ, **stage.env}
+    for command in stage.commands:
+        if isinstance(command, list):
+            subprocess.run(command, check=True, env=env)
+        else:
+            command()
+    return time.time() - start_time
+
+
+def load_state(state_path: str) -> dict:
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_state(state_path: str, state: dict):
+    os.makedirs(os.path.dirname(state_path) or ".", exist_ok=True)
+    with open(state_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=4)
+
+
+def run_pipeline(
+    stages: list[Stage],
+    state_path: str,
+    targets: list[str] = None,
+    force: bool = False,
+    max_workers: int = 3,
+) -> dict:
+    """
+    依存関係の順にステージを実行する。依存の終わったステージは並行して実行し、
+    内容のハッシュが前回と同じで出力も揃っているステージはスキップする。
+    ステージ名から (状態, 経過時間[秒]) への辞書を返す。
+    """
+    stage_dict = {stage.name: stage for stage in stages}
+
+    # 対象ステージとその依存をすべて集める
+    selected = set()
+    pending_names = list(targets or stage_dict)
+    while pending_names:
+        name = pending_names.pop()
+        if name in selected:
+            continue
+        selected.add(name)
+        pending_names.extend(stage_dict[name].deps)
+
+    state = load_state(state_path)
+    state_lock = threading.Lock()
+    report = {}
+    done = set()
+    pending = [stage for stage in stages if stage.name in selected]
+
+    def start_stage(stage: Stage):
+        # 依存が終わった時点の入力でハッシュを計算する
+        content_hash = stage.content_hash()
+        with state_lock:
+            if not force and state.get(stage.name) == content_hash and stage.outputs_exist():
+                return "skipped", 0.0, content_hash
+            # 実行前に前回のハッシュを消しておき、途中で失敗したステージが次回スキップされないようにする
+            state.pop(stage.name, None)
+            save_state(state_path, state)
+        return "ran", run_stage(stage), stage.content_hash()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        running = {}
+        while pending or running:
+            for stage in [s for s in pending if all(d in done for d in s.deps if d in selected)]:
+                pending.remove(stage)
+                print(f"[pipeline] start {stage.name}")
+                running[executor.submit(start_stage, stage)] = stage
+
+            finished, _ = concurrent.futures.wait(
+                running, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in finished:
+                stage = running.pop(future)
+                status, elapsed, content_hash = future.result()
+                with state_lock:
+                    state[stage.name] = content_hash
+                    save_state(state_path, state)
+                report[stage.name] = (status, elapsed)
+                done.add(stage.name)
+                print(f"[pipeline] {status} {stage.name} ({elapsed:.1f}s)")
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コンバート処理をまとめて実行する")
+    parser.add_argument("--target-area", default="higashine")
+    parser.add_argument("--work-dir", default="work")
+    parser.add_argument("--static-dir", default="static")
+    parser.add_argument("--force", action="store_true", help="すべてのステージを再実行する")
+    parser.add_argument(
+        "--service-date",
+        default=otp_client.service_date(),
+        help="OTPに問い合わせる日付（MM-DD-YYYY）",
+    )
+    parser.add_argument("--max-workers", type=int, default=3, help="同時に実行するステージ数")
+    parser.add_argument("stages", nargs="*", help="実行するステージ（省略時はすべて）")
+    args = parser.parse_args()
+
+    # 各ステージのスクリプトは環境変数から日付を読む
+    os.environ["OTP_SERVICE_DATE"] = args.service_date
+    stages = build_stages(
+        args.target_area, args.work_dir, args.static_dir, args.service_date
+    )
+    state_path = os.path.join(args.work_dir, STATE_FILE_NAME)
+    start_time = time.time()
+    report = run_pipeline(
+        stages, state_path, args.stages or None, args.force, args.max_workers
+    )
+
+    print("stage            status   wall time")
+    for stage in stages:
+        if stage.name in report:
+            status, elapsed = report[stage.name]
+            print(f"{stage.name:<16} {status:<8} {elapsed:8.1f}s")
+    print(f"total                     {time.time() - start_time:8.1f}s")
+
+
+if __name__ == "__main__":
+    main()
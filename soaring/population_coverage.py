@@ -0,0 +1,96 @@
+"""
+到達圏がカバーする人口の集計表。
+最小到達時間区分の行列（area_search.calc_first_reachable_times）とメッシュ順の人口ベクトルから、
+    - coverage: スポットごと・(徒歩距離, 時間) の区分ごとのカバー人口
+    - union_coverage: スポットのグループ（hospital など入力JSONのキー）ごとに、
+      グループ内の先頭から順にスポットを加えていったときの和集合のカバー人口
+を求める。union_coverage の各グループの最後の行がグループ全体でのカバー人口になる。
+途中の行は入力JSONでのスポットの並び順に依存する（効果の大きい順などではない）ため、
+順序に意味のない入力ではグループの最後の行だけを使うこと。
+"""
+import numpy as np
+
+
+def coverage_by_bucket(first_times: np.ndarray, population: np.ndarray, time_count: int) -> np.ndarray:
+    """
+    (徒歩距離区分, メッシュ) の最小到達時間区分から、(徒歩距離区分, 時間区分) のカバー人口を求める。
+    最小到達時間区分ごとに人口を合計し、時間の方向に累積する
+    """
+    walk_count = first_times.shape[0]
+    buckets = np.minimum(first_times, time_count).astype(np.intp)  # 到達できないメッシュは time_count に寄せる
+    buckets += np.arange(walk_count)[:, None] * (time_count + 1)
+    sums = np.bincount(
+        buckets.ravel(),
+        weights=np.broadcast_to(population, first_times.shape).ravel(),
+        minlength=walk_count * (time_count + 1),
+    )
+    coverage = np.cumsum(sums.reshape(walk_count, time_count + 1)[:, :time_count], axis=1)
+    return coverage.astype(population.dtype)
+
+
+def spot_coverage(first_times: np.ndarray, population: np.ndarray, time_count: int) -> np.ndarray:
+    """(スポット, 徒歩距離区分, 時間区分) のカバー人口"""
+    if len(first_times) == 0:
+        return np.zeros((0, first_times.shape[1], time_count), dtype=population.dtype)
+    return np.stack(
+        [coverage_by_bucket(spot_first_times, population, time_count) for spot_first_times in first_times]
+    )
+
+
+def cumulative_union_coverage(
+    first_times: np.ndarray, population: np.ndarray, time_count: int, spot_indices
+) -> np.ndarray:
+    """spot_indices の順にスポットを加えていったときの、和集合の (徒歩距離区分, 時間区分) のカバー人口"""
+    union_first_times = None
+    coverages = []
+    for spot_index in spot_indices:
+        if union_first_times is None:
+            union_first_times = first_times[spot_index].copy()
+        else:
+            np.minimum(union_first_times, first_times[spot_index], out=union_first_times)
+        coverages.append(coverage_by_bucket(union_first_times, population, time_count))
+    if not coverages:
+        return np.zeros((0, first_times.shape[1], time_count), dtype=population.dtype)
+    return np.stack(coverages)
+
+
+def write_population_coverage(
+    first_times: np.ndarray,
+    spot_groups: dict[str, list[dict]],
+    population: np.ndarray,
+    time_limits_min: list[int],
+    walk_distances_m: list[int],
+    output_path: str,
+):
+    """
+    カバー人口の集計表を、軸のラベルと合わせてファイルに書き出す。
+    first_times のスポットの並びは spot_groups をグループの順に連結したものと同じであること。
+    union_coverage の group_offsets[g]〜group_offsets[g + 1] の行がグループgの累積の和集合で、
+    グループ全体のカバー人口は最後の行（group_offsets[g + 1] - 1）
+    """
+    time_count = len(time_limits_min)
+    group_sizes = [len(spots) for spots in spot_groups.values()]
+    group_offsets = np.concatenate([[0], np.cumsum(group_sizes)]).astype(np.int64)
+    walk_count = len(walk_distances_m)
+    union_coverage = [np.zeros((0, walk_count, time_count), dtype=population.dtype)]  # スポットがない場合
+    union_coverage += [
+        cumulative_union_coverage(first_times, population, time_count, range(start, end))
+        for start, end in zip(group_offsets[:-1], group_offsets[1:])
+    ]
+    np.savez(
+        output_path,
+        coverage=spot_coverage(first_times, population, time_count),
+        union_coverage=np.concatenate(union_coverage),
+        total_population=population.sum(),
+        spot_ids=np.array([spot["id"] for spots in spot_groups.values() for spot in spots]),
+        group_names=np.array(list(spot_groups.keys())),
+        group_offsets=group_offsets,
+        time_limits_min=np.array(time_limits_min),
+        walk_distances_m=np.array(walk_distances_m),
+    )
+
+
+def load_population_coverage(input_path: str) -> dict:
+    """write_population_coverageで書き出した集計表とラベルを読み込む"""
+    with np.load(input_path) as data:
+        return {key: data[key] for key in data.files}
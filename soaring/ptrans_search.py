@@ -1,13 +1,18 @@
 import json
-import requests
-import sys
-import datetime
-import polyline
+import argparse
+import collections
 import concurrent.futures
-import threading
+import itertools
+import contextlib
+import textwrap
 import os
+import otp_cache
+import otp_client
+from geometry_store import GeometryStoreWriter, merge_geometry
 
 MAX_WALK_DISTANCE_M = 1000  # 徒歩の最大距離[m]
+SUBMIT_WINDOW = 256  # 同時に投入しておく探索の数の上限
+SURFACE_CUTOFF_MIN = 180  # サーフェスを計算する所要時間の上限[分]
 
 
 def load_spots(json_path):
@@ -34,35 +39,26 @@ def load_refpoints(json_path):
     return data.get("ref-points", [])
 
 
-def merge_geometry(geometry_list: list[str]) -> str:
-    coords = []
-    for geom in geometry_list:
-        coords.extend(polyline.decode(geom))
-    merged_geom = polyline.encode(coords)
-    return merged_geom
-
-
 def get_travel_time(from_spot, to_stop, max_walk_distance_m: int):
     """スポットからバス停までの所要時間と経路形状を取得"""
-    base_url = "http://localhost:8080/otp/routers/default/plan"
-
-    # 現在の日付を取得してMM-DD-YYYYフォーマットに変換
-    current_date = datetime.datetime.now().strftime("%m-%d-%Y")
 
     params = {
         "fromPlace": f"{from_spot['lat']},{from_spot['lon']}",
         "toPlace": f"{to_stop['lat']},{to_stop['lon']}",
         "mode": "WALK,TRANSIT",
-        "date": current_date,
+        "date": otp_client.service_date(),
         "time": "10:00:00",
         "maxWalkDistance": max_walk_distance_m,
         "numItineraries": 1,
     }
 
+    result = otp_client.get_client().plan(params)
+    if not result.ok:
+        print(f"Error calculating travel time: {result.error}")
+        return None, None, None, None
+
     try:
-        response = requests.get(base_url, params=params, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = result.data
 
         # 経路が見つかった場合、所要時間（分）と形状を返す
         if "plan" in data and data["plan"]["itineraries"]:
@@ -122,77 +118,421 @@ def _process_pair(args):
     }
 
 
-def execute(elem_list_1: list, elem_list_2: list, max_walk_distance_m: int):
+class Workload:
+    """スケジューラで実行する掛け合わせ1つ分の公共交通探索"""
+
+    def __init__(
+        self,
+        name: str,
+        elem_list_1: list,
+        elem_list_2: list,
+        max_walk_distance_m: int,
+        sink,
+        priority: int = 0,
+    ):
+        self.name = name
+        self.elem_list_1 = elem_list_1
+        self.elem_list_2 = elem_list_2
+        self.max_walk_distance_m = max_walk_distance_m
+        self.sink = sink  # 見つかった経路を受け取る関数
+        self.priority = priority  # 小さいほど先に投入する
+        self.total = len(elem_list_1) * len(elem_list_2)
+        self.processed = 0
+        self.found = 0
+        self._last_percentage = -1
+
+    def pairs(self):
+        """投入する探索 (掛け合わせ, 探索する関数, 引数) を順に返す"""
+        for elem_1 in self.elem_list_1:
+            for elem_2 in self.elem_list_2:
+                yield self, _process_pair, (elem_1, elem_2, self.max_walk_distance_m)
+
+    def complete(self, result: dict) -> list:
+        """
+        探索が1件終わったときに呼ばれる（スケジューラのスレッドからのみ）。
+        続けて投入する探索のリストを返す
+        """
+        if result is not None:
+            self.sink(result)
+            self.found += 1
+        self._count_processed()
+        return []
+
+    def _count_processed(self):
+        self.processed += 1
+        current_percentage = int((self.processed / self.total) * 100)
+        if current_percentage > self._last_percentage:
+            print(f"Progress [{self.name}]: {current_percentage}%")
+            self._last_percentage = current_percentage
+
+
+def _process_surface(args):
+    spot, pointset_id, max_walk_distance_m = args
+    return spot, get_travel_times_to_pointset(spot, pointset_id, max_walk_distance_m)
+
+
+def _process_pair_or_fallback(args):
+    """経路探索を行い、経路が得られなければ代わりの経路（サーフェスで求めた所要時間だけのもの）を返す"""
+    spot, dest, max_walk_distance_m, fallback = args
+    return _process_pair((spot, dest, max_walk_distance_m)) or fallback
+
+
+class OneToManyWorkload(Workload):
     """
-    与えられたリストの掛け合わせの数だけ公共交通探索を行う。
-    並列実行でスループットを向上させる。
+    elem_list_1 の各出発地から elem_list_2（ポイントセット pointset_id と同じ順の地点）への
+    所要時間を、出発地ごとに1回のサーフェス評価で求める掛け合わせ。
+    サーフェスで到達できた組は、サーフェスの所要時間だけの経路
+    （walk_distance_m がNone、geometry と sections が空）を sink に渡す。
+    itinerary_max_duration_m を指定した場合のみ、所要時間がそれ以下の組について
+    同じ投入キューで経路探索を続けて行い、完全な経路を渡す（経路が得られなければ所要時間だけの経路）。
+    組ごとの経路探索はリクエスト数を増やすため、既定（None）では行わない。
     """
-    routes = []
-    total_pairs = len(elem_list_1) * len(elem_list_2)
-    if total_pairs == 0:
-        return routes
-
-    pairs_iter = (
-        (spot, stop, max_walk_distance_m)
-        for spot in elem_list_1
-        for stop in elem_list_2
-    )
 
-    processed = 0
-    last_percentage = -1
-    lock = threading.Lock()
+    def __init__(
+        self,
+        name: str,
+        elem_list_1: list,
+        elem_list_2: list,
+        pointset_id: str,
+        max_walk_distance_m: int,
+        sink,
+        itinerary_max_duration_m: int = None,
+        priority: int = 0,
+    ):
+        super().__init__(name, elem_list_1, elem_list_2, max_walk_distance_m, sink, priority)
+        self.pointset_id = pointset_id
+        self.itinerary_max_duration_m = itinerary_max_duration_m
+        self.total = len(elem_list_1)  # サーフェスの数
+        # 続けて行う経路探索（件数はサーフェスの結果が出るたびに増える）
+        self.itineraries = Workload(f"{name} itineraries", [], [], max_walk_distance_m, sink)
+
+    def pairs(self):
+        for spot in self.elem_list_1:
+            yield self, _process_surface, (spot, self.pointset_id, self.max_walk_distance_m)
+
+    def complete(self, result: tuple) -> list:
+        spot, times = result
+        followups = []
+        if times is not None:
+            if len(times) != len(self.elem_list_2):
+                raise ValueError(
+                    f"pointset {self.pointset_id} has {len(times)} points, "
+                    f"expected {len(self.elem_list_2)}"
+                )
+            for dest, time_s in zip(self.elem_list_2, times):
+                if time_s is None:
+                    continue
+                duration_m = int(time_s / 60)
+                route = {
+                    "from": spot["id"],
+                    "to": dest["id"],
+                    "duration_m": duration_m,
+                    "walk_distance_m": None,
+                    "geometry": "",
+                    "sections": [],
+                }
+                if (
+                    self.itinerary_max_duration_m is not None
+                    and duration_m <= self.itinerary_max_duration_m
+                ):
+                    args = (spot, dest, self.max_walk_distance_m, route)
+                    followups.append((self.itineraries, _process_pair_or_fallback, args))
+                    self.itineraries.total += 1
+                else:
+                    self.sink(route)
+                    self.found += 1
+        self._count_processed()
+        return followups
+
+
+def _round_robin(iterators: list):
+    """各イテレータから1件ずつ順番に取り出す"""
+    iterators = list(iterators)
+    while iterators:
+        for it in list(iterators):
+            try:
+                yield next(it)
+            except StopIteration:
+                iterators.remove(it)
+
+
+def execute_workloads(
+    workloads: list[Workload],
+    window: int = SUBMIT_WINDOW,
+    interleave: bool = False,
+):
+    """
+    複数の掛け合わせを1つのスレッドプールと投入キューで実行する。
+    既定では優先度の順に投入し、前の掛け合わせの投入が終わり次第、次の掛け合わせの
+    探索で空いた枠を埋めるため、掛け合わせごとにプールが空になるのを待たない。
+    interleave=True の場合は各掛け合わせから1件ずつ交互に投入する。
+    完了した探索が続けて投入する探索を返した場合は、それを新しい探索より先に投入する。
+    未完了のリクエストは最大window件に抑え、結果は各掛け合わせのsinkに完了した順に渡す。
+    """
+    workloads = sorted(
+        (w for w in workloads if w.total > 0), key=lambda w: w.priority
+    )
+    if interleave:
+        tasks = _round_robin(w.pairs() for w in workloads)
+    else:
+        tasks = itertools.chain.from_iterable(w.pairs() for w in workloads)
 
     max_workers = min(32, (os.cpu_count() or 4) * 5)  # I/O主体なのでスレッド数を多めに
+    followups = collections.deque()  # 完了した探索から続けて投入する探索（先に投入する）
+
+    def next_tasks(count: int) -> list:
+        batch = []
+        while followups and len(batch) < count:
+            batch.append(followups.popleft())
+        batch.extend(itertools.islice(tasks, count - len(batch)))
+        return batch
+
     with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [executor.submit(_process_pair, args) for args in pairs_iter]
-        for future in concurrent.futures.as_completed(futures):
-            result = future.result()
-            if result is not None:
-                routes.append(result)
-
-            with lock:
-                processed += 1
-                current_percentage = int((processed / total_pairs) * 100)
-                if current_percentage > last_percentage:
-                    print(f"Progress: {current_percentage}%")
-                    last_percentage = current_percentage
-
-    if last_percentage < 100:
-        print("Progress: 100%")
 
+        def submit(task):
+            workload, process, args = task
+            return executor.submit(process, args), workload
+
+        pending = dict(submit(task) for task in next_tasks(window))
+        while pending:
+            done, _ = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            for future in done:
+                followups.extend(pending.pop(future).complete(future.result()))
+            for task in next_tasks(window - len(pending)):
+                future, workload = submit(task)
+                pending[future] = workload
+
+
+def execute(
+    elem_list_1: list,
+    elem_list_2: list,
+    max_walk_distance_m: int,
+    sink=None,
+    window: int = SUBMIT_WINDOW,
+):
+    """
+    与えられたリストの掛け合わせの数だけ公共交通探索を行う。
+    見つかった経路は完了した順にsinkに渡す。sinkを省略した場合は経路のリストを返す。
+    """
+    routes = []
+    workload = Workload(
+        "routes", elem_list_1, elem_list_2, max_walk_distance_m, sink or routes.append
+    )
+    execute_workloads([workload], window)
     return routes
 
 
+def _is_reachable(time_s) -> bool:
+    # サーフェスで到達できない点は負の値またはintの最大値になる
+    return time_s is not None and 0 <= time_s < 2**31 - 1
+
+
+def get_travel_times_to_pointset(from_spot, pointset_id: str, max_walk_distance_m: int):
+    """
+    スポットから、ポイントセットの各点までの所要時間[秒]をサーフェス1つで取得する。
+    失敗した場合はNone。到達できない点の値はNone
+    """
+    params = {
+        "fromPlace": f"{from_spot['lat']},{from_spot['lon']}",
+        "mode": "WALK,TRANSIT",
+        "date": otp_client.service_date(),
+        "time": "10:00:00",
+        "maxWalkDistance": max_walk_distance_m,
+        "cutoffMinutes": SURFACE_CUTOFF_MIN,
+    }
+    client = otp_client.get_client()
+    result = client.surface(params)
+    if result.ok:
+        result = client.surface_indicator(result.data["id"], pointset_id)
+    if not result.ok or "times" not in result.data:
+        print(f"Error calculating travel times: {result.error or 'no times in response'}")
+        return None
+    return [t if _is_reachable(t) else None for t in result.data["times"]]
+
+
+def execute_one_to_many(
+    elem_list_1: list,
+    elem_list_2: list,
+    pointset_id: str,
+    max_walk_distance_m: int,
+    sink,
+    itinerary_max_duration_m: int = None,
+    window: int = SUBMIT_WINDOW,
+):
+    """
+    elem_list_1 の各出発地から elem_list_2 への経路を OneToManyWorkload で求め、
+    完了した順に sink に渡す
+    """
+    workload = OneToManyWorkload(
+        "routes", elem_list_1, elem_list_2, pointset_id,
+        max_walk_distance_m, sink, itinerary_max_duration_m,
+    )
+    execute_workloads([workload], window)
+
+
 def write_json(output_dir: str, key: str, routes: list):
     output = {key: routes}
     with open(output_dir + f"/{key}.json", "w", encoding="utf-8") as f:
         json.dump(output, f, ensure_ascii=False, indent=4)
 
 
+class RouteJsonWriter:
+    """
+    write_json と同じ形式（{key: [経路, ...]}、インデント4）のJSONを1件ずつ書き出す。
+    経路は追加するたびに <key>.json.partial に書き込んでフラッシュし、
+    正常にcloseした時点で本来のパス <key>.json に置き換える。
+    例外で抜けた場合は、それまでの経路を閉じたJSONとして <key>.json.partial に残す。
+    """
+
+    def __init__(self, output_dir: str, key: str):
+        self.path = output_dir + f"/{key}.json"
+        self.partial_path = self.path + ".partial"
+        self.count = 0
+        self._file = open(self.partial_path, "w", encoding="utf-8")
+        self._file.write("{\n" + " " * 4 + json.dumps(key, ensure_ascii=False) + ": [")
+
+    def add(self, route: dict):
+        text = json.dumps(route, ensure_ascii=False, indent=4)
+        separator = ",\n" if self.count else "\n"
+        self._file.write(separator + textwrap.indent(text, " " * 8))
+        self._file.flush()
+        self.count += 1
+
+    def _finish(self):
+        self._file.write(("\n" + " " * 4 + "]" if self.count else "]") + "\n}")
+        self._file.close()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._finish()
+        os.replace(self.partial_path, self.path)
+
+    def abort(self):
+        """途中までの経路を <key>.json.partial に残す（<key>.json は置き換えない）"""
+        if self._file.closed:
+            return
+        self._finish()
+        print(f"{self.partial_path}: {self.count} routes (incomplete)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
 def main(
     input_spots_path: str,
     input_stops_path: str,
     input_refpoint_path: str,
     output_dir: str,
+    refpoint_pointset_id: str = None,
+    itinerary_max_duration_m: int = None,
+    output_geometry_store_path: str = None,
 ):
     # データの読み込み
     spots = load_spots(input_spots_path)
     stops = load_stops(input_stops_path)
     refpoints = load_refpoints(input_refpoint_path)
 
-    spots_to_stops = execute(spots, stops, MAX_WALK_DISTANCE_M)
-    write_json(output_dir, "spot_to_stops", spots_to_stops)
-
-    spots_to_refpoints = execute(spots, refpoints, MAX_WALK_DISTANCE_M * 100)
-    write_json(output_dir, "spot_to_refpoints", spots_to_refpoints)
-
-    stops_to_refpoints = execute(stops, refpoints, MAX_WALK_DISTANCE_M)
-    write_json(output_dir, "stop_to_refpoints", stops_to_refpoints)
+    # 区間の形状をジオメトリストアに分ける場合は、経路に形状のIDだけを残して書き出す
+    geometry_writer = None
+    if output_geometry_store_path:
+        geometry_writer = GeometryStoreWriter(output_geometry_store_path)
+
+    def sink(writer: RouteJsonWriter):
+        if geometry_writer is None:
+            return writer.add
+        return lambda route: writer.add(geometry_writer.dedupe_route(route))
+
+    # 3つの掛け合わせを1つのキューで実行し、小さい掛け合わせから投入する。
+    # 経路はメモリに溜めず、見つかった順にそれぞれのファイルへ書き出す
+    # ジオメトリストアも同じwithで開き、途中で失敗した場合は書きかけのファイルを残さない
+    with geometry_writer or contextlib.nullcontext(), \
+            RouteJsonWriter(output_dir, "spot_to_stops") as spot_to_stops, \
+            RouteJsonWriter(output_dir, "spot_to_refpoints") as spot_to_refpoints, \
+            RouteJsonWriter(output_dir, "stop_to_refpoints") as stop_to_refpoints:
+        workloads = [
+            Workload("spot_to_stops", spots, stops,
+                     MAX_WALK_DISTANCE_M, sink(spot_to_stops)),
+        ]
+        if refpoint_pointset_id is None:
+            workloads += [
+                Workload("spot_to_refpoints", spots, refpoints,
+                         MAX_WALK_DISTANCE_M * 100, sink(spot_to_refpoints)),
+                Workload("stop_to_refpoints", stops, refpoints,
+                         MAX_WALK_DISTANCE_M, sink(stop_to_refpoints)),
+            ]
+        else:
+            # 参照点への所要時間は出発地ごとに1回のサーフェス評価で求める
+            workloads += [
+                OneToManyWorkload("spot_to_refpoints", spots, refpoints,
+                                  refpoint_pointset_id, MAX_WALK_DISTANCE_M * 100,
+                                  sink(spot_to_refpoints), itinerary_max_duration_m),
+                OneToManyWorkload("stop_to_refpoints", stops, refpoints,
+                                  refpoint_pointset_id, MAX_WALK_DISTANCE_M,
+                                  sink(stop_to_refpoints), itinerary_max_duration_m),
+            ]
+        for workload in workloads:
+            workload.priority = workload.total
+        execute_workloads(workloads)
+
+    if geometry_writer is not None:
+        print(geometry_writer.report())
+
+    for workload in workloads:
+        if isinstance(workload, OneToManyWorkload):
+            itineraries = workload.itineraries
+            print(
+                f"{workload.name}: {workload.total} surfaces, "
+                f"{itineraries.total} itineraries, {workload.found} duration-only routes"
+            )
+        else:
+            print(f"{workload.name}: {workload.found}/{workload.total} routes")
+    for writer in (spot_to_stops, spot_to_refpoints, stop_to_refpoints):
+        print(f"{writer.path}: {writer.count} routes")
+
+    print(otp_client.get_client().report())
+    otp_cache.close_cache()
 
 
 if __name__ == "__main__":
-    input_spots_path = sys.argv[1]
-    input_stops_path = sys.argv[2]
-    input_refpoint_path = sys.argv[3]
-    output_dir = sys.argv[4]
-    main(input_spots_path, input_stops_path, input_refpoint_path, output_dir)
+    parser = argparse.ArgumentParser(description="公共交通探索")
+    parser.add_argument("input_spots_path")
+    parser.add_argument("input_stops_path")
+    parser.add_argument("input_refpoint_path")
+    parser.add_argument("output_dir")
+    parser.add_argument(
+        "--one-to-many",
+        dest="refpoint_pointset_id",
+        metavar="POINTSET_ID",
+        help="参照点への所要時間をOTPのサーフェスで求める（参照点のポイントセットIDを指定）",
+    )
+    parser.add_argument(
+        "--itinerary-max-duration-m",
+        type=int,
+        default=None,
+        help="--one-to-many で、所要時間がこれ以下の組について完全な経路も取得する[分]"
+        "（組ごとに経路探索を行う。省略時は所要時間だけを求める）",
+    )
+    parser.add_argument(
+        "--geometry-store",
+        dest="output_geometry_store_path",
+        help="区間の形状を重複なく格納するジオメトリストアの出力先（経路には形状のIDだけを残す）",
+    )
+    args = parser.parse_args()
+    main(
+        args.input_spots_path,
+        args.input_stops_path,
+        args.input_refpoint_path,
+        args.output_dir,
+        args.refpoint_pointset_id,
+        args.itinerary_max_duration_m,
+        args.output_geometry_store_path,
+    )
@@ -0,0 +1,149 @@
+"""
+メッシュから「そのメッシュに到達できるスポット」を引く転置索引。
+最小到達時間区分の行列（area_search.calc_first_reachable_times）から作り、
+メッシュごとに (徒歩距離, 時間) の区分それぞれについて、到達できるスポットのビット集合
+（np.packbits でスポット順に詰めたもの）を持つ。
+
+レコードストアに格納し、キーはメッシュコード、値は
+[徒歩距離区分][時間区分][スポットのビット集合] の順に並べたバイト列。
+どのスポットからも到達できないメッシュは格納しない。
+軸のラベル（スポットID・時間区分・徒歩距離区分）は META_KEY のレコードにJSONで格納する。
+
+使い方:
+    python soaring/reachability_index.py build <first_reachable_times.npz> <index>
+    python soaring/reachability_index.py query <index> <mesh_code> <time_limit_min> <walk_distance_m>
+"""
+import sys
+import json
+import bisect
+import numpy as np
+from record_store import RecordStore, RecordStoreWriter
+
+META_KEY = "__meta__"
+BUILD_CHUNK_MESHES = 64  # 一度にビット集合を作るメッシュ数（作業メモリを抑える）
+
+
+def write_reachability_index(
+    first_times: np.ndarray,
+    spot_ids: list[str],
+    mesh_codes: list[str],
+    time_limits_min: list[int],
+    walk_distances_m: list[int],
+    output_path: str,
+) -> int:
+    """
+    (スポット, 徒歩距離区分, メッシュ) の最小到達時間区分の行列から転置索引を書き出す。
+    格納したメッシュの数を返す
+    """
+    spot_count, walk_count, mesh_count = first_times.shape
+    time_indices = np.arange(len(time_limits_min), dtype=first_times.dtype)
+    reached = np.flatnonzero((first_times < len(time_limits_min)).any(axis=(0, 1)))
+    meta = {
+        "spot_ids": [str(id) for id in spot_ids],
+        "time_limits_min": [int(t) for t in time_limits_min],
+        "walk_distances_m": [int(w) for w in walk_distances_m],
+    }
+    with RecordStoreWriter(output_path) as writer:
+        writer.add(META_KEY, json.dumps(meta).encode("utf-8"))
+        for start in range(0, len(reached), BUILD_CHUNK_MESHES):
+            chunk = reached[start : start + BUILD_CHUNK_MESHES]
+            # (メッシュ, 徒歩距離, スポット) -> (メッシュ, 徒歩距離, 時間, スポット)
+            times = first_times[:, :, chunk].transpose(2, 1, 0)
+            bits = np.packbits(times[:, :, None, :] <= time_indices[:, None], axis=-1)
+            for mesh_index, mesh_bits in zip(chunk.tolist(), bits):
+                writer.add(str(mesh_codes[mesh_index]), mesh_bits.tobytes())
+    return len(reached)
+
+
+def write_reachability_index_from_npz(first_times_path: str, output_path: str) -> int:
+    """area_search.write_first_reachable_times で書き出したファイルから転置索引を作る"""
+    with np.load(first_times_path) as data:
+        return write_reachability_index(
+            data["first_times"],
+            data["spot_ids"].tolist(),
+            data["mesh_codes"].tolist(),
+            data["time_limits_min"].tolist(),
+            data["walk_distances_m"].tolist(),
+            output_path,
+        )
+
+
+class ReachabilityIndex:
+    """
+    転置索引をメモリマップして問い合わせる。
+    時間・徒歩距離は区分の値でなくてもよく、それ以下で最大の区分として扱う
+    （到達可能性は時間・徒歩距離について単調なので、区分の間の値に対して控えめな答えになる）
+    """
+
+    def __init__(self, path: str):
+        self._store = RecordStore(path)
+        meta = json.loads(self._store.get_bytes(META_KEY))
+        self.spot_ids: list[str] = meta["spot_ids"]
+        self.time_limits_min: list[int] = meta["time_limits_min"]
+        self.walk_distances_m: list[int] = meta["walk_distances_m"]
+        self._spot_positions = {id: i for i, id in enumerate(self.spot_ids)}
+        self._spot_bytes = (len(self.spot_ids) + 7) // 8
+
+    def __len__(self) -> int:
+        """格納しているメッシュの数"""
+        return len(self._store) - 1
+
+    def __contains__(self, mesh_code: str) -> bool:
+        return mesh_code != META_KEY and mesh_code in self._store
+
+    def _bucket(self, time_limit_min: float, walk_distance_m: float) -> int:
+        """区分の通し番号。どの区分にも満たなければ-1"""
+        time_index = bisect.bisect_right(self.time_limits_min, time_limit_min) - 1
+        walk_index = bisect.bisect_right(self.walk_distances_m, walk_distance_m) - 1
+        if time_index < 0 or walk_index < 0:
+            return -1
+        return walk_index * len(self.time_limits_min) + time_index
+
+    def spot_bits(self, mesh_code: str, time_limit_min: float, walk_distance_m: float) -> bytes:
+        """到達できるスポットのビット集合（np.packbitsと同じ並び）。到達できるスポットがなければ全て0"""
+        bucket = self._bucket(time_limit_min, walk_distance_m)
+        if bucket < 0 or mesh_code not in self:
+            return bytes(self._spot_bytes)
+        start = bucket * self._spot_bytes
+        return self._store.get_bytes(mesh_code)[start : start + self._spot_bytes]
+
+    def spot_mask(self, mesh_code: str, time_limit_min: float, walk_distance_m: float) -> np.ndarray:
+        """スポット順の到達可否のbool配列"""
+        bits = np.frombuffer(self.spot_bits(mesh_code, time_limit_min, walk_distance_m), dtype=np.uint8)
+        return np.unpackbits(bits, count=len(self.spot_ids)).astype(bool)
+
+    def spots_reaching(self, mesh_code: str, time_limit_min: float, walk_distance_m: float) -> list[str]:
+        """指定した時間・徒歩距離以内にメッシュに到達できるスポットのID"""
+        mask = self.spot_mask(mesh_code, time_limit_min, walk_distance_m)
+        return [self.spot_ids[i] for i in np.flatnonzero(mask)]
+
+    def reaches(self, spot_id: str, mesh_code: str, time_limit_min: float, walk_distance_m: float) -> bool:
+        """スポットが指定した時間・徒歩距離以内にメッシュに到達できるか。未知のスポットはKeyError"""
+        position = self._spot_positions[spot_id]
+        bits = self.spot_bits(mesh_code, time_limit_min, walk_distance_m)
+        return bool(bits[position // 8] & (0x80 >> (position % 8)))
+
+    def close(self):
+        self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "build":
+        count = write_reachability_index_from_npz(sys.argv[2], sys.argv[3])
+        print(f"Wrote {count} meshes to {sys.argv[3]}")
+    elif len(sys.argv) == 6 and sys.argv[1] == "query":
+        with ReachabilityIndex(sys.argv[2]) as index:
+            spots = index.spots_reaching(sys.argv[3], float(sys.argv[4]), float(sys.argv[5]))
+        print(json.dumps(spots, ensure_ascii=False))
+    else:
+        print(
+            "Usage: python reachability_index.py build <first_reachable_times.npz> <index>\n"
+            "       python reachability_index.py query <index> <mesh_code> <time_limit_min> <walk_distance_m>"
+        )
+        sys.exit(1)
@@ -0,0 +1,170 @@
+"""
+キー付きのレコードを1ファイルにまとめて格納するレコードストア。
+
+ファイル構成:
+    ヘッダ   : MAGIC, バージョン, フラグ, レコード数, 索引の位置
+    レコード : 各レコードのバイト列を書き込んだ順に連結したもの
+    索引     : 位置(uint64)の配列, 長さ(uint64)の配列, 改行区切りのキー(UTF-8)
+
+レコードは追記しながら一時ファイルに書き出し、索引を最後にまとめて書き出してから
+本来のパスに置き換える。途中で例外が起きた場合は一時ファイルを削除し、既存のファイルは残す。
+読み込み時はファイルをメモリマップし、索引だけを読んで辞書を作るため、
+個々のレコードは必要になった時点で初めて読み出される。
+"""
+import os
+import sys
+import mmap
+import zlib
+import array
+import struct
+
+MAGIC = b"SRST"
+VERSION = 1
+FLAG_ZLIB = 1  # レコードをzlibで圧縮している
+HEADER = struct.Struct("<4sHHQQ")
+
+
+class RecordStoreWriter:
+    """レコードストアを逐次書き出す"""
+
+    def __init__(self, path: str, compress: bool = False, allow_duplicates: bool = False):
+        """
+        allow_duplicates=True の場合は同じキーを何度でも追加でき、読み込み時には
+        最後に追加したレコードが使われる（書き出し側で全件を保持せずに済む）
+        """
+        self.path = path
+        self.compress = compress
+        self.allow_duplicates = allow_duplicates
+        self._tmp_path = path + ".tmp"
+        self._file = open(self._tmp_path, "wb")
+        self._file.write(b"\0" * HEADER.size)
+        self._keys = []
+        self._offsets = array.array("Q")
+        self._lengths = array.array("Q")
+        self._seen = set()
+
+    def add(self, key: str, data: bytes):
+        """レコードを追加する。allow_duplicates でなければ同じキーは一度しか追加できない"""
+        if "\n" in key:
+            raise ValueError(f"key must not contain a newline: {key!r}")
+        if not self.allow_duplicates:
+            if key in self._seen:
+                raise KeyError(f"duplicate key: {key}")
+            self._seen.add(key)
+        if self.compress:
+            data = zlib.compress(data)
+        self._keys.append(key)
+        self._offsets.append(self._file.tell())
+        self._lengths.append(len(data))
+        self._file.write(data)
+
+    def close(self):
+        """索引を書き出し、ヘッダを確定させて本来のパスに置き換える"""
+        if self._file.closed:
+            return
+        index_offset = self._file.tell()
+        self._file.write(_to_little_endian(self._offsets).tobytes())
+        self._file.write(_to_little_endian(self._lengths).tobytes())
+        self._file.write("\n".join(self._keys).encode("utf-8"))
+        flags = FLAG_ZLIB if self.compress else 0
+        self._file.seek(0)
+        self._file.write(
+            HEADER.pack(MAGIC, VERSION, flags, len(self._keys), index_offset)
+        )
+        self._file.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        """書きかけの一時ファイルを削除する"""
+        if self._file.closed:
+            return
+        self._file.close()
+        os.remove(self._tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class RecordStore:
+    """レコードストアをメモリマップして読み込む"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, flags, count, index_offset = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a record store")
+        if version != VERSION:
+            raise ValueError(f"unsupported record store version: {version}")
+        self.compressed = bool(flags & FLAG_ZLIB)
+
+        self._offsets = _read_uint64_array(self._mmap, index_offset, count)
+        self._lengths = _read_uint64_array(self._mmap, index_offset + 8 * count, count)
+        keys_blob = self._mmap[index_offset + 16 * count :].decode("utf-8")
+        keys = keys_blob.split("\n") if count else []
+        # 同じキーが複数あれば後のレコードを使う
+        self._positions = dict(zip(keys, range(count)))
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._positions
+
+    def keys(self):
+        return self._positions.keys()
+
+    def _read(self, position: int) -> bytes:
+        offset = self._offsets[position]
+        data = self._mmap[offset : offset + self._lengths[position]]
+        return zlib.decompress(data) if self.compressed else data
+
+    def get_bytes(self, key: str) -> bytes:
+        """キーに対応するレコードを返す。なければKeyError"""
+        return self._read(self._positions[key])
+
+    def get_many_bytes(self, keys: list[str]) -> list:
+        """
+        複数のキーに対応するレコードをまとめて返す。
+        ファイル上の位置の順に読み出し、結果はkeysの順に並べる。存在しないキーはNone
+        """
+        results = [None] * len(keys)
+        found = [
+            (self._positions[key], i)
+            for i, key in enumerate(keys)
+            if key in self._positions
+        ]
+        for position, i in sorted(found):
+            results[i] = self._read(position)
+        return results
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _to_little_endian(values: array.array) -> array.array:
+    if sys.byteorder == "big":
+        values = array.array(values.typecode, values)
+        values.byteswap()
+    return values
+
+
+def _read_uint64_array(buffer, offset: int, count: int) -> array.array:
+    values = array.array("Q")
+    values.frombytes(buffer[offset : offset + 8 * count])
+    return _to_little_endian(values)
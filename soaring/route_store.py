@@ -0,0 +1,94 @@
+"""
+公共交通の経路（スポット→バス停、スポット→参照点、バス停→参照点）を
+1ファイルにまとめたルートストア。
+キーは (出発地ID, 目的地ID) で、各レコードは経路をpickleしてzlibで圧縮したもの。
+同じ組の経路を複数回追加した場合は、読み込み時に最後に追加したものが使われる。
+ptrans_search.py を --geometry-store 付きで実行した場合、経路は区間の形状の代わりに
+geometry_id を持つ。ジオメトリストアを指定して開くと、読み出し時に形状を復元する。
+"""
+import sys
+import pickle
+from record_store import RecordStore, RecordStoreWriter
+from geometry_store import GeometryStore
+
+
+def route_key(from_id: str, to_id: str) -> str:
+    """個別ファイル出力のファイル名と同じ形式のキーを返す"""
+    return f"{from_id}_{to_id}"
+
+
+class RouteStoreWriter:
+    """ルートストアを逐次書き出す。経路は追加した時点で書き出し、手元には保持しない"""
+
+    def __init__(self, path: str):
+        self._writer = RecordStoreWriter(path, compress=True, allow_duplicates=True)
+
+    def add(self, route: dict):
+        self._writer.add(route_key(route["from"], route["to"]), pickle.dumps(route))
+
+    def close(self):
+        self._writer.close()
+
+    def abort(self):
+        """書きかけのファイルを破棄する"""
+        self._writer.abort()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class RouteStore:
+    """ルートストアをメモリマップし、必要な経路だけを読み出す"""
+
+    def __init__(self, path: str, geometry_store_path: str = None):
+        self._store = RecordStore(path)
+        self._geometry_store = GeometryStore(geometry_store_path) if geometry_store_path else None
+
+    def __len__(self) -> int:
+        return len(self._store)
+
+    def __contains__(self, pair: tuple) -> bool:
+        return route_key(*pair) in self._store
+
+    def get(self, from_id: str, to_id: str) -> dict:
+        """経路を一つ読み出す。なければKeyError"""
+        return self._load(self._store.get_bytes(route_key(from_id, to_id)))
+
+    def get_many(self, pairs: list[tuple[str, str]]) -> list:
+        """複数の経路をまとめて読み出す。存在しない組はNone"""
+        records = self._store.get_many_bytes(
+            [route_key(from_id, to_id) for from_id, to_id in pairs]
+        )
+        return [self._load(data) if data is not None else None for data in records]
+
+    def _load(self, data: bytes) -> dict:
+        route = pickle.loads(data)
+        if self._geometry_store is not None:
+            route = self._geometry_store.resolve_route(route)
+        return route
+
+    def close(self):
+        self._store.close()
+        if self._geometry_store is not None:
+            self._geometry_store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+if __name__ == "__main__":
+    # 使い方: python route_store.py <route_store> [from_id to_id [geometry_store]]
+    with RouteStore(sys.argv[1], sys.argv[4] if len(sys.argv) == 5 else None) as store:
+        if len(sys.argv) >= 4:
+            print(store.get(sys.argv[2], sys.argv[3]))
+        else:
+            print(f"{len(store)} routes")
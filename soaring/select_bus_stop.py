@@ -1,12 +1,15 @@
 import json
 import random
 import sys
-import xml.etree.ElementTree as ET
+from kml_writer import KmlWriter
 from pathlib import Path
 from typing import List, Dict, Any
 import math
+import numpy as np
 
 BUS_COUNT = 100
+MIN_STOP_SPACING_M = 250  # バス停同士の最小間隔（メートル）
+PLACEMENT_SEED = 42  # 配置の乱数シード
 
 # 地球の半径（メートル）
 EARTH_RADIUS = 6371000
@@ -52,17 +55,6 @@ def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float
     return EARTH_RADIUS * c
 
 
-def random_point_in_mesh(mesh: Dict[str, Any]) -> (float, float):
-    coords = mesh["geometry"]["coordinates"][0]
-    lons = [p[0] for p in coords]
-    lats = [p[1] for p in coords]
-    min_lon, max_lon = min(lons), max(lons)
-    min_lat, max_lat = min(lats), max(lats)
-    lon = random.uniform(min_lon, max_lon)
-    lat = random.uniform(min_lat, max_lat)
-    return lat, lon
-
-
 def random_point_near_spot(spot: Dict[str, Any], radius: float = 50.0) -> (float, float):
     """スポット付近にランダムな点を生成（半径radius以内）"""
     lat = spot["lat"]
@@ -79,16 +71,80 @@ def random_point_near_spot(spot: Dict[str, Any], radius: float = 50.0) -> (float
     return lat + delta_lat, lon + delta_lon
 
 
+def place_stops(
+    meshes: List[Dict[str, Any]],
+    count: int,
+    existing_points: List[tuple] = (),
+    min_spacing_m: float = MIN_STOP_SPACING_M,
+    seed: int = PLACEMENT_SEED,
+) -> List[tuple]:
+    """
+    人口で重み付けしたサンプリングでメッシュ内にバス停を配置し、(lat, lon) のリストを返す。
+    メッシュの選択順は重み付き非復元抽出（Efraimidis-Spirakis法）でまとめて決め、
+    その順に、既存のバス停から min_spacing_m 以上離れている候補だけを採用する。
+    間隔の判定は min_spacing_m 四方の格子に登録したバス停だけを近傍から探して行う。
+    """
+    if count <= 0 or not meshes:
+        return []
+    rng = np.random.default_rng(seed)
+
+    # 各メッシュ内の候補点をまとめて生成
+    rings = np.array([m["geometry"]["coordinates"][0][:4] for m in meshes], dtype=float)
+    min_lon, max_lon = rings[:, :, 0].min(axis=1), rings[:, :, 0].max(axis=1)
+    min_lat, max_lat = rings[:, :, 1].min(axis=1), rings[:, :, 1].max(axis=1)
+    cand_lon = rng.uniform(min_lon, max_lon)
+    cand_lat = rng.uniform(min_lat, max_lat)
+
+    # 人口で重み付けした非復元抽出の順序
+    population = np.array([m["population"] for m in meshes], dtype=float)
+    order = np.argsort(rng.exponential(size=len(meshes)) / population, kind="stable")
+
+    # 間隔判定用に平面座標[m]へ変換
+    cos_lat0 = math.cos(math.radians(float(np.mean(cand_lat))))
+
+    def to_x(lon):
+        return np.radians(lon) * EARTH_RADIUS * cos_lat0
+
+    def to_y(lat):
+        return np.radians(lat) * EARTH_RADIUS
+
+    cand_x, cand_y = to_x(cand_lon), to_y(cand_lat)
+    min_spacing_sq = min_spacing_m ** 2
+
+    grid = {}
+
+    def register(x: float, y: float):
+        key = (int(math.floor(x / min_spacing_m)), int(math.floor(y / min_spacing_m)))
+        grid.setdefault(key, []).append((x, y))
+
+    def is_far_enough(x: float, y: float) -> bool:
+        gx, gy = int(math.floor(x / min_spacing_m)), int(math.floor(y / min_spacing_m))
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for px, py in grid.get((gx + dx, gy + dy), ()):
+                    if (px - x) ** 2 + (py - y) ** 2 < min_spacing_sq:
+                        return False
+        return True
+
+    for lat, lon in existing_points:
+        register(float(to_x(lon)), float(to_y(lat)))
+
+    placed = []
+    for idx in order.tolist():
+        x, y = float(cand_x[idx]), float(cand_y[idx])
+        if not is_far_enough(x, y):
+            continue
+        register(x, y)
+        placed.append((float(cand_lat[idx]), float(cand_lon[idx])))
+        if len(placed) >= count:
+            break
+    return placed
+
+
 def write_kml(stops, out_path: Path) -> None:
-    kml = ET.Element("kml", xmlns="http://www.opengis.net/kml/2.2")
-    doc = ET.SubElement(kml, "Document")
-    for stop in stops:
-        pm = ET.SubElement(doc, "Placemark")
-        ET.SubElement(pm, "name").text = stop["name"]
-        ET.SubElement(pm, "description").text = stop["id"]
-        point = ET.SubElement(pm, "Point")
-        ET.SubElement(point, "coordinates").text = f'{stop["lon"]},{stop["lat"]},0'
-    ET.ElementTree(kml).write(out_path, encoding="utf-8", xml_declaration=True)
+    with KmlWriter(out_path) as kml:
+        for stop in stops:
+            kml.add_point(stop["lon"], stop["lat"], name=stop["name"], description=stop["id"])
 
 
 def main():
@@ -130,25 +186,11 @@ def main():
         )
         stop_id += 1
 
-    # メッシュ内にランダムに追加のバス停を配置
-    used_mesh_indices = set()
-    available_meshes = list(range(len(meshes)))
-    
-    for i in range(BUS_COUNT):
-        # まだ使用されていないメッシュのみを候補とする
-        candidate_indices = [idx for idx in available_meshes if idx not in used_mesh_indices]
-        
-        if not candidate_indices:
-            print(f"⚠️ {len(stops)}個のバス停を配置しました（メッシュが不足）", file=sys.stderr)
-            break
-        
-        # 候補メッシュから均等に選択（重み付けなし）
-        selected_idx = random.choice(candidate_indices)
-        
-        mesh = meshes[selected_idx]
-        used_mesh_indices.add(selected_idx)
-        
-        lat, lon = random_point_in_mesh(mesh)
+    # 人口に応じてメッシュ内に追加のバス停を配置
+    placed = place_stops(meshes, BUS_COUNT, [(s["lat"], s["lon"]) for s in stops])
+    if len(placed) < BUS_COUNT:
+        print(f"⚠️ {len(placed)}個のバス停を配置しました（候補が不足）", file=sys.stderr)
+    for lat, lon in placed:
         stops.append(
             {"id": f"comstop{stop_id}", "name": f"バス停{stop_id}", "lat": lat, "lon": lon}
         )
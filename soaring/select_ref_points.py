@@ -1,40 +1,11 @@
 import sys
-import os
 import json
-from typing import Tuple
-from shapely.geometry import Point, Polygon
+from kml_writer import KmlWriter
+from generate_mesh import mesh250m_to_cell
 
-# 格子の分割数
-DIV_NUM_VERTICAL = 40  # 縦方向の分割数
-DIV_NUM_HORIZONTAL = 40  # 横方向の分割数
-
-# KML用ライブラリの読み込み（なければKML出力をスキップ）
-try:
-    import simplekml
-
-    _HAS_SIMPLEKML = True
-except Exception:
-    _HAS_SIMPLEKML = False
-
-
-def generate_grid_points(
-    sw_lon: float, sw_lat: float, ne_lon: float, ne_lat: float
-) -> list:
-    """格子状の点を生成"""
-    points = []
-
-    # 経度・緯度の間隔を計算
-    lon_step = (ne_lon - sw_lon) / DIV_NUM_HORIZONTAL
-    lat_step = (ne_lat - sw_lat) / DIV_NUM_VERTICAL
-
-    # 格子点を生成
-    for i in range(DIV_NUM_VERTICAL + 1):
-        lat = sw_lat + (lat_step * i)
-        for j in range(DIV_NUM_HORIZONTAL + 1):
-            lon = sw_lon + (lon_step * j)
-            points.append((lat, lon))
-
-    return points
+# 人口に応じた参照点の選定
+POPULATION_PER_REF_POINT = 2000  # 参照点1つが受け持つ人口の目安
+MAX_CELL_MESHES = 4  # 参照点1つが受け持つ範囲の一辺の最大メッシュ数（4 = 約1km）
 
 
 def read_mesh_file(file_path: str) -> list:
@@ -44,39 +15,75 @@ def read_mesh_file(file_path: str) -> list:
     return data.get("mesh", [])
 
 
-def filter_points_in_mesh(points: list, mesh_list: list) -> list:
-    """メッシュの中に含まれる点のみを返す"""
-    # メッシュのポリゴンをshapelyオブジェクトに変換
-    mesh_polygons = []
+def select_adaptive_points(mesh_list: list) -> list:
+    """
+    人口のあるメッシュだけを対象に四分木で領域を分割し、参照点を選ぶ。
+    領域の人口が POPULATION_PER_REF_POINT 以下かつ一辺が MAX_CELL_MESHES 以下に
+    なるまで分割し、各領域の人口重心に最も近い人口のあるメッシュの中心を参照点とする。
+    人口の多い地域ほど参照点が密になり、人口のない山林や海上には置かれない。
+    """
+    cells = []
     for mesh in mesh_list:
-        coords = mesh["geometry"]["coordinates"][0]
-        polygon = Polygon(coords)
-        mesh_polygons.append(polygon)
-
-    # 各点がいずれかのメッシュに含まれるかチェック
-    filtered_points = []
-    for lat, lon in points:
-        point = Point(lon, lat)
-        for polygon in mesh_polygons:
-            if polygon.contains(point):
-                filtered_points.append((lat, lon))
-                break
+        if mesh.get("population", 0) <= 0:
+            continue
+        row, col = mesh250m_to_cell(mesh["mesh_code"])
+        cells.append((row, col, mesh["population"]))
+    if not cells:
+        return []
+
+    row_min = min(row for row, _, _ in cells)
+    col_min = min(col for _, col, _ in cells)
+    extent = max(
+        max(row for row, _, _ in cells) - row_min,
+        max(col for _, col, _ in cells) - col_min,
+    ) + 1
+    size = 1
+    while size < extent:
+        size *= 2
 
-    return filtered_points
+    points = []
+    stack = [(row_min, col_min, size, cells)]
+    while stack:
+        row0, col0, size, node_cells = stack.pop()
+        population = sum(pop for _, _, pop in node_cells)
+        if size == 1 or (
+            population <= POPULATION_PER_REF_POINT and size <= MAX_CELL_MESHES
+        ):
+            points.append(_representative_cell(node_cells))
+            continue
+
+        half = size // 2
+        children = {}
+        for cell in node_cells:
+            key = (cell[0] >= row0 + half, cell[1] >= col0 + half)
+            children.setdefault(key, []).append(cell)
+        for (upper, right), child_cells in children.items():
+            stack.append(
+                (row0 + half * upper, col0 + half * right, half, child_cells)
+            )
+
+    # 格子上の中心座標に変換し、南西から順に並べる
+    points.sort()
+    return [((row + 0.5) / 480, (col + 0.5) / 320 + 100) for row, col in points]
+
+
+def _representative_cell(cells: list) -> tuple:
+    """人口重心に最も近いメッシュの(行, 列)を返す"""
+    population = sum(pop for _, _, pop in cells)
+    center_row = sum(row * pop for row, _, pop in cells) / population
+    center_col = sum(col * pop for _, col, pop in cells) / population
+    row, col, _ = min(
+        cells, key=lambda c: ((c[0] - center_row) ** 2 + (c[1] - center_col) ** 2, c)
+    )
+    return row, col
 
 
 def write_kml(output_path: str, points: list):
-    """KML を出力（simplekml がインストールされている場合）"""
-    if not _HAS_SIMPLEKML:
-        print("simplekml がインストールされていないため KML 出力をスキップします")
-        return
-    kml = simplekml.Kml()
-    for idx, (lat, lon) in enumerate(points, 1):
-        p = kml.newpoint()
-        p.coords = [(lon, lat)]
-    kml_path = os.path.splitext(output_path)[0] + ".kml"
-    kml.save(kml_path)
-    print(f"KML written to: {kml_path}")
+    """KML を出力（拡張子が .kmz の場合は圧縮して出力）"""
+    with KmlWriter(output_path) as kml:
+        for lat, lon in points:
+            kml.add_point(lon, lat)
+    print(f"KML written to: {output_path}")
 
 
 def read_target_region(file_path: str):
@@ -110,14 +117,18 @@ def main():
         ne_lon = target_region_dict["north-east"]["lon"]
         ne_lat = target_region_dict["north-east"]["lat"]
 
-        # 格子点の生成
-        points = generate_grid_points(sw_lon, sw_lat, ne_lon, ne_lat)
-        print(f"Generated {len(points)} grid points")
-
-        # メッシュファイルの読み込み（引数として渡されるが使用しない）
+        # メッシュファイルの読み込み
         mesh_list = read_mesh_file(input_mesh_file)
         print(f"Loaded {len(mesh_list)} meshes")
 
+        # 人口に応じて参照点を選定し、対象領域の外のものは除く
+        points = [
+            (lat, lon)
+            for lat, lon in select_adaptive_points(mesh_list)
+            if sw_lat <= lat <= ne_lat and sw_lon <= lon <= ne_lon
+        ]
+        print(f"Selected {len(points)} ref points")
+
         # JSON出力
         write_json(output_path, points)
         print(f"JSON output written to: {output_path}")
@@ -0,0 +1,163 @@
+"""
+ベンチマーク用に合成した領域データ（地点・人口メッシュ・到達圏・経路）を作る。
+乱数の種を固定すれば毎回同じデータになる。
+"""
+import math
+import random
+import polyline
+import generate_mesh
+import otp_stub
+from geometry_store import merge_geometry
+
+CENTER_LAT = 38.43  # 合成する領域の中心（東根市付近）
+CENTER_LON = 140.39
+KM_PER_DEG_LAT = 111.0
+
+
+def region_bounds(size_km: float, center_lat: float = CENTER_LAT, center_lon: float = CENTER_LON) -> tuple:
+    """中心と一辺[km]から (南端緯度, 西端経度, 北端緯度, 東端経度) を返す"""
+    half_lat = size_km / 2 / KM_PER_DEG_LAT
+    half_lon = half_lat / math.cos(math.radians(center_lat))
+    return center_lat - half_lat, center_lon - half_lon, center_lat + half_lat, center_lon + half_lon
+
+
+def make_points(count: int, prefix: str, size_km: float, seed: int = 0) -> list[dict]:
+    """領域内に一様に散らばった地点（スポット・バス停・参照点と同じ形式）を作る"""
+    rng = random.Random(f"{prefix}-{seed}")
+    south, west, north, east = region_bounds(size_km)
+    return [
+        {
+            "id": f"{prefix}{i}",
+            "name": f"{prefix}{i}",
+            "lat": rng.uniform(south, north),
+            "lon": rng.uniform(west, east),
+        }
+        for i in range(count)
+    ]
+
+
+def make_mesh_features(size_km: float, seed: int = 0) -> list[dict]:
+    """領域を覆う5次メッシュを mesh.json の "mesh" と同じ形式で作る"""
+    rng = random.Random(seed)
+    south, west, north, east = region_bounds(size_km)
+    row0, col0 = generate_mesh.latlon_to_mesh_cell(south, west)
+    row1, col1 = generate_mesh.latlon_to_mesh_cell(north, east)
+    features = []
+    for row in range(row0, row1 + 1):
+        for col in range(col0, col1 + 1):
+            code = generate_mesh.mesh_cell_to_mesh250m(row, col)
+            _, _, _, _, ring = generate_mesh.mesh250m_to_polygon(code)
+            features.append(
+                {
+                    "mesh_code": code,
+                    "population": rng.randint(1, 100),
+                    "geometry": {"type": "Polygon", "coordinates": [ring]},
+                }
+            )
+    return features
+
+
+def make_isochrone(spot: dict, time_limits: list, walk_distance_limit: int) -> dict:
+    """OTPの到達圏探索と同じ形式のレスポンスを作る"""
+    return otp_stub.synthetic_isochrone(
+        {
+            "fromPlace": f"{spot['lat']},{spot['lon']}",
+            "maxWalkDistance": walk_distance_limit,
+            "cutoffSec": list(time_limits),
+        }
+    )
+
+
+def make_polyline(start: dict, end: dict, vertices: int, rng: random.Random) -> str:
+    """2点間を揺らぎのある折れ線で結んだGoogle Polyline"""
+    coords = []
+    for i in range(vertices):
+        t = i / (vertices - 1)
+        coords.append(
+            (
+                start["lat"] + (end["lat"] - start["lat"]) * t + rng.uniform(-1e-4, 1e-4),
+                start["lon"] + (end["lon"] - start["lon"]) * t + rng.uniform(-1e-4, 1e-4),
+            )
+        )
+    return polyline.encode(coords)
+
+
+def make_routes(
+    from_points: list[dict],
+    to_points: list[dict],
+    seed: int = 0,
+    legs: int = 3,
+    vertices_per_leg: int = 30,
+) -> list[dict]:
+    """ptrans_search の出力と同じ形式の経路を全組み合わせについて作る"""
+    rng = random.Random(seed)
+    routes = []
+    for start in from_points:
+        for end in to_points:
+            sections = []
+            for i in range(legs):
+                a = {k: start[k] + (end[k] - start[k]) * i / legs for k in ("lat", "lon")}
+                b = {k: start[k] + (end[k] - start[k]) * (i + 1) / legs for k in ("lat", "lon")}
+                sections.append(
+                    {
+                        "mode": "BUS" if i % 2 else "WALK",
+                        "from": {"name": "", **a},
+                        "to": {"name": "", **b},
+                        "duration_m": rng.randint(1, 30),
+                        "distance_m": rng.randint(100, 5000),
+                        "geometry": make_polyline(a, b, vertices_per_leg, rng),
+                    }
+                )
+            routes.append(
+                {
+                    "from": start["id"],
+                    "to": end["id"],
+                    "duration_m": sum(s["duration_m"] for s in sections),
+                    "walk_distance_m": sum(
+                        s["distance_m"] for s in sections if s["mode"] == "WALK"
+                    ),
+                    "geometry": merge_geometry([s["geometry"] for s in sections]),
+                    "sections": sections,
+                }
+            )
+    return routes
+
+
+def write_osm_grid(path: str, size_km: float, spacing_m: float = 200, seed: int = 0):
+    """
+    領域を格子状の道路で覆った .osm（XML）を書き出す。
+    4本に1本を幹線道路（primary）とし、一部の道路は一方通行にする。
+    """
+    rng = random.Random(seed)
+    south, west, north, east = region_bounds(size_km)
+    n_rows = max(2, int(size_km * 1000 / spacing_m) + 1)
+    n_cols = n_rows
+    lats = [south + (north - south) * i / (n_rows - 1) for i in range(n_rows)]
+    lons = [west + (east - west) * j / (n_cols - 1) for j in range(n_cols)]
+
+    def node_id(i: int, j: int) -> int:
+        return i * n_cols + j + 1
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("<?xml version='1.0' encoding='UTF-8'?>\n<osm version=\"0.6\">\n")
+        for i, lat in enumerate(lats):
+            for j, lon in enumerate(lons):
+                # 少し揺らして完全な格子にしない
+                f.write(
+                    f'  <node id="{node_id(i, j)}" lat="{lat + rng.uniform(-2e-5, 2e-5):.7f}" '
+                    f'lon="{lon + rng.uniform(-2e-5, 2e-5):.7f}"/>\n'
+                )
+        way_id = 1
+        lines = [[(i, j) for j in range(n_cols)] for i in range(n_rows)]
+        lines += [[(i, j) for i in range(n_rows)] for j in range(n_cols)]
+        for k, line in enumerate(lines):
+            highway = "primary" if k % 4 == 0 else "residential"
+            f.write(f'  <way id="{way_id}">\n')
+            for i, j in line:
+                f.write(f'    <nd ref="{node_id(i, j)}"/>\n')
+            f.write(f'    <tag k="highway" v="{highway}"/>\n')
+            if k % 7 == 3:
+                f.write('    <tag k="oneway" v="yes"/>\n')
+            f.write("  </way>\n")
+            way_id += 1
+        f.write("</osm>\n")
@@ -0,0 +1,106 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+from shapely.geometry import shape, box, Polygon, MultiPolygon
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import area_search  # noqa: E402
+import synthetic_region  # noqa: E402
+
+REGION_SIZE_KM = 20
+
+
+@pytest.fixture(scope="module")
+def mesh_indexes():
+    meshes = [area_search.Mesh(f) for f in synthetic_region.make_mesh_features(REGION_SIZE_KM)]
+    return area_search.MeshIndex(meshes), area_search.RasterMeshIndex(meshes)
+
+
+def irregular_geometries(center, seed: int = 0) -> list:
+    """半径の揺らいだ多角形（穴あり）と、離れた矩形からなるMultiPolygonを大きさを変えて作る"""
+    rng = np.random.default_rng(seed)
+    geometries = []
+    for radius_km in (0.3, 1, 3, 8):
+        angles = np.sort(rng.uniform(0, 2 * np.pi, 200))
+        radii = radius_km * rng.uniform(0.5, 1.0, 200)
+        exterior = np.column_stack(
+            [center.x + radii / 91 * np.cos(angles), center.y + radii / 111 * np.sin(angles)]
+        )
+        hole_angles = np.linspace(0, 2 * np.pi, 30)[:-1]
+        hole = np.column_stack(
+            [center.x + 0.2 * radius_km / 91 * np.cos(hole_angles),
+             center.y + 0.2 * radius_km / 111 * np.sin(hole_angles)]
+        )
+        island = box(center.x + 1.2 * radius_km / 91, center.y,
+                     center.x + 1.5 * radius_km / 91, center.y + 0.3 * radius_km / 111)
+        geometries.append(MultiPolygon([Polygon(exterior, [hole]), island]))
+    return geometries
+
+
+def test_raster_index_matches_polygon_index(mesh_indexes):
+    polygon_index, raster_index = mesh_indexes
+    center = polygon_index.mesh_list[len(polygon_index.mesh_list) // 2].geometry.centroid
+    geometries = irregular_geometries(center)
+    # 地域の端からはみ出す形状
+    geometries.append(box(*polygon_index.mesh_list[0].geometry.buffer(0.01).bounds))
+    for spot in synthetic_region.make_points(5, "spot", REGION_SIZE_KM):
+        isochrone = synthetic_region.make_isochrone(spot, area_search.make_time_limits()[::6], 1000)
+        geometries += [shape(feature["geometry"]) for feature in isochrone["features"]]
+
+    for geometry in geometries:
+        expected = polygon_index.query(geometry)
+        np.testing.assert_array_equal(raster_index.query(geometry), expected)
+        bbox = polygon_index.query_bbox(geometry)
+        np.testing.assert_array_equal(raster_index.query_bbox(geometry), bbox)
+        np.testing.assert_array_equal(raster_index.query(geometry, bbox), expected)
+
+
+def test_calc_first_reachable_times_is_the_same_for_both_indexes(mesh_indexes):
+    polygon_index, raster_index = mesh_indexes
+    time_limits = area_search.make_time_limits()
+    spot = synthetic_region.make_points(1, "spot", REGION_SIZE_KM)[0]
+    walk_geojson_lists = []
+    for walk_distance_m in (200, 1000):
+        response = synthetic_region.make_isochrone(spot, time_limits, walk_distance_m)
+        walk_geojson_lists.append(
+            area_search.parse_isochrone(response, time_limits, spot["id"], walk_distance_m)
+        )
+    np.testing.assert_array_equal(
+        area_search.calc_first_reachable_times(walk_geojson_lists, time_limits, raster_index),
+        area_search.calc_first_reachable_times(walk_geojson_lists, time_limits, polygon_index),
+    )
+
+
+def naive_first_reachable_times(walk_geojson_lists, time_limits, mesh_index) -> np.ndarray:
+    """到達圏ごとにすべてのメッシュとの交差を判定し、到達できる最小の時間区分をとる"""
+    time_to_index = {time_limit // 60: i for i, time_limit in enumerate(time_limits)}
+    first_times = np.full(
+        (len(walk_geojson_lists), len(mesh_index.mesh_codes)), area_search.UNREACHABLE, dtype=np.uint8
+    )
+    for walk_index, geojson_list in enumerate(walk_geojson_lists):
+        for geojson in geojson_list:
+            reachable = mesh_index.query(shape(geojson.geometry))
+            time_index = time_to_index[geojson.time_limit_min]
+            first_times[walk_index, reachable] = np.minimum(first_times[walk_index, reachable], time_index)
+    return first_times
+
+
+def test_calc_first_reachable_times_matches_naive_evaluator(mesh_indexes):
+    time_limits = area_search.make_time_limits()
+    for spot in synthetic_region.make_points(3, "spot", REGION_SIZE_KM, seed=1):
+        walk_geojson_lists = []
+        for walk_distance_m in (200, 500, 1000):
+            response = synthetic_region.make_isochrone(spot, time_limits, walk_distance_m)
+            walk_geojson_lists.append(
+                area_search.parse_isochrone(response, time_limits, spot["id"], walk_distance_m)
+            )
+        for mesh_index in mesh_indexes:
+            expected = naive_first_reachable_times(walk_geojson_lists, time_limits, mesh_index)
+            assert (expected < area_search.UNREACHABLE).any()
+            np.testing.assert_array_equal(
+                area_search.calc_first_reachable_times(walk_geojson_lists, time_limits, mesh_index),
+                expected,
+            )
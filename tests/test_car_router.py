@@ -0,0 +1,83 @@
+import os
+import sys
+import math
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import car_router  # noqa: E402
+import synthetic_region  # noqa: E402
+
+
+def reference_shortest_times(graph: car_router.CarGraph, source: int) -> np.ndarray:
+    """ダイクストラ法とは独立に、ベルマン・フォード法で source からの最短所要時間[秒]を求める"""
+    src = np.repeat(np.arange(graph.node_count), np.diff(graph.indptr))
+    dist = np.full(graph.node_count, np.inf)
+    dist[source] = 0.0
+    for _ in range(graph.node_count):
+        candidate = dist[src] + graph.time_s
+        updated = dist.copy()
+        np.minimum.at(updated, graph.indices, candidate)
+        if np.array_equal(updated, dist):
+            break
+        dist = updated
+    return dist
+
+
+def hand_checked_graph():
+    """
+    A→B→C→D→A の一方通行の環と、遠回りな A→C からなる小さなグラフ。
+    (グラフ, バス停, route_all_pairs で期待する (所要時間[分], 距離[km]) のリスト) を返す
+    """
+    lat = [36.0, 36.0, 36.01, 36.01]
+    lon = [137.0, 137.01, 137.01, 137.0]
+    src = [0, 1, 0, 2, 3]
+    dst = [1, 2, 2, 3, 0]
+    time_s = [60.0, 60.0, 300.0, 30.0, 10.0]
+    length_m = [t * 10 for t in time_s]
+    stops = [{"id": name, "lat": la, "lon": lo} for name, la, lo in zip("ABCD", lat, lon)]
+    # 手計算した最短所要時間[秒]（行: 出発, 列: 到着）
+    times = [
+        [0, 60, 120, 150],
+        [100, 0, 60, 90],
+        [40, 100, 0, 30],
+        [10, 70, 130, 0],
+    ]
+    expected = [
+        (times[i][j] / 60, times[i][j] * 10 / 1000)
+        for i in range(4)
+        for j in range(4)
+        if i != j
+    ]
+    return car_router.CarGraph(lat, lon, src, dst, length_m, time_s), stops, expected
+
+
+def test_route_all_pairs_on_hand_checked_graph():
+    graph, stops, expected = hand_checked_graph()
+    results = car_router.route_all_pairs(graph, stops)
+    assert len(results) == len(expected)
+    for (duration_m, distance_km, _), (want_duration_m, want_distance_km) in zip(results, expected):
+        assert math.isclose(duration_m, want_duration_m)
+        assert math.isclose(distance_km, want_distance_km)
+
+
+@pytest.fixture(scope="module")
+def grid_graph(tmp_path_factory):
+    osm_path = str(tmp_path_factory.mktemp("osm") / "grid.osm")
+    synthetic_region.write_osm_grid(osm_path, size_km=3)
+    return car_router.CarGraph.from_osm(osm_path)
+
+
+def test_dijkstra_matches_bellman_ford_on_grid(grid_graph):
+    graph = grid_graph
+    rng = np.random.default_rng(0)
+    for source in rng.choice(graph.node_count, size=5, replace=False).tolist():
+        dist, pred_edge = graph.shortest_path_tree(source, set(range(graph.node_count)))
+        reference = reference_shortest_times(graph, source)
+        np.testing.assert_allclose(np.array(dist), reference, rtol=1e-9, atol=1e-6)
+        # 最短経路木をたどった経路の所要時間の合計が最短所要時間と一致する
+        for target in np.flatnonzero(np.isfinite(reference))[:50].tolist():
+            path_time = float(graph.time_s[graph.path_edges(pred_edge, target)].sum())
+            assert math.isclose(path_time, dist[target], rel_tol=1e-9, abs_tol=1e-6)
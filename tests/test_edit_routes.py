@@ -0,0 +1,55 @@
+import os
+import sys
+import csv
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import edit_routes  # noqa: E402
+from route_store import RouteStore  # noqa: E402
+
+
+def route(from_id, to_id, duration_m, walk_distance_m=None):
+    return {
+        "from": from_id,
+        "to": to_id,
+        "duration_m": duration_m,
+        "walk_distance_m": walk_distance_m,
+        "geometry": "" if walk_distance_m is None else "_p~iF~ps|U_ulLnnqC",
+        "sections": [],
+    }
+
+
+def write_routes(tmp_path, key, routes):
+    path = str(tmp_path / f"{key}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({key: routes}, f)
+    return path
+
+
+def test_duration_only_routes_stay_in_all_routes_csv(tmp_path):
+    spot_to_refpoints = write_routes(tmp_path, "spot_to_refpoints", [route("s1", "r1", 42)])
+    spot_to_stops = write_routes(tmp_path, "spot_to_stops", [route("s1", "b1", 7, 350)])
+    stop_to_refpoints = write_routes(tmp_path, "stop_to_refpoints", [route("b1", "r1", 30)])
+    all_routes_path = str(tmp_path / "all_routes.csv")
+    route_store_path = str(tmp_path / "routes.bin")
+
+    edit_routes.main(
+        spot_to_refpoints, spot_to_stops, stop_to_refpoints, all_routes_path, route_store_path
+    )
+
+    with open(all_routes_path, encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert [(r["from"], r["to"], r["duration_m"], r["walk_distance_m"]) for r in rows] == [
+        ("s1", "r1", "42", ""),
+        ("s1", "b1", "7", "350"),
+        ("b1", "r1", "30", ""),
+    ]
+
+    with RouteStore(route_store_path) as store:
+        assert len(store) == 3
+        assert store.get("s1", "b1") == route("s1", "b1", 7, 350)
+
+    matrices = edit_routes.load_route_matrices(all_routes_path)
+    i, j = matrices["from_index"]["s1"], matrices["to_index"]["r1"]
+    assert matrices["duration_m"][i, j] == 42
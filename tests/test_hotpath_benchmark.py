@@ -0,0 +1,35 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import hotpath_benchmark  # noqa: E402
+
+
+def run_main(monkeypatch, *args) -> int:
+    argv = ["hotpath_benchmark.py", "--scales", "town", "--benchmarks", "reachability_update",
+            "--repeat", "1", *args]
+    monkeypatch.setattr(sys, "argv", argv)
+    return hotpath_benchmark.main()
+
+
+def test_missing_baseline_fails_only_when_required(tmp_path, monkeypatch):
+    paths = ["--baseline", str(tmp_path / "baseline.json"), "--output", str(tmp_path / "latest.json")]
+    assert run_main(monkeypatch, *paths) == 0
+    assert run_main(monkeypatch, *paths, "--require-baseline") == 2
+
+
+def test_regression_against_baseline_fails(tmp_path, monkeypatch):
+    baseline_path = tmp_path / "baseline.json"
+    paths = ["--baseline", str(baseline_path), "--output", str(tmp_path / "latest.json")]
+    assert run_main(monkeypatch, *paths, "--update-baseline") == 0
+
+    # ベースラインを大幅に速くして、現在の結果が退行として検出されることを確かめる
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    for result in baseline["results"].values():
+        result["seconds"] /= 100
+    with open(baseline_path, "w", encoding="utf-8") as f:
+        json.dump(baseline, f)
+    assert run_main(monkeypatch, *paths, "--require-baseline") == 1
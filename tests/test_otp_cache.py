@@ -0,0 +1,107 @@
+import os
+import sys
+import subprocess
+
+SOARING_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring")
+sys.path.insert(0, SOARING_DIR)
+
+import otp_cache  # noqa: E402
+
+WRITER_SCRIPT = """
+import sys
+import otp_cache
+cache = otp_cache.OtpCache(sys.argv[1], sys.argv[2])
+for i in range(300):
+    params = {"fromPlace": f"{i},{sys.argv[3]}", "toPlace": "0,0"}
+    cache.put("plan", params, {"plan": {"i": i}})
+    cache.get("plan", params)
+cache.close()
+"""
+
+
+def test_concurrent_writer_processes_share_one_file(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    graph_dir = str(tmp_path / "graph")
+    env = {**os.environ, "PYTHONPATH": SOARING_DIR}
+    writers = [
+        subprocess.Popen(
+            [sys.executable, "-c", WRITER_SCRIPT, cache_path, graph_dir, str(n)], env=env
+        )
+        for n in range(3)
+    ]
+    assert [writer.wait(timeout=120) for writer in writers] == [0, 0, 0]
+
+    cache = otp_cache.OtpCache(cache_path, graph_dir)
+    assert cache.count() == 900
+    cache.close()
+
+
+def test_put_is_visible_to_other_connections_immediately(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    cache = otp_cache.OtpCache(cache_path, str(tmp_path / "graph"))
+    cache.put("plan", {"fromPlace": "1,2", "toPlace": "3,4"}, {"plan": {}})
+
+    # 書き込みロックを持ったままでなければ、別の接続から書き込める
+    other = otp_cache.OtpCache(cache_path, str(tmp_path / "graph"))
+    assert other.get("plan", {"fromPlace": "1,2", "toPlace": "3,4"}) == {"plan": {}}
+    other.put("plan", {"fromPlace": "5,6", "toPlace": "7,8"}, {"plan": {}})
+    assert cache.count() == 2
+    other.close()
+    cache.close()
+
+
+def test_graph_identity_ignores_non_graph_inputs(tmp_path):
+    (tmp_path / "region-latest.osm.pbf").write_bytes(b"osm")
+    (tmp_path / "gtfs.zip").write_bytes(b"gtfs")
+    graph_id = otp_cache.graph_identity(str(tmp_path))
+
+    (tmp_path / "tblT001102Q06.txt").write_text("population")
+    (tmp_path / "target_region.json").write_text("{}")
+    assert otp_cache.graph_identity(str(tmp_path)) == graph_id
+
+    (tmp_path / "Graph.obj").write_bytes(b"graph")
+    assert otp_cache.graph_identity(str(tmp_path)) != graph_id
+
+
+def test_key_rounds_places_to_cache_precision():
+    params = {"fromPlace": "38.1234561,140.1234564", "toPlace": "38.5,140.5", "mode": "CAR"}
+    same = {"toPlace": "38.500000,140.500000", "mode": "CAR", "fromPlace": "38.12345614,140.1234559"}
+    assert otp_cache.make_key("plan", params) == otp_cache.make_key("plan", same)
+    moved = dict(params, fromPlace="38.123457,140.123456")
+    assert otp_cache.make_key("plan", params) != otp_cache.make_key("plan", moved)
+    assert otp_cache.make_key("plan", params) != otp_cache.make_key("plan", dict(params, mode="WALK"))
+    assert otp_cache.make_key("plan", params) != otp_cache.make_key("isochrone", params)
+
+
+def test_entries_of_another_graph_are_purged(tmp_path):
+    cache_path = str(tmp_path / "cache.sqlite3")
+    graph_dir = tmp_path / "graph"
+    graph_dir.mkdir()
+    (graph_dir / "region.osm.pbf").write_bytes(b"osm")
+    params = {"fromPlace": "1,2", "toPlace": "3,4"}
+    cache = otp_cache.OtpCache(cache_path, str(graph_dir))
+    cache.put("plan", params, {"plan": {}})
+    cache.close()
+
+    (graph_dir / "region.osm.pbf").write_bytes(b"updated osm")
+    cache = otp_cache.OtpCache(cache_path, str(graph_dir))
+    assert cache.purged_on_open == 1
+    assert cache.get("plan", params) is None
+    assert cache.count() == 0
+    cache.close()
+
+
+def test_transient_errors_are_not_cached(tmp_path):
+    cache = otp_cache.OtpCache(str(tmp_path / "cache.sqlite3"), str(tmp_path / "graph"))
+    for i, error_id in enumerate(sorted(otp_cache.TRANSIENT_ERROR_IDS)):
+        params = {"fromPlace": f"{i},0", "toPlace": "0,0"}
+        cache.put("plan", params, {"error": {"id": error_id, "msg": "transient"}})
+        assert cache.get("plan", params) is None
+    cache.put("plan", {"fromPlace": "9,0", "toPlace": "0,0"}, {"error": "not a dict"})
+
+    # 経路が見つからないなどの決まった結果は保存する
+    not_found = {"error": {"id": 404, "msg": "PATH_NOT_FOUND"}}
+    cache.put("plan", {"fromPlace": "1,1", "toPlace": "0,0"}, not_found)
+    assert cache.get("plan", {"fromPlace": "1,1", "toPlace": "0,0"}) == not_found
+    assert cache.count() == 1
+    cache.close()
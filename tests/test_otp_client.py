@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import otp_cache  # noqa: E402
+import otp_client  # noqa: E402
+import otp_stub  # noqa: E402
+
+PLAN_PARAMS = {"fromPlace": "38.25,140.88", "toPlace": "38.3,140.9", "mode": "WALK,TRANSIT"}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(otp_client, "BACKOFF_BASE_S", 0.0)
+
+
+@pytest.fixture
+def start_stub():
+    servers = []
+
+    def start(**options):
+        server = otp_stub.start_stub(**options)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_retries_transient_errors(start_stub):
+    server = start_stub(error_rate=0.5, error_status=[503], seed=0)
+    client = otp_client.OtpClient(server.base_url, max_retries=10)
+    results = [client.plan(PLAN_PARAMS, use_cache=False) for _ in range(20)]
+    assert all(result.ok for result in results)
+    assert server.error_count > 0
+    # 失敗した試行の分だけ余分に問い合わせる
+    assert sum(result.attempts for result in results) == server.request_count
+    assert client.request_count == server.request_count
+    assert client.failure_count == server.error_count
+
+
+def test_gives_up_after_max_retries(start_stub):
+    server = start_stub(error_rate=1.0, error_status=[503])
+    client = otp_client.OtpClient(server.base_url, max_retries=2)
+    result = client.plan(PLAN_PARAMS, use_cache=False)
+    assert not result.ok
+    assert (result.status, result.error, result.attempts) == (503, "HTTP 503", 3)
+    assert server.request_count == 3
+
+
+def test_does_not_retry_client_errors(start_stub):
+    server = start_stub(error_rate=1.0, error_status=[400])
+    client = otp_client.OtpClient(server.base_url, max_retries=5)
+    result = client.plan(PLAN_PARAMS, use_cache=False)
+    assert (result.status, result.attempts) == (400, 1)
+    assert server.request_count == 1
+
+
+def test_connection_errors_are_retried():
+    server = otp_stub.start_stub()
+    base_url = server.base_url
+    server.shutdown()
+    server.server_close()
+    client = otp_client.OtpClient(base_url, max_retries=2)
+    result = client.plan(PLAN_PARAMS, use_cache=False)
+    assert not result.ok
+    assert result.error.startswith("ConnectionError")
+    assert result.attempts == 3
+
+
+def test_plan_caches_successful_responses(start_stub, tmp_path, monkeypatch):
+    monkeypatch.setenv("OTP_CACHE_PATH", str(tmp_path / "cache.sqlite3"))
+    monkeypatch.setenv("OTP_GRAPH_DIR", str(tmp_path / "graph"))
+    monkeypatch.delenv("OTP_CACHE_DISABLE", raising=False)
+    monkeypatch.setattr(otp_cache, "_default_cache", None)
+    server = start_stub()
+    client = otp_client.OtpClient(server.base_url)
+    try:
+        first = client.plan(PLAN_PARAMS)
+        second = client.plan(PLAN_PARAMS)
+    finally:
+        otp_cache.close_cache()
+    assert first.ok and second.ok
+    assert second.data == first.data
+    assert server.request_count == 1
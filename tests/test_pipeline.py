@@ -0,0 +1,105 @@
+import os
+import sys
+import csv
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import otp_stub  # noqa: E402
+import pipeline  # noqa: E402
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+
+
+def test_search_stages_share_the_otp_cache(tmp_path):
+    stages = {stage.name: stage for stage in pipeline.build_stages("test", str(tmp_path))}
+    car_cache = stages["car-search"].env["OTP_CACHE_PATH"]
+    ptrans_cache = stages["ptrans-search"].env["OTP_CACHE_PATH"]
+    assert car_cache == ptrans_cache == os.path.join(str(tmp_path), "cache", "otp_cache.sqlite3")
+
+
+def test_ptrans_search_stage_writes_routes(tmp_path, monkeypatch):
+    work_dir = str(tmp_path)
+    archive = os.path.join(work_dir, "output", "archive")
+    write_json(
+        os.path.join(archive, "spot_list.json"),
+        {"spots": [{"id": "s1", "lat": 38.43, "lon": 140.39},
+                   {"id": "s2", "lat": 38.44, "lon": 140.40}]},
+    )
+    write_json(
+        os.path.join(archive, "combus_stops.json"),
+        {"combus-stops": [{"id": "b1", "lat": 38.435, "lon": 140.395}]},
+    )
+    write_json(
+        os.path.join(archive, "ref_points.json"),
+        {"ref-points": [{"id": "r1", "lat": 38.45, "lon": 140.41}]},
+    )
+
+    server = otp_stub.start_stub()
+    monkeypatch.setenv("OTP_BASE_URL", server.base_url)
+    try:
+        stages = pipeline.build_stages("test", work_dir)
+        stage = next(s for s in stages if s.name == "ptrans-search")
+        # 依存ステージの出力は上で用意したので、このステージのコマンドだけを実行する
+        pipeline.run_stage(stage)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert stage.outputs_exist()
+    assert os.path.exists(stage.env["OTP_CACHE_PATH"])
+    for key, count in [("spot_to_stops", 2), ("spot_to_refpoints", 2), ("stop_to_refpoints", 1)]:
+        with open(os.path.join(work_dir, "output", f"{key}.json"), encoding="utf-8") as f:
+            assert len(json.load(f)[key]) == count
+    with open(os.path.join(archive, "all_routes.csv"), encoding="utf-8") as f:
+        assert len(list(csv.reader(f))) > 1
+
+
+def test_area_search_and_archive_stages_package_the_geojson_archive(tmp_path, monkeypatch):
+    import zipfile
+    import synthetic_region
+    from geojson_archive import GeojsonArchive
+
+    work_dir = str(tmp_path)
+    archive = os.path.join(work_dir, "output", "archive")
+    write_json(
+        os.path.join(archive, "spot_list.json"),
+        {"spots": synthetic_region.make_points(1, "spot", size_km=2)},
+    )
+    write_json(
+        os.path.join(archive, "combus_stops.json"),
+        {"combus-stops": synthetic_region.make_points(1, "stop", size_km=2, seed=1)},
+    )
+    write_json(
+        os.path.join(archive, "mesh.json"),
+        {"mesh": synthetic_region.make_mesh_features(size_km=2)},
+    )
+    # 以前の個別ファイル出力が残っていても、アーカイブには含めない
+    os.makedirs(os.path.join(archive, "geojson"))
+    with open(os.path.join(archive, "all_geojsons.txt"), "w") as f:
+        f.write("old\n")
+
+    server = otp_stub.start_stub()
+    monkeypatch.setenv("OTP_BASE_URL", server.base_url)
+    try:
+        stages = {stage.name: stage for stage in pipeline.build_stages("test", work_dir)}
+        pipeline.run_stage(stages["area-search"])
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert stages["area-search"].outputs_exist()
+    assert not os.path.exists(os.path.join(archive, "geojson"))
+    assert not os.path.exists(os.path.join(archive, "all_geojsons.txt"))
+    with GeojsonArchive(os.path.join(archive, "geojsons.bin")) as geojsons:
+        assert len(geojsons) > 0
+
+    pipeline.run_stage(stages["archive"])
+    with zipfile.ZipFile(os.path.join(work_dir, "output", "archive.zip")) as zf:
+        names = zf.namelist()
+    assert "geojsons.bin" in names
+    assert not any(name.startswith("geojson/") or name == "all_geojsons.txt" for name in names)
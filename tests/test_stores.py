@@ -0,0 +1,170 @@
+import os
+import sys
+
+import numpy as np
+import polyline
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "soaring"))
+
+import record_store  # noqa: E402
+import route_store  # noqa: E402
+import geometry_store  # noqa: E402
+import reachability_index  # noqa: E402
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_record_store_round_trip(tmp_path, compress):
+    path = str(tmp_path / "records.bin")
+    records = {f"key{i}": os.urandom(i * 7) for i in range(50)}
+    with record_store.RecordStoreWriter(path, compress=compress) as writer:
+        for key, data in records.items():
+            writer.add(key, data)
+
+    with record_store.RecordStore(path) as store:
+        assert len(store) == len(records)
+        assert set(store.keys()) == set(records)
+        for key, data in records.items():
+            assert store.get_bytes(key) == data
+        keys = ["key3", "missing", "key1"]
+        assert store.get_many_bytes(keys) == [records["key3"], None, records["key1"]]
+        with pytest.raises(KeyError):
+            store.get_bytes("missing")
+
+
+def test_record_store_duplicates(tmp_path):
+    path = str(tmp_path / "records.bin")
+    with record_store.RecordStoreWriter(path) as writer:
+        writer.add("a", b"1")
+        with pytest.raises(KeyError):
+            writer.add("a", b"2")
+
+    path = str(tmp_path / "duplicates.bin")
+    with record_store.RecordStoreWriter(path, allow_duplicates=True) as writer:
+        writer.add("a", b"1")
+        writer.add("a", b"2")
+    with record_store.RecordStore(path) as store:
+        assert len(store) == 1
+        assert store.get_bytes("a") == b"2"
+
+
+def test_record_store_writer_aborts_on_error(tmp_path):
+    path = tmp_path / "records.bin"
+    with record_store.RecordStoreWriter(str(path)) as writer:
+        writer.add("a", b"old")
+
+    with pytest.raises(RuntimeError):
+        with record_store.RecordStoreWriter(str(path)) as writer:
+            writer.add("a", b"new")
+            raise RuntimeError
+    # 既存のファイルは残り、一時ファイルは消える
+    assert os.listdir(tmp_path) == ["records.bin"]
+    with record_store.RecordStore(str(path)) as store:
+        assert store.get_bytes("a") == b"old"
+
+
+def make_route(from_id: str, to_id: str, points: list) -> dict:
+    sections = [
+        {"mode": "WALK", "geometry": polyline.encode(points[:2])},
+        {"mode": "BUS", "geometry": polyline.encode(points[1:])},
+    ]
+    return {
+        "from": from_id,
+        "to": to_id,
+        "duration_s": 600,
+        "geometry": geometry_store.merge_geometry([s["geometry"] for s in sections]),
+        "sections": sections,
+    }
+
+
+def test_route_store_round_trip_with_geometry_store(tmp_path):
+    route_path = str(tmp_path / "routes.bin")
+    geometry_path = str(tmp_path / "geometries.bin")
+    shared = [(38.25, 140.88), (38.26, 140.89)]
+    routes = [
+        make_route("s1", "b1", shared + [(38.27, 140.9)]),
+        make_route("s2", "b1", shared + [(38.28, 140.91)]),
+        {"from": "s3", "to": "b1", "duration_s": 900, "geometry": "", "sections": []},
+    ]
+    with geometry_store.GeometryStoreWriter(geometry_path) as geometries, \
+            route_store.RouteStoreWriter(route_path) as writer:
+        for route in routes:
+            writer.add(geometries.dedupe_route(route))
+        # 共通の徒歩区間は一度だけ格納する
+        assert geometries.total_count == 4
+    with geometry_store.GeometryStore(geometry_path) as geometries:
+        assert len(geometries) == 3
+
+    with route_store.RouteStore(route_path, geometry_path) as store:
+        assert len(store) == 3
+        assert ("s1", "b1") in store and ("b1", "s1") not in store
+        assert store.get("s1", "b1") == routes[0]
+        assert store.get_many([("s3", "b1"), ("s9", "b1"), ("s2", "b1")]) == [
+            routes[2], None, routes[1]
+        ]
+
+    # ジオメトリストアを指定しなければ geometry_id のまま読み出す
+    with route_store.RouteStore(route_path) as store:
+        route = store.get("s1", "b1")
+        assert "geometry" not in route
+        assert all("geometry_id" in section for section in route["sections"])
+
+
+def test_route_store_keeps_last_route_of_a_pair(tmp_path):
+    path = str(tmp_path / "routes.bin")
+    with route_store.RouteStoreWriter(path) as writer:
+        writer.add({"from": "s1", "to": "b1", "duration_s": 1})
+        writer.add({"from": "s1", "to": "b1", "duration_s": 2})
+    with route_store.RouteStore(path) as store:
+        assert store.get("s1", "b1")["duration_s"] == 2
+
+
+def test_geometry_store_rejects_inconsistent_route(tmp_path):
+    route = make_route("s1", "b1", [(38.25, 140.88), (38.26, 140.89), (38.27, 140.9)])
+    route["geometry"] = polyline.encode([(0, 0), (1, 1)])
+    with pytest.raises(ValueError):
+        with geometry_store.GeometryStoreWriter(str(tmp_path / "geometries.bin")) as writer:
+            writer.dedupe_route(route)
+    assert os.listdir(tmp_path) == []
+
+
+def test_reachability_index_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    spot_ids = [f"spot{i}" for i in range(11)]  # 8の倍数でないスポット数
+    mesh_codes = [str(5740_0000 + i) for i in range(200)]
+    time_limits_min = [10, 20, 30, 40]
+    walk_distances_m = [200, 500, 1000]
+    unreachable = len(time_limits_min)
+    first_times = rng.integers(0, unreachable + 1, (len(spot_ids), len(walk_distances_m), len(mesh_codes)))
+    first_times = first_times.astype(np.uint8)
+    first_times[:, :, :20] = unreachable  # どのスポットからも到達できないメッシュ
+
+    path = str(tmp_path / "reachability.bin")
+    count = reachability_index.write_reachability_index(
+        first_times, spot_ids, mesh_codes, time_limits_min, walk_distances_m, path
+    )
+    assert count == len(mesh_codes) - 20
+
+    with reachability_index.ReachabilityIndex(path) as index:
+        assert len(index) == count
+        assert index.spot_ids == spot_ids
+        assert mesh_codes[0] not in index and mesh_codes[-1] in index
+        assert reachability_index.META_KEY not in index
+        for walk_index, walk_distance_m in enumerate(walk_distances_m):
+            for time_index, time_limit_min in enumerate(time_limits_min):
+                for mesh_index in range(0, len(mesh_codes), 7):
+                    expected = first_times[:, walk_index, mesh_index] <= time_index
+                    mask = index.spot_mask(mesh_codes[mesh_index], time_limit_min, walk_distance_m)
+                    np.testing.assert_array_equal(mask, expected)
+        # 区分の間の値はそれ以下で最大の区分として扱い、どの区分にも満たなければ到達不可
+        mesh_code = mesh_codes[-1]
+        np.testing.assert_array_equal(
+            index.spot_mask(mesh_code, 25, 999), index.spot_mask(mesh_code, 20, 500)
+        )
+        assert index.spots_reaching(mesh_code, 5, 1000) == []
+        assert index.spots_reaching(mesh_code, 40, 100) == []
+        expected = [id for id, t in zip(spot_ids, first_times[:, 2, -1]) if t <= 3]
+        assert index.spots_reaching(mesh_code, 40, 1000) == expected
+        assert index.reaches("spot0", mesh_code, 40, 1000) == (first_times[0, 2, -1] <= 3)
+        with pytest.raises(KeyError):
+            index.reaches("unknown", mesh_code, 40, 1000)